@@ -0,0 +1,62 @@
+import datetime as dt
+import os
+import sys
+import tempfile
+import time
+
+import sqlalchemy as sql
+
+import eopsin as eop
+
+'''
+In this benchmark we compare the candle throughput of the batched `DBService.addCandles` against storing the same
+candles row by row via `DBService.addCandle` in a sqlite database file.
+
+Usage: python bulk-insert.py [number of candles]
+'''
+
+N_CANDLES = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+PERIOD_START = dt.datetime(2021, 1, 1, 0, 0, tzinfo=dt.timezone.utc)
+INTERVAL = eop.Interval.MINUTE_1
+
+
+def getCandles(exchange: eop.Exchange, pair: eop.Pair):
+    return [eop.Candle(exchange=exchange, pair=pair, interval=INTERVAL,
+                       openTime=PERIOD_START + idx * INTERVAL.timedelta(),
+                       closeTime=PERIOD_START + (idx + 1) * INTERVAL.timedelta(),
+                       open=1., high=2., low=0.5, close=1.5, volume=10., quoteAssetVolume=15., numberOfTrades=3,
+                       takerBuyBaseAssetVolume=5., takerBuyQuoteAssetVolume=7.5)
+            for idx in range(N_CANDLES)]
+
+
+def benchmark(name: str, store):
+    with tempfile.TemporaryDirectory() as directory:
+        engine = sql.create_engine(f"sqlite:///{os.path.join(directory, 'benchmark.sqlite')}", future=True)
+        dbService = eop.DBService(engine)
+        candles = getCandles(dbService.getExchange('Binance'), dbService.getPair('BTC', 'USDT'))
+
+        start = time.perf_counter()
+        store(dbService, candles)
+        duration = time.perf_counter() - start
+        engine.dispose()
+
+    print(f'{name:>10}: {N_CANDLES} candles in {duration:.2f} s ({N_CANDLES / duration:.0f} candles/s)')
+    return duration
+
+
+def storeRowWise(dbService: eop.DBService, candles):
+    for candle in candles:
+        dbService.addCandle(candle)
+
+
+def storeBatched(dbService: eop.DBService, candles):
+    inserted, skipped = dbService.addCandles(candles)
+    assert (inserted, skipped) == (len(candles), 0)
+    # A second pass only hits already stored candles
+    inserted, skipped = dbService.addCandles(candles)
+    assert (inserted, skipped) == (0, len(candles))
+
+
+rowWise = benchmark('row-wise', storeRowWise)
+batched = benchmark('batched', storeBatched)
+print(f'Speedup: {rowWise / batched:.1f}x (the batched run includes a second pass over duplicates)')
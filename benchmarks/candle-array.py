@@ -0,0 +1,54 @@
+import datetime as dt
+import sys
+import time
+import tracemalloc
+
+import sqlalchemy as sql
+
+import eopsin as eop
+
+'''
+In this benchmark we compare loading candles as candle entities via `DBService.findCandles` against loading them as a
+structured numpy array via `DBService.findCandlesArray` (time and peak python memory), for both timestamp formats.
+
+Usage: python candle-array.py [number of candles]
+'''
+
+N_CANDLES = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+PERIOD_START = dt.datetime(2021, 1, 1, 0, 0, tzinfo=dt.timezone.utc)
+INTERVAL = eop.Interval.MINUTE_1
+PERIOD_END = PERIOD_START + N_CANDLES * INTERVAL.timedelta()
+
+
+def benchmark(name: str, load):
+    start = time.perf_counter()
+    candles = load(exchange, pair, INTERVAL, PERIOD_START, PERIOD_END)
+    duration = time.perf_counter() - start
+    assert len(candles) == N_CANDLES
+    del candles
+
+    # memory is traced in a separate run, since tracing distorts the timings
+    tracemalloc.start()
+    load(exchange, pair, INTERVAL, PERIOD_START, PERIOD_END)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name:>16}: {N_CANDLES} candles in {duration:.2f} s, peak memory {peak / 2 ** 20:.1f} MiB')
+    return duration, peak
+
+
+for timestampFormat in eop.TimestampFormat:
+    print(f'{timestampFormat.name} timestamps')
+    engine = sql.create_engine("sqlite://", future=True)
+    dbService = eop.DBService(engine, timestampFormat=timestampFormat)
+    exchange = dbService.getExchange('Binance')
+    pair = dbService.getPair('BTC', 'USDT')
+    dbService.addCandles([eop.Candle(exchange=exchange, pair=pair, interval=INTERVAL,
+                                     openTime=PERIOD_START + idx * INTERVAL.timedelta(),
+                                     closeTime=PERIOD_START + (idx + 1) * INTERVAL.timedelta(),
+                                     open=1., high=2., low=0.5, close=1.5, volume=10., quoteAssetVolume=15.,
+                                     numberOfTrades=3, takerBuyBaseAssetVolume=5., takerBuyQuoteAssetVolume=7.5)
+                          for idx in range(N_CANDLES)])
+
+    ormDuration, ormPeak = benchmark('findCandles', dbService.findCandles)
+    arrayDuration, arrayPeak = benchmark('findCandlesArray', dbService.findCandlesArray)
+    print(f'Speedup: {ormDuration / arrayDuration:.1f}x, memory reduction: {ormPeak / arrayPeak:.1f}x')
@@ -0,0 +1,87 @@
+import datetime as dt
+import os
+import random
+import sys
+import tempfile
+import time
+
+import sqlalchemy as sql
+
+import eopsin as eop
+
+'''
+In this benchmark we compare range reads on a sqlite database file for the two candle table layouts, each with
+timestamps stored as datetime text and as integer epoch milliseconds. The candles of all pairs are inserted
+interleaved in time, as it happens when backfilling many pairs in parallel, such that the candles of a single pair are
+scattered over the file in the default ROWID layout.
+
+Usage: python candle-layout.py [number of candles] [number of pairs]
+'''
+
+N_CANDLES = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+N_PAIRS = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+N_QUERIES = 200
+PERIOD_START = dt.datetime(2021, 1, 1, 0, 0, tzinfo=dt.timezone.utc)
+INTERVAL = eop.Interval.MINUTE_1
+QUERY_WIDTH = dt.timedelta(days=1)
+
+
+def fill(dbService: eop.DBService, pairs):
+    exchange = dbService.getExchange('Binance')
+    insert = sql.insert(dbService.candleTable)
+    nSlots = N_CANDLES // len(pairs)
+    batch = 5000
+    for offset in range(0, nSlots, batch):
+        rows = [dict(exchange_id=exchange.id, pair_id=pair.id, interval=INTERVAL,
+                     openTime=PERIOD_START + idx * INTERVAL.timedelta(),
+                     closeTime=PERIOD_START + (idx + 1) * INTERVAL.timedelta(),
+                     open=1., high=2., low=0.5, close=1.5, volume=10., quoteAssetVolume=15., numberOfTrades=3,
+                     takerBuyBaseAssetVolume=5., takerBuyQuoteAssetVolume=7.5)
+                for idx in range(offset, min(offset + batch, nSlots)) for pair in pairs]
+        dbService.session.execute(insert, rows)
+        dbService.session.commit()
+    return nSlots
+
+
+def benchmark(layout: eop.CandleLayout, timestampFormat: eop.TimestampFormat):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'benchmark.sqlite')
+        engine = sql.create_engine(f"sqlite:///{path}", future=True)
+        dbService = eop.DBService(engine, candleLayout=layout, timestampFormat=timestampFormat)
+        pairs = [dbService.getPair(f'COIN{idx}', 'USDT') for idx in range(N_PAIRS)]
+
+        start = time.perf_counter()
+        nSlots = fill(dbService, pairs)
+        fillDuration = time.perf_counter() - start
+        size = os.path.getsize(path)
+
+        # Drop the page cache of the connection pool
+        engine.dispose()
+        dbService = eop.DBService(engine)
+        exchange = dbService.getExchange('Binance')
+        pair = dbService.getPair('COIN0', 'USDT')
+
+        random.seed(42)
+        maxOffset = nSlots * INTERVAL.timedelta() - QUERY_WIDTH
+        starts = [PERIOD_START + random.random() * maxOffset for _ in range(N_QUERIES)]
+
+        start = time.perf_counter()
+        for periodStart in starts:
+            dbService.findCandlesArray(exchange, pair, INTERVAL, periodStart, periodStart + QUERY_WIDTH)
+        readDuration = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for periodStart in starts:
+            dbService.findMissingCandlePeriods(exchange, pair, INTERVAL, periodStart, periodStart + QUERY_WIDTH)
+        missingDuration = time.perf_counter() - start
+        engine.dispose()
+
+    print(f'{layout.name:>9} {timestampFormat.name:>8}: fill {fillDuration:.1f} s, file size {size / 2 ** 20:.0f} MiB, '
+          f'range reads {readDuration / N_QUERIES * 1000:.1f} ms, '
+          f'gap checks {missingDuration / N_QUERIES * 1000:.1f} ms')
+
+
+print(f'{N_CANDLES} candles of {N_PAIRS} pairs, {N_QUERIES} random {QUERY_WIDTH} range queries')
+for layout in eop.CandleLayout:
+    for timestampFormat in eop.TimestampFormat:
+        benchmark(layout, timestampFormat)
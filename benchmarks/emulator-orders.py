@@ -0,0 +1,47 @@
+import datetime as dt
+import sys
+
+import numpy as np
+import sqlalchemy as sql
+
+import eopsin as eop
+
+'''
+In this benchmark we compare the market order throughput of the `ExchangeEmulator`, once resolving the price of every
+order through `getLastCompleteCandleBefore` on the candle store and once from the prefetched `PriceSeries`. One order
+is placed per simulated minute on stored klines, served by an `OfflineHandler`.
+
+Usage: python emulator-orders.py [number of orders]
+'''
+
+N_ORDERS = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+PERIOD_START = dt.datetime(2021, 1, 1, 0, 0, tzinfo=dt.timezone.utc)
+INTERVAL = eop.Interval.MINUTE_1
+PERIOD_END = PERIOD_START + N_ORDERS * INTERVAL.timedelta()
+
+engine = sql.create_engine("sqlite://", future=True)
+dbService = eop.DBService(engine)
+pair = dbService.getPair('BTC', 'USDT')
+offline = eop.OfflineHandler(dbService)
+candles = np.zeros(N_ORDERS + 1, dtype=eop.CANDLE_DTYPE)
+candles['openTime'] = eop.toEpochMs(PERIOD_START - INTERVAL.timedelta()) + \
+                      np.arange(N_ORDERS + 1) * INTERVAL.milliseconds()
+candles['closeTime'] = candles['openTime'] + INTERVAL.milliseconds() - 1
+candles['close'] = 1. + np.arange(N_ORDERS + 1) % 100
+dbService.addCandlesArray(offline.exchange, pair, INTERVAL, candles)
+
+
+def benchmark(name: str, prefetch: bool):
+    emulator = eop.ExchangeEmulator(offline, portfolio={'USDT': 1e9})
+    emulator.prefetchOnDemand = prefetch
+    emulator.events[INTERVAL] += lambda: emulator.placeOrder(eop.MarketOrder.newBuy(pair, 1))
+    report = emulator.backtest(PERIOD_START, PERIOD_END, tickwidth=INTERVAL.timedelta())
+    assert emulator.getAssetBalance('BTC') == N_ORDERS
+    print(f'{name:>12}: {N_ORDERS} orders in {report["simulation"]:.2f} s (+ {report["prefetch"]:.2f} s prefetch), '
+          f'{N_ORDERS / report["simulation"]:.0f} orders/s')
+    return report['simulation'] + report['prefetch']
+
+
+storeDuration = benchmark('store', prefetch=False)
+seriesDuration = benchmark('price series', prefetch=True)
+print(f'Speedup: {storeDuration / seriesDuration:.1f}x')
@@ -0,0 +1,71 @@
+import datetime as dt
+import sys
+import time
+
+import sqlalchemy as sql
+
+import eopsin as eop
+from eopsin.exchange.binance import _BinanceMixin
+
+'''
+In this benchmark we compare the ingest of raw binance kline pages into an in-memory sqlite database, once per row
+via ORM candles and `DBService.addCandles`, and once vectorized via a structured array and `DBService.addCandlesArray`.
+Parsing and inserting are timed separately for both timestamp formats.
+
+Usage: python kline-parsing.py [number of klines]
+'''
+
+N_KLINES = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+PERIOD_START = dt.datetime(2021, 1, 1, 0, 0, tzinfo=dt.timezone.utc)
+INTERVAL = eop.Interval.MINUTE_1
+PAGE_SIZE = 1000
+
+
+class KlineParser(_BinanceMixin):
+    ''' The conversions of the binance handlers without a client '''
+
+    def __init__(self, exchange: eop.Exchange):
+        self.exchange = exchange
+
+
+def getPages():
+    # same layout as the responses of the klines endpoint, numbers are transferred as strings
+    openTime = eop.toEpochMs(PERIOD_START)
+    klines = [[openTime + idx * INTERVAL.milliseconds(), '29000.12000000', '29010.00000000', '28990.00000000',
+               f'{29000 + idx % 100}.50000000', '12.34500000', openTime + (idx + 1) * INTERVAL.milliseconds() - 1,
+               '358000.12300000', idx % 1000, '6.10000000', '177000.50000000', '0'] for idx in range(N_KLINES)]
+    return [klines[idx:idx + PAGE_SIZE] for idx in range(0, N_KLINES, PAGE_SIZE)]
+
+
+def benchmark(name: str, timestampFormat: eop.TimestampFormat, parse, store):
+    engine = sql.create_engine("sqlite://", future=True)
+    dbService = eop.DBService(engine, timestampFormat=timestampFormat)
+    parser = KlineParser(dbService.getExchange('Binance'))
+    pair = dbService.getPair('BTC', 'USDT')
+    pages = getPages()
+
+    start = time.perf_counter()
+    parsed = [parse(parser, pair, page) for page in pages]
+    parsing = time.perf_counter() - start
+    for candles in parsed:
+        store(dbService, parser.exchange, pair, candles)
+    duration = time.perf_counter() - start
+
+    assert len(dbService.findCandlesArray(parser.exchange, pair, INTERVAL, PERIOD_START,
+                                          PERIOD_START + N_KLINES * INTERVAL.timedelta())) == N_KLINES
+    dbService.removeSession()
+    print(f'{name:>10} ({timestampFormat.value:>8}): {N_KLINES} klines parsed in {parsing:.2f} s, '
+          f'ingested in {duration:.2f} s, {N_KLINES / duration:.0f} klines/s')
+    return parsing, duration
+
+
+for timestampFormat in eop.TimestampFormat:
+    rowParsing, rowDuration = benchmark(
+        'row-wise', timestampFormat,
+        lambda parser, pair, page: [parser._getCandleFromData(pair, INTERVAL, row) for row in page],
+        lambda dbService, exchange, pair, candles: dbService.addCandles(candles))
+    arrayParsing, arrayDuration = benchmark(
+        'vectorized', timestampFormat,
+        lambda parser, pair, page: parser._getCandlesArrayFromData(page),
+        lambda dbService, exchange, pair, candles: dbService.addCandlesArray(exchange, pair, INTERVAL, candles))
+    print(f'Speedup: {rowParsing / arrayParsing:.1f}x parsing, {rowDuration / arrayDuration:.1f}x ingest')
@@ -0,0 +1,68 @@
+import datetime as dt
+import sys
+import time
+
+import numpy as np
+import sqlalchemy as sql
+
+import eopsin as eop
+
+'''
+In this benchmark we compare a moving average strategy on 1 minute klines run tick by tick by the `ExchangeEmulator`
+against the same strategy run by the `VectorizedBacktest` in one pass.
+
+Usage: python vectorized-backtest.py [number of minutes]
+'''
+
+N_MINUTES = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+PERIOD_START = dt.datetime(2021, 1, 1, 0, 0, tzinfo=dt.timezone.utc)
+INTERVAL = eop.Interval.MINUTE_1
+PERIOD_END = PERIOD_START + N_MINUTES * INTERVAL.timedelta()
+WINDOW = 30
+
+engine = sql.create_engine("sqlite://", future=True)
+dbService = eop.DBService(engine)
+pair = dbService.getPair('BTC', 'USDT')
+offline = eop.OfflineHandler(dbService)
+candles = np.zeros(N_MINUTES, dtype=eop.CANDLE_DTYPE)
+candles['openTime'] = eop.toEpochMs(PERIOD_START) + np.arange(N_MINUTES) * INTERVAL.milliseconds()
+candles['closeTime'] = candles['openTime'] + INTERVAL.milliseconds() - 1
+candles['close'] = 100 * np.exp(np.cumsum(np.random.default_rng(1).normal(0, 0.002, N_MINUTES)))
+dbService.addCandlesArray(offline.exchange, pair, INTERVAL, candles)
+
+
+def getTargets(closes: np.ndarray) -> np.ndarray:
+    average = np.convolve(closes, np.ones(WINDOW) / WINDOW)[:len(closes)]
+    return np.where(closes > average, 0.5, 0.)
+
+
+start = time.perf_counter()
+emulator = eop.ExchangeEmulator(offline, portfolio={'USDT': 1000.})
+closes = []
+
+
+def onCandle():
+    closes.append(emulator.getCurrentCourse(pair))
+    target = getTargets(np.array(closes[-WINDOW:]))[-1]
+    portfolio = emulator.getPortfolio()
+    asset = portfolio.get('BTC', 0.)
+    order = target * (asset * closes[-1] + portfolio['USDT']) / closes[-1] - asset
+    if order > 0:
+        emulator.placeOrder(eop.MarketOrder.newBuy(pair, order))
+    elif order < 0:
+        emulator.placeOrder(eop.MarketOrder.newSell(pair, min(-order, asset)))
+
+
+emulator.events[INTERVAL] += onCandle
+emulator.backtest(PERIOD_START, PERIOD_END, tickwidth=INTERVAL.timedelta())
+emulatorDuration = time.perf_counter() - start
+print(f'  emulator: {N_MINUTES} minutes in {emulatorDuration:.2f} s, portfolio {emulator.getPortfolio()}')
+
+start = time.perf_counter()
+array = offline.getHistoricalKlinesArray(pair, INTERVAL, PERIOD_START, PERIOD_END)
+loaded = time.perf_counter()
+result = eop.VectorizedBacktest(pair, array, {'USDT': 1000.}).runTargets(getTargets(array['close']))
+vectorizedDuration = time.perf_counter() - start
+print(f'vectorized: {N_MINUTES} minutes in {vectorizedDuration:.3f} s (thereof {loaded - start:.3f} s loading), '
+      f'portfolio {result.getPortfolio()}')
+print(f'Speedup: {emulatorDuration / vectorizedDuration:.0f}x')
@@ -1,3 +1,9 @@
-from .exchange import ExchangeHandler
+from .exchange import BaseExchangeHandler, ExchangeHandler
+from .binancelimits import BinanceRateLimiter, LimitedClient, LimitedAsyncClient
 from .binance import BinanceHandler
-from .emulator import ExchangeEmulator
\ No newline at end of file
+from .emulator import ExchangeEmulator
+from .offline import MissingKlinesError, OfflineHandler
+from .vectorbacktest import BacktestResult, VectorizedBacktest
+from .asyncexchange import AsyncExchangeHandler
+from .asyncbinance import AsyncBinanceHandler
+from .klinestream import BinanceKlineStream
\ No newline at end of file
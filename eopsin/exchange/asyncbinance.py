@@ -0,0 +1,90 @@
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import eopsin.model as m
+import eopsin.service as s
+import eopsin.util as util
+from .asyncexchange import AsyncExchangeHandler
+from .binance import _BinanceMixin
+from .binancelimits import LimitedAsyncClient
+from .klinestream import BinanceKlineStream
+
+
+class AsyncBinanceHandler(_BinanceMixin, AsyncExchangeHandler):
+    '''
+    Binance handler on top of the `AsyncClient` of python-binance. Use `create` to connect to the exchange and
+    `close` to release the connection.
+    '''
+
+    def __init__(self, dbservice: s.DBService, client: LimitedAsyncClient, candleStore: s.CandleStore = None):
+        super().__init__(dbservice, candleStore)
+        self.client = client
+        self.clock = util.ClockSync()
+
+    @classmethod
+    async def create(cls, dbservice: s.DBService, apiKey: str, apiSecret: str, candleStore: s.CandleStore = None,
+                     **kwargs) -> 'AsyncBinanceHandler':
+        client = await LimitedAsyncClient.create(apiKey, apiSecret, **kwargs)
+        return cls(dbservice, client, candleStore)
+
+    async def close(self) -> None:
+        await self.client.close_connection()
+
+    async def _getServerTime(self) -> datetime:
+        response = await self.client.get_server_time()
+        return self._convertTimestamp(response['serverTime'])
+
+    async def getTime(self) -> datetime:
+        ''' Answered locally from the clock synced with the server '''
+        if self.clock.needsSync():
+            await self.clock.syncAsync(self._getServerTime)
+            self.client.timestamp_offset = int(self.clock.getSystemOffset() * 1000)
+        return self.clock.getTime()
+
+    async def _getHistoricalKlinesFromServer(self, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                                             periodEnd: datetime) -> np.ndarray:
+        data = await self.client.get_klines(**self._getKlinesRequest(pair, interval, periodStart, periodEnd))
+        return self._getCandlesArrayFromData(data)
+
+    async def streamKlines(self, subscriptions: List[Tuple[m.Pair, m.Interval]], terminate=lambda: False) -> None:
+        ''' Event loop driven by the kline streams of the subscribed pairs and intervals instead of polling '''
+        await BinanceKlineStream(self, subscriptions).run(terminate)
+
+    async def getLastCompleteCandleBefore(self, pair: m.Pair, interval: m.Interval, date: datetime) -> m.Candle:
+        begin = util.floorDatetime(date, interval.timedelta()) - interval.timedelta()
+        candles = await self.getHistoricalKlines(pair, interval, begin, date)
+        return candles[0]
+
+    async def getAssetBalance(self, asset: str) -> float:
+        info = await self.client.get_asset_balance(asset=asset)
+        return float(info['free'])
+
+    async def getPortfolio(self) -> Dict[str, float]:
+        info = await self.client.get_account()
+        return {entry['asset']: float(entry['free']) for entry in info['balances']}
+
+    async def placeOrder(self, order: m.Order) -> m.OrderId:
+        method, data = self._getOrderRequest(order)
+        info = await getattr(self.client, method)(**data)
+        self.log.debug(f'Placing order: {order} returned {info}')
+
+        return m.OrderId(pair=order.pair, id=info['orderId'])
+
+    async def checkOrder(self, orderId: m.OrderId) -> m.OrderStatus:
+        response = await self.client.get_order(symbol=self._convertPairSymbol(orderId.pair), orderId=str(orderId.id))
+        return m.OrderStatus[response['status']]
+
+    async def getInfo(self, orderId: m.OrderId) -> m.OrderInfo:
+        res = await self.client.get_order(symbol=self._convertPairSymbol(orderId.pair), orderId=str(orderId.id))
+        return self._getOrderInfo(orderId.pair, res)
+
+    async def cancelOrder(self, orderId: m.OrderId) -> None:
+        await self.client.cancel_order(**self._getCancelRequest(orderId))
+
+    async def getAllOrders(self, pair: m.Pair):
+        return await self.client.get_all_orders(symbol=self._convertPairSymbol(pair))
+
+    async def getAllOpenOrders(self, pair: m.Pair):
+        return await self.client.get_open_orders(symbol=self._convertPairSymbol(pair))
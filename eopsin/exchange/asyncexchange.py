@@ -0,0 +1,151 @@
+import asyncio
+from abc import abstractmethod
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+import eopsin.model as m
+import eopsin.util as util
+from .exchange import BaseExchangeHandler
+
+
+class AsyncExchangeHandler(BaseExchangeHandler):
+    '''
+    Asyncio counterpart of the `ExchangeHandler`, whose requests to the exchange are coroutines, such that many of
+    them can run concurrently under one event loop. The candle store is still accessed synchronously, which keeps
+    each store operation atomic with respect to the other coroutines.
+    '''
+    # Chunks of missing klines are fetched by at most `maxConcurrentRequests` concurrent requests per call
+    maxConcurrentRequests: int = 8
+
+    @abstractmethod
+    async def _getHistoricalKlinesFromServer(self, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                                             periodEnd: datetime) -> Union[List[m.Candle], np.ndarray]:
+        pass
+
+    async def _fetchHistoricalKlinesChunk(self, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                                          periodEnd: datetime) -> Union[List[m.Candle], np.ndarray]:
+        if self.rateLimiter is not None:
+            waited = await self.rateLimiter.acquireAsync(self.klinesRequestWeight)
+            if waited > 0:
+                self.log.debug(f'Waited {waited:.2f} s for the request weight budget')
+        self.log.debug(
+            f'Fetching {pair} klines ({interval}) for the period {periodStart} - {periodEnd} from {self.exchange}')
+        return await self._getHistoricalKlinesFromServer(pair, interval, periodStart, periodEnd)
+
+    async def _fetchMissingHistoricalKlines(self, pair: m.Pair, interval: m.Interval,
+                                            missingPeriods: List[Tuple[datetime, datetime]]) -> None:
+        missingPeriods = self._resampleMissingHistoricalKlines(pair, interval, missingPeriods)
+        chunks, flights = self._joinFetchFlights(pair, interval, self._getPageChunks(interval, missingPeriods))
+        try:
+            await self._fetchPageChunks(pair, interval, chunks)
+        finally:
+            self._landFetchFlights(pair, interval, chunks)
+        # the chunks fetched by other callers are checked again by `_assureHistoricalKlines`
+        for flight in flights:
+            await asyncio.get_running_loop().run_in_executor(None, flight.wait)
+
+    async def _fetchPageChunks(self, pair: m.Pair, interval: m.Interval,
+                               chunks: List[Tuple[datetime, datetime]]) -> None:
+        semaphore = asyncio.Semaphore(self.maxConcurrentRequests)
+
+        async def fetch(periodStart: datetime, periodEnd: datetime):
+            async with semaphore:
+                return periodStart, periodEnd, await self._fetchHistoricalKlinesChunk(pair, interval, periodStart,
+                                                                                     periodEnd)
+
+        # the chunks are fetched concurrently, but stored one after the other as they complete
+        tasks = [asyncio.ensure_future(fetch(periodStart, periodEnd)) for periodStart, periodEnd in chunks]
+        try:
+            for task in asyncio.as_completed(tasks):
+                periodStart, periodEnd, candles = await task
+                self._storeHistoricalKlinesChunk(pair, interval, periodStart, periodEnd, candles)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    async def _assureHistoricalKlines(self, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                                      periodEnd: datetime, attempt: int = 1) -> None:
+        if attempt > 3:
+            self.log.error(
+                f'Max attempts reached while trying to fetch missing historical klines for {pair} from {self.name} for the period {periodStart} - {periodEnd}')
+            raise RuntimeError('Max attempts reached while trying to fetch missing historical klines')
+
+        missingPeriods = self.candleStore.findMissingCandlePeriods(self.exchange, pair, interval, periodStart, periodEnd)
+        if missingPeriods:
+            await self._fetchMissingHistoricalKlines(pair, interval, missingPeriods)
+            await self._assureHistoricalKlines(pair, interval, periodStart, periodEnd, attempt=attempt + 1)
+
+    async def backfillHistoricalKlines(self, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                                       periodEnd: datetime) -> datetime:
+        ''' Same as `ExchangeHandler.backfillHistoricalKlines` '''
+        watermark = self.getBackfillWatermark(pair, interval, periodStart)
+        if watermark < periodEnd:
+            self.log.debug(f'Backfilling {self.exchange} {pair} klines ({interval}) from {watermark} to {periodEnd}')
+            await self._assureHistoricalKlines(pair, interval, watermark, periodEnd)
+        return self.getBackfillWatermark(pair, interval, periodStart)
+
+    async def getHistoricalKlines(self, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                                  periodEnd: datetime) -> List[m.Candle]:
+        self.log.debug(
+            f'Getting historical klines: {self.exchange} {pair} ({interval}) from {periodStart} to {periodEnd}')
+        await self._assureHistoricalKlines(pair, interval, periodStart, periodEnd)
+        return self.candleStore.findCandles(self.exchange, pair, interval, periodStart, periodEnd)
+
+    async def getHistoricalKlinesArray(self, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                                       periodEnd: datetime) -> np.ndarray:
+        ''' Same as `getHistoricalKlines` but returns a structured array of `CANDLE_DTYPE` '''
+        self.log.debug(
+            f'Getting historical kline array: {self.exchange} {pair} ({interval}) from {periodStart} to {periodEnd}')
+        await self._assureHistoricalKlines(pair, interval, periodStart, periodEnd)
+        return self.candleStore.findCandlesArray(self.exchange, pair, interval, periodStart, periodEnd)
+
+    @abstractmethod
+    async def getLastCompleteCandleBefore(self, pair: m.Pair, interval: m.Interval, date: datetime) -> m.Candle:
+        pass
+
+    @abstractmethod
+    async def getTime(self) -> datetime:
+        pass
+
+    @abstractmethod
+    async def getPortfolio(self) -> Dict[str, float]:
+        pass
+
+    @abstractmethod
+    async def getAssetBalance(self, asset: str) -> float:
+        pass
+
+    @abstractmethod
+    async def placeOrder(self, order: m.Order) -> m.OrderId:
+        pass
+
+    @abstractmethod
+    async def checkOrder(self, orderId: m.OrderId) -> m.OrderStatus:
+        pass
+
+    @abstractmethod
+    async def cancelOrder(self, orderId: m.OrderId) -> None:
+        pass
+
+    @abstractmethod
+    async def getAllOrders(self, pair: m.Pair) -> List[m.Order]:
+        pass
+
+    @abstractmethod
+    async def getAllOpenOrders(self, pair: m.Pair) -> List[m.Order]:
+        pass
+
+    async def close(self) -> None:
+        ''' Releases the connections to the exchange '''
+        pass
+
+    async def eventLoop(self, tickwidth: timedelta, terminate=lambda: False) -> None:
+        while not terminate():
+            now = await self.getTime()
+            next = util.floorDatetime(now, tickwidth) + tickwidth
+            delta = next - now
+            await asyncio.sleep(delta.total_seconds())
+            self._fireEvents(next)
@@ -1,24 +1,29 @@
+import asyncio
 from datetime import datetime, timezone
-from typing import List
+from typing import Dict, List, Tuple
 
-import binance
 import numpy as np
 
 import eopsin.model as m
 import eopsin.service as s
 import eopsin.util as util
+from .binancelimits import BinanceRateLimiter, LimitedClient
 from .exchange import ExchangeHandler
+from .klinestream import BinanceKlineStream
 
+# the fields of `CANDLE_DTYPE` in the column order of the binance kline rows
+_KLINE_COLUMNS = ('openTime', 'open', 'high', 'low', 'close', 'volume', 'closeTime', 'quoteAssetVolume',
+                  'numberOfTrades', 'takerBuyBaseAssetVolume', 'takerBuyQuoteAssetVolume')
 
-class BinanceHandler(ExchangeHandler):
-    name = 'Binance'
-
-    def __init__(self, dbservice: s.DBService, apiKey: str, apiSecret: str, **kwargs):
-        super().__init__(dbservice)
-        self.client = binance.Client(apiKey, apiSecret, **kwargs)
 
-    def __del__(self):
-        self.client.session.close()
+class _BinanceMixin:
+    ''' Conversions between the binance api and the model, shared by the blocking and the asyncio handler '''
+    name = 'Binance'
+    # binance returns at most 1000 klines per request, one kline before each chunk is requested in addition
+    pageSize = 999
+    # The requests are budgeted by the `BinanceRateLimiter` of the client, which charges the weight of each endpoint.
+    # The weight of the chunks is taken from there as well, in case a handler level `rateLimiter` is set anyway.
+    klinesRequestWeight = BinanceRateLimiter.getWeight('get', '/api/v3/klines')
 
     def _convertIntervalString(self, interval: m.Interval) -> str:
         return interval.value
@@ -49,22 +54,122 @@ class BinanceHandler(ExchangeHandler):
                           )
         return candle
 
-    def getTime(self) -> datetime:
-        response = self.client.get_server_time()
-        timestamp = float(response['serverTime'])  # timestamp is in milliseconds
-        return datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc)
+    def _getCandlesArrayFromData(self, data: List[list]) -> np.ndarray:
+        '''
+        Converts a page of kline rows to a structured array of `CANDLE_DTYPE` column by column, without creating
+        a python object per candle. The numeric strings of binance are parsed by numpy while casting the columns.
+        '''
+        candles = np.empty(len(data), dtype=m.CANDLE_DTYPE)
+        if not data:
+            return candles
+        table = np.array(data, dtype=object)
+        for idx, name in enumerate(_KLINE_COLUMNS):
+            candles[name] = table[:, idx]
+        return candles
 
-    def _getHistoricalKlinesFromServer(self, pair: m.Pair, interval: m.Interval, periodStart: datetime,
-                                       periodEnd: datetime) -> List[m.Candle]:
+    def _getCandleFromStream(self, pair: m.Pair, interval: m.Interval, kline: dict) -> m.Candle:
+        return m.Candle(exchange=self.exchange, pair=pair, interval=interval,
+                        openTime=self._convertTimestamp(kline['t']),
+                        open=float(kline['o']),
+                        high=float(kline['h']),
+                        low=float(kline['l']),
+                        close=float(kline['c']),
+                        volume=float(kline['v']),
+                        closeTime=self._convertTimestamp(kline['T']),
+                        quoteAssetVolume=float(kline['q']),
+                        numberOfTrades=kline['n'],
+                        takerBuyBaseAssetVolume=float(kline['V']),
+                        takerBuyQuoteAssetVolume=float(kline['Q']),
+                        )
+
+    def _getKlinesRequest(self, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                          periodEnd: datetime) -> dict:
+        '''
+        Returns the arguments of `get_klines` for a chunk of at most `pageSize` klines, which is fetched by a single
+        request. Unlike `get_historical_klines`, it neither pages by 500 klines nor looks up the listing date first.
+        '''
         periodStart = util.ceilDatetime(periodStart, interval.timedelta(), tz=timezone.utc).astimezone(timezone.utc)
         periodEnd = util.floorDatetime(periodEnd, interval.timedelta(), tz=timezone.utc).astimezone(timezone.utc)
-        candles = [self._getCandleFromData(pair, interval, candle) for candle in
-                   self.client.get_historical_klines(self._convertPairSymbol(pair),
-                                                     self._convertIntervalString(interval),
-                                                     # shift by one to somehow get the right klines
-                                                     self._convertDate(periodStart - interval.timedelta()),
-                                                     self._convertDate(periodEnd))]
-        return candles
+        return {'symbol': self._convertPairSymbol(pair), 'interval': self._convertIntervalString(interval),
+                # shift by one to somehow get the right klines
+                'startTime': self._convertDate(periodStart - interval.timedelta()),
+                'endTime': self._convertDate(periodEnd), 'limit': self.pageSize + 1}
+
+    def _getOrderRequest(self, order: m.Order) -> Tuple[str, dict]:
+        ''' Returns the name of the client method placing the order and its arguments '''
+        getStr = lambda flt: np.format_float_positional(flt, trim='-')
+        data = {'symbol': self._convertPairSymbol(order.pair)}
+
+        if isinstance(order, m.LimitOrder):
+            data['quantity'] = getStr(order.volume)
+            data['price'] = getStr(order.price)
+            method = 'order_limit'
+        elif isinstance(order, m.MarketOrder):
+            if order.volumeType == order.volumeType.ASSET:
+                data['quantity'] = getStr(order.volume)
+            else:
+                data['quoteOrderQty'] = getStr(order.volume)
+            method = 'order_market'
+        else:
+            raise ValueError(f"Unknown order type: {type(order)}")
+
+        if order.side is m.OrderSide.SELL:
+            return f'{method}_sell', data
+        elif order.side is m.OrderSide.BUY:
+            return f'{method}_buy', data
+        else:
+            raise ValueError(f"Unknown order side: {order.side.name}")
+
+    def _getCancelRequest(self, orderId: m.OrderId) -> dict:
+        ''' Returns the arguments of `cancel_order` '''
+        return {'symbol': self._convertPairSymbol(orderId.pair), 'orderId': str(orderId.id)}
+
+    def getRateLimitMetrics(self) -> Dict[str, float]:
+        ''' Metrics of the request weight budget, which is shared by all handlers of the process '''
+        return self.client.limiter.getMetrics()
+
+    def _getOrderInfo(self, pair: m.Pair, res: dict) -> m.OrderInfo:
+        return m.OrderInfo(pair=pair, orderId=res['orderId'],
+                           time=self._convertTimestamp(res['time']),
+                           orderedVolume=float(res['origQty']),
+                           filledVolume=float(res['executedQty']),
+                           filledCurrencyVolume=float(res['cummulativeQuoteQty']),
+                           status=m.OrderStatus[res['status']],
+                           type=res['type'],
+                           side=m.OrderSide[res['side']],
+                           )
+
+
+class BinanceHandler(_BinanceMixin, ExchangeHandler):
+
+    def __init__(self, dbservice: s.DBService, apiKey: str, apiSecret: str, candleStore: s.CandleStore = None,
+                 **kwargs):
+        super().__init__(dbservice, candleStore)
+        self.client = LimitedClient(apiKey, apiSecret, **kwargs)
+        self.clock = util.ClockSync()
+
+    def __del__(self):
+        self.client.session.close()
+
+    def _getServerTime(self) -> datetime:
+        response = self.client.get_server_time()
+        return self._convertTimestamp(response['serverTime'])
+
+    def getTime(self) -> datetime:
+        ''' Answered locally from the clock synced with the server '''
+        if self.clock.needsSync():
+            self.clock.sync(self._getServerTime)
+            self.client.timestamp_offset = int(self.clock.getSystemOffset() * 1000)
+        return self.clock.getTime()
+
+    def _getHistoricalKlinesFromServer(self, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                                       periodEnd: datetime) -> np.ndarray:
+        return self._getCandlesArrayFromData(
+            self.client.get_klines(**self._getKlinesRequest(pair, interval, periodStart, periodEnd)))
+
+    def streamKlines(self, subscriptions: List[Tuple[m.Pair, m.Interval]], terminate=lambda: False) -> None:
+        ''' Event loop driven by the kline streams of the subscribed pairs and intervals instead of polling '''
+        asyncio.run(BinanceKlineStream(self, subscriptions).run(terminate))
 
     def getLastCompleteCandleBefore(self, pair: m.Pair, interval: m.Interval, date: datetime) -> m.Candle:
         begin = util.floorDatetime(date, interval.timedelta()) - interval.timedelta()
@@ -80,43 +185,9 @@ class BinanceHandler(ExchangeHandler):
         portfolio = {entry['asset']: float(entry['free']) for entry in info['balances']}
         return portfolio
 
-    def _processMarketOrder(self, order: m.MarketOrder) -> dict:
-        getStr = lambda flt: np.format_float_positional(flt, trim='-')
-
-        data = {}
-        data['symbol'] = self._convertPairSymbol(order.pair)
-        if order.volumeType == order.volumeType.ASSET:
-            data['quantity'] = getStr(order.volume)
-        else:
-            data['quoteOrderQty'] = getStr(order.volume)
-
-        if order.side is m.OrderSide.SELL:
-            info = self.client.order_market_sell(**data)
-        elif order.side is m.OrderSide.BUY:
-            info = self.client.order_market_buy(**data)
-        else:
-            raise ValueError(f"Unknown order side: {order.side.name}")
-
-        return info
-
     def placeOrder(self, order: m.Order) -> m.OrderId:
-        symbol = self._convertPairSymbol(order.pair)
-        getStr = lambda flt: np.format_float_positional(flt, trim='-')
-
-        if isinstance(order, m.LimitOrder):
-            if order.side is m.OrderSide.SELL:
-                info = self.client.order_limit_sell(symbol=symbol, quantity=getStr(order.volume),
-                                                    price=getStr(order.price))
-            elif order.side is m.OrderSide.BUY:
-                info = self.client.order_limit_buy(symbol=symbol, quantity=getStr(order.volume),
-                                                   price=getStr(order.price))
-            else:
-                raise ValueError(f"Unknown order side: {order.side.name}")
-        elif isinstance(order, m.MarketOrder):
-            info = self._processMarketOrder(order)
-        else:
-            raise ValueError(f"Unknown order type: {type(order)}")
-
+        method, data = self._getOrderRequest(order)
+        info = getattr(self.client, method)(**data)
         self.log.debug(f'Placing order: {order} returned {info}')
 
         return m.OrderId(pair=order.pair, id=info['orderId'])
@@ -128,19 +199,10 @@ class BinanceHandler(ExchangeHandler):
 
     def getInfo(self, orderId: m.OrderId) -> m.OrderInfo:
         res = self.client.get_order(symbol=self._convertPairSymbol(orderId.pair), orderId=str(orderId.id))
-        info = m.OrderInfo(pair=orderId.pair, orderId=res['orderId'],
-                           time=self._convertTimestamp(res['time']),
-                           orderedVolume=float(res['origQty']),
-                           filledVolume=float(res['executedQty']),
-                           filledCurrencyVolume=float(res['cummulativeQuoteQty']),
-                           status=m.OrderStatus[res['status']],
-                           type=res['type'],
-                           side=m.OrderSide[res['side']],
-                           )
-        return info
+        return self._getOrderInfo(orderId.pair, res)
 
-    def cancelOrder(self, orderId: m.OrderId):
-        pass
+    def cancelOrder(self, orderId: m.OrderId) -> None:
+        self.client.cancel_order(**self._getCancelRequest(orderId))
 
     def getAllOrders(self, pair: m.Pair):
         return self.client.get_all_orders(symbol=self._convertPairSymbol(pair))
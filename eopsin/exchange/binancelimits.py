@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Dict, Tuple
+from urllib.parse import urlsplit
+
+import binance
+from binance.exceptions import BinanceAPIException
+
+import eopsin.util as util
+
+_log = logging.getLogger(__name__)
+
+# Request weights of the spot api endpoints, requests to all other endpoints weigh 1. Deviations, e.g. of openOrders
+# without a symbol, are corrected by the used weight reported by binance.
+ENDPOINT_WEIGHTS: Dict[Tuple[str, str], int] = {
+    ('get', '/api/v3/klines'): 2,
+    ('get', '/api/v3/depth'): 5,
+    ('get', '/api/v3/ticker/24hr'): 2,
+    ('get', '/api/v3/exchangeInfo'): 20,
+    ('get', '/api/v3/account'): 20,
+    ('get', '/api/v3/order'): 4,
+    ('get', '/api/v3/openOrders'): 6,
+    ('get', '/api/v3/allOrders'): 20,
+    ('get', '/api/v3/myTrades'): 20,
+}
+# Requests to these endpoints also count towards the order rate limit
+ORDER_ENDPOINTS = {('post', '/api/v3/order'), ('post', '/api/v3/order/oco')}
+
+
+class BinanceRateLimiter:
+    '''
+    Budget of the binance request weight and order rate limits. Callers are queued until their request fits into the
+    budget, which is synchronised with the usage binance reports in the response headers. After a request has been
+    rejected (429 or 418), no requests are sent until the time given by binance.
+    '''
+    weight: util.TokenBucket
+    orders: util.TokenBucket
+    requests: int
+    rejected: int
+    waited: float
+    usedWeight: int
+
+    def __init__(self, weight: util.TokenBucket = None, orders: util.TokenBucket = None):
+        self.weight = weight or util.TokenBucket(capacity=6000, rate=6000 / 60)
+        self.orders = orders or util.TokenBucket(capacity=100, rate=100 / 10)
+        self.requests = 0
+        self.rejected = 0
+        self.waited = 0.
+        self.usedWeight = 0
+        self._retryAt = 0.
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'BinanceRateLimiter<weight={self.weight}, orders={self.orders}>'
+
+    __str__ = __repr__
+
+    @staticmethod
+    def getWeight(method: str, path: str) -> int:
+        return ENDPOINT_WEIGHTS.get((method, path), 1)
+
+    def _getRetryDelay(self) -> float:
+        return max(0., self._retryAt - time.monotonic())
+
+    def _record(self, waited: float) -> None:
+        with self._lock:
+            self.requests += 1
+            self.waited += waited
+
+    def acquire(self, method: str, path: str) -> float:
+        ''' Blocks until the request fits into the budget, returns the time waited in seconds '''
+        waited = 0.
+        delay = self._getRetryDelay()
+        while delay > 0:
+            time.sleep(delay)
+            waited += delay
+            delay = self._getRetryDelay()
+
+        waited += self.weight.acquire(self.getWeight(method, path))
+        if (method, path) in ORDER_ENDPOINTS:
+            waited += self.orders.acquire()
+        self._record(waited)
+        return waited
+
+    async def acquireAsync(self, method: str, path: str) -> float:
+        ''' Same as `acquire`, but waits without blocking the event loop '''
+        waited = 0.
+        delay = self._getRetryDelay()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            waited += delay
+            delay = self._getRetryDelay()
+
+        waited += await self.weight.acquireAsync(self.getWeight(method, path))
+        if (method, path) in ORDER_ENDPOINTS:
+            waited += await self.orders.acquireAsync()
+        self._record(waited)
+        return waited
+
+    def update(self, headers) -> None:
+        ''' Synchronises the budget with the usage reported in the headers of a binance response '''
+        usedWeight = headers.get('X-MBX-USED-WEIGHT-1M')
+        if usedWeight is not None:
+            self.usedWeight = int(usedWeight)
+            self.weight.capTokens(self.weight.capacity - self.usedWeight)
+        orderCount = headers.get('X-MBX-ORDER-COUNT-10S')
+        if orderCount is not None:
+            self.orders.capTokens(self.orders.capacity - int(orderCount))
+
+    def reject(self, headers) -> None:
+        ''' Stops all requests for the time given in the headers of a rejected (429 or 418) response '''
+        retryAfter = float(headers.get('Retry-After', 60))
+        _log.warning(f'Binance rejected a request, pausing all requests for {retryAfter} s')
+        with self._lock:
+            self.rejected += 1
+            self._retryAt = max(self._retryAt, time.monotonic() + retryAfter)
+
+    def getMetrics(self) -> Dict[str, float]:
+        return {
+            'requests': self.requests,
+            'rejected': self.rejected,
+            'waited': self.waited,
+            'usedWeight': self.usedWeight,
+            'weightUtilization': 1 - self.weight.tokens / self.weight.capacity,
+            'orderUtilization': 1 - self.orders.tokens / self.orders.capacity,
+        }
+
+
+class _LimitedClientMixin:
+    # the limits apply per IP, such that all clients of the process share one limiter by default
+    limiter: BinanceRateLimiter = BinanceRateLimiter()
+    # requests rejected with 429 (too many requests) are retried after the time given by binance
+    maxRetries: int = 3
+
+    @staticmethod
+    def _getEndpoint(method: str, uri: str) -> Tuple[str, str]:
+        return method.lower(), urlsplit(uri).path
+
+    @staticmethod
+    def _copyData(kwargs: dict) -> dict:
+        # the request parameters are signed in place, such that each attempt needs a fresh copy
+        if isinstance(kwargs.get('data'), dict):
+            return dict(kwargs, data=dict(kwargs['data']))
+        return kwargs
+
+    def _handleRejection(self, error: BinanceAPIException, attempt: int) -> None:
+        if error.status_code not in (429, 418):
+            raise error
+        self.limiter.reject(error.response.headers)
+        # a 418 is an ip ban for repeatedly violating the limits
+        if error.status_code == 418 or attempt >= self.maxRetries:
+            raise error
+
+
+class LimitedClient(_LimitedClientMixin, binance.Client):
+    ''' `binance.Client` whose requests are throttled by the shared `limiter` '''
+
+    def _request(self, method, uri: str, signed: bool, force_params: bool = False, **kwargs):
+        attempt = 0
+        while True:
+            self.limiter.acquire(*self._getEndpoint(method, uri))
+            try:
+                return super()._request(method, uri, signed, force_params, **self._copyData(kwargs))
+            except BinanceAPIException as error:
+                self._handleRejection(error, attempt)
+                attempt += 1
+
+    def _handle_response(self, response):
+        self.limiter.update(response.headers)
+        return super()._handle_response(response)
+
+
+class LimitedAsyncClient(_LimitedClientMixin, binance.AsyncClient):
+    ''' `binance.AsyncClient` whose requests are throttled by the shared `limiter` '''
+
+    async def _request(self, method, uri: str, signed: bool, force_params: bool = False, **kwargs):
+        attempt = 0
+        while True:
+            await self.limiter.acquireAsync(*self._getEndpoint(method, uri))
+            try:
+                return await super()._request(method, uri, signed, force_params, **self._copyData(kwargs))
+            except BinanceAPIException as error:
+                self._handleRejection(error, attempt)
+                attempt += 1
+
+    async def _handle_response(self, response):
+        self.limiter.update(response.headers)
+        return await super()._handle_response(response)
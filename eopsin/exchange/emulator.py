@@ -1,16 +1,39 @@
 import copy
 import datetime as dt
 import itertools as it
-from typing import List, Dict
+import math
+import time
+from dataclasses import dataclass
+from typing import Iterable, List, Dict, Tuple, Union
+
+import numpy as np
 
 import eopsin.model as m
+import eopsin.service as s
 import eopsin.util as util
 from .exchange import ExchangeHandler
 
 
+@dataclass
+class _PrefetchedKlines:
+    # the prefetched period in epoch ms
+    periodStart: int
+    periodEnd: int
+    candles: np.ndarray
+    openTimes: np.ndarray
+
+
 class ExchangeEmulator(ExchangeHandler):
+    '''
+    Simulates the order execution on top of the klines of an exchange handler. During a backtest, the klines of a
+    pair and interval are prefetched for the whole remaining period in one bulk fetch and load as soon as they are
+    first requested, or up front if declared, and then served from memory.
+    '''
     _exchangeHandler: ExchangeHandler
     _portfolio: Dict[str, float]
+    # Prefetches klines requested during a backtest, which have not been declared
+    prefetchOnDemand: bool = True
+    backtestReport: Dict[str, float]
 
     class _Decorators:
         @classmethod
@@ -23,25 +46,92 @@ class ExchangeEmulator(ExchangeHandler):
     def __init__(self, exchange: ExchangeHandler, portfolio: Dict[str, float] = {},
                  now: dt.datetime = dt.datetime.now()):
         self.name = f'{exchange.name}-Emulator'
-        super().__init__(exchange.dbservice)
+        super().__init__(exchange.dbservice, exchange.candleStore)
         self._exchangeHandler = exchange
         self._portfolio = portfolio
         self._now = now.astimezone(dt.timezone.utc)
         self._orders = {}
         self._orderIdGenerator = it.count(1)
+        self._prefetched: Dict[Tuple[int, m.Interval], _PrefetchedKlines] = {}
+        # prices of the prefetched 1 minute klines by pair id
+        self._prices: Dict[int, s.PriceSeries] = {}
+        self._prefetchDuration = 0.
+        self._backtestEnd = None
+        self.backtestReport = {}
 
     @_Decorators.delegateToExchange
     def _getHistoricalKlinesFromServer(self, pair: m.Pair, interval: m.Interval, periodStart: dt.datetime,
-                                       periodEnd: dt.datetime) -> List[m.Candle]:
+                                       periodEnd: dt.datetime) -> Union[List[m.Candle], np.ndarray]:
         pass
 
-    @_Decorators.delegateToExchange
+    def prefetch(self, klines: Iterable[Tuple[m.Pair, m.Interval]], periodStart: dt.datetime,
+                 periodEnd: dt.datetime) -> None:
+        ''' Loads the klines of the period into memory, each pair and interval with one bulk fetch and load '''
+        for pair, interval in klines:
+            self._prefetchKlines(pair, interval, periodStart, periodEnd)
+
+    def _prefetchKlines(self, pair: m.Pair, interval: m.Interval, periodStart: dt.datetime,
+                        periodEnd: dt.datetime) -> _PrefetchedKlines:
+        start = time.perf_counter()
+        # the candle before the period is the last complete candle at its start
+        periodStart = util.floorDatetime(periodStart, interval.timedelta()) - interval.timedelta()
+        candles = self._exchangeHandler.getHistoricalKlinesArray(pair, interval, periodStart, periodEnd)
+        prefetched = _PrefetchedKlines(util.toEpochMs(periodStart), util.toEpochMs(periodEnd), candles,
+                                       np.ascontiguousarray(candles['openTime']))
+        self._prefetched[(pair.id, interval)] = prefetched
+        if interval is m.Interval.MINUTE_1:
+            self._prices[pair.id] = s.PriceSeries(candles)
+        self._prefetchDuration += time.perf_counter() - start
+        self.log.debug(f'Prefetched {len(candles)} {pair} klines ({interval}) for the period {periodStart} - {periodEnd}')
+        return prefetched
+
+    def _findPrefetchedKlines(self, pair: m.Pair, interval: m.Interval, periodStart: dt.datetime,
+                              periodEnd: dt.datetime) -> np.ndarray:
+        ''' Returns the prefetched klines of the period or None, if they are not in memory '''
+        periodStart, periodEnd = util.toEpochMs(periodStart), util.toEpochMs(periodEnd)
+        prefetched = self._prefetched.get((pair.id, interval))
+        if prefetched is None or periodStart < prefetched.periodStart or periodEnd > prefetched.periodEnd:
+            if not self.prefetchOnDemand or self._backtestEnd is None or periodEnd > util.toEpochMs(self._backtestEnd):
+                return None
+            prefetched = self._prefetchKlines(pair, interval, util.fromEpochMs(periodStart), self._backtestEnd)
+
+        begin, end = np.searchsorted(prefetched.openTimes, [periodStart, periodEnd])
+        candles = prefetched.candles[begin:end]
+        # same as the store, which only returns the klines complete within the period
+        return candles[candles['closeTime'] <= periodEnd]
+
+    def getHistoricalKlines(self, pair: m.Pair, interval: m.Interval, periodStart: dt.datetime,
+                            periodEnd: dt.datetime) -> List[m.Candle]:
+        candles = self._findPrefetchedKlines(pair, interval, periodStart, periodEnd)
+        if candles is None:
+            return super().getHistoricalKlines(pair, interval, periodStart, periodEnd)
+        exchange = self._exchangeHandler.exchange
+        return [m.Candle.fromRecord(exchange, pair, interval, candle) for candle in candles]
+
+    def getHistoricalKlinesArray(self, pair: m.Pair, interval: m.Interval, periodStart: dt.datetime,
+                                 periodEnd: dt.datetime) -> np.ndarray:
+        candles = self._findPrefetchedKlines(pair, interval, periodStart, periodEnd)
+        if candles is None:
+            return super().getHistoricalKlinesArray(pair, interval, periodStart, periodEnd)
+        return candles
+
     def getLastCompleteCandleBefore(self, pair: m.Pair, interval: m.Interval, date: dt.datetime) -> m.Candle:
-        pass
+        begin = util.floorDatetime(date, interval.timedelta()) - interval.timedelta()
+        candles = self._findPrefetchedKlines(pair, interval, begin, date)
+        if candles is None or len(candles) == 0:
+            return self._exchangeHandler.getLastCompleteCandleBefore(pair, interval, date)
+        return m.Candle.fromRecord(self._exchangeHandler.exchange, pair, interval, candles[0])
 
     def getCurrentCourse(self, pair: m.Pair):
         ''' Defined to be the closing price of the last 1 minute candle '''
-        return self._exchangeHandler.getLastCompleteCandleBefore(pair, m.Interval.MINUTE_1, self._now).close
+        prices = self._prices.get(pair.id)
+        if prices is None and self.prefetchOnDemand and self._backtestEnd is not None:
+            self._prefetchKlines(pair, m.Interval.MINUTE_1, self._now, self._backtestEnd)
+            prices = self._prices[pair.id]
+        course = prices.getLastClose(self._now) if prices is not None else math.nan
+        if math.isnan(course):
+            return self.getLastCompleteCandleBefore(pair, m.Interval.MINUTE_1, self._now).close
+        return course
 
     def getTime(self) -> dt.datetime:
         return self._now
@@ -119,10 +209,23 @@ class ExchangeEmulator(ExchangeHandler):
         pass
 
     def eventLoop(self, tickwidth: dt.timedelta, terminate=lambda: False) -> None:
+        '''
+        Backtests jump from one tick with subscribed events due to the next, the ticks in between are skipped. Without
+        a known end, every tick is visited, such that `terminate` is checked at each of them.
+        '''
         while not terminate():
-            self._now = util.floorDatetime(self._now, tickwidth) + tickwidth
+            if self._backtestEnd is None:
+                self._now = util.floorDatetime(self._now, tickwidth) + tickwidth
+            else:
+                # a backtest ends at the first tick from its end on, like when visiting every tick
+                self._now = min(self._getNextEventTime(self._now, tickwidth),
+                                self._getFirstTickFrom(self._backtestEnd, tickwidth))
             self._fireEvents(self._now)
 
+    def _getFirstTickFrom(self, time: dt.datetime, tickwidth: dt.timedelta) -> dt.datetime:
+        tick = tickwidth // dt.timedelta(milliseconds=1)
+        return time + dt.timedelta(milliseconds=-self._getEventClock(time) % tick)
+
     def _getBacktestTermination(self, periodEnd: dt.datetime):
         def terminate():
             return self.getTime() >= periodEnd
@@ -130,6 +233,24 @@ class ExchangeEmulator(ExchangeHandler):
         return terminate
 
     def backtest(self, periodStart: dt.datetime, periodEnd: dt.datetime,
-                 tickwidth: dt.timedelta = dt.timedelta(minutes=1)):
+                 tickwidth: dt.timedelta = dt.timedelta(minutes=1),
+                 klines: Iterable[Tuple[m.Pair, m.Interval]] = ()) -> Dict[str, float]:
+        '''
+        Runs the event loop over the period. The klines of the given pairs and intervals are prefetched before,
+        others once they are first requested. Returns a report of the time spent prefetching and simulating.
+        '''
+        start = time.perf_counter()
+        self._prefetchDuration = 0.
+        self._backtestEnd = periodEnd
+        self.prefetch(klines, periodStart, periodEnd)
         self._now = periodStart
-        self.eventLoop(tickwidth, terminate=self._getBacktestTermination(periodEnd))
+        try:
+            self.eventLoop(tickwidth, terminate=self._getBacktestTermination(periodEnd))
+        finally:
+            self._backtestEnd = None
+        duration = time.perf_counter() - start
+        self.backtestReport = {'prefetch': self._prefetchDuration, 'simulation': duration - self._prefetchDuration,
+                               'klines': sum(len(prefetched.candles) for prefetched in self._prefetched.values())}
+        self.log.info(f'Backtest took {duration:.2f} s, thereof {self._prefetchDuration:.2f} s prefetching '
+                      f'{self.backtestReport["klines"]} klines')
+        return self.backtestReport
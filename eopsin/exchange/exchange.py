@@ -1,14 +1,22 @@
+import concurrent.futures
 import logging
+import math
+import threading
 import time
 from abc import ABC, abstractmethod
-from datetime import datetime, timedelta
-from typing import List, Tuple, Dict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Tuple, Union
+
+import numpy as np
 
 import eopsin.model as m
 import eopsin.service as s
 import eopsin.util as util
 
 _log = logging.getLogger(__name__)
+# The new candle events are due on the interval grids counted from this date in the timezone of the event time, the
+# same reference as `floorDatetime`
+_EVENT_REFERENCE_MS = util.toEpochMs(datetime(2000, 1, 1, tzinfo=timezone.utc))
 
 
 class NewCandleEvents(util.Events):
@@ -31,47 +39,266 @@ class NewCandleEvents(util.Events):
         super().__setitem__(item, value)
 
 
-class ExchangeHandler(ABC):
+class BaseExchangeHandler(ABC):
+    ''' Kline storage shared by the blocking `ExchangeHandler` and the `AsyncExchangeHandler` '''
     name: str
     dbservice: s.DBService
+    candleStore: s.CandleStore
     exchange: m.Exchange
     events: NewCandleEvents
     log: logging.Logger
+    # Missing klines are derived from stored klines of these finer intervals before fetching them from the exchange
+    resampleSources: Tuple[m.Interval, ...] = (m.Interval.MINUTE_1, m.Interval.MINUTE_5, m.Interval.MINUTE_15,
+                                               m.Interval.HOUR_1, m.Interval.HOUR_4, m.Interval.DAY_1)
+    # Missing klines are fetched in chunks of at most `pageSize` klines, one request each
+    pageSize: int = 1000
+    # Request weight budget that may be shared between handlers, None for no limit. Each chunk is charged the weight of
+    # the request fetching it. Handlers whose client budgets all of its requests, like the binance handlers, leave it
+    # unset, such that the klines requests are not limited twice.
+    rateLimiter: util.TokenBucket = None
+    klinesRequestWeight: int = 1
+    # Fetches of overlapping periods are coalesced across all handlers of the process
+    fetchFlights: util.SingleFlight = util.SingleFlight()
 
-    def __init__(self, dbservice: s.DBService):
+    def __init__(self, dbservice: s.DBService, candleStore: s.CandleStore = None):
         self.dbservice = dbservice
+        self.candleStore = candleStore or dbservice
         self.exchange = dbservice.getExchange(self.name)
         self.events = NewCandleEvents()
         self.log = _log.getChild(self.name)
 
+    def _resampleMissingHistoricalKlines(self, pair: m.Pair, interval: m.Interval,
+                                         missingPeriods: List[Tuple[datetime, datetime]]) -> \
+            List[Tuple[datetime, datetime]]:
+        ''' Derives the missing klines from stored klines of finer intervals, returns the periods still missing '''
+        sources = [source for source in self.resampleSources if s.canResample(source, interval)]
+        # coarser sources need less klines to be aggregated
+        for source in sorted(sources, key=lambda source: source.milliseconds(), reverse=True):
+            remaining = []
+            for periodStart, periodEnd in missingPeriods:
+                candles = self.candleStore.findCandlesArray(self.exchange, pair, source, periodStart,
+                                                            min(periodEnd, self._getCompleteCandlesEnd(interval)))
+                candles = s.resampleCandles(candles, source, interval)
+                if len(candles) > 0:
+                    inserted, _ = self.candleStore.addCandlesArray(self.exchange, pair, interval, candles)
+                    self.log.debug(f'Derived {inserted} {pair} klines ({interval}) from stored {source} klines')
+                remaining += s.getMissingPeriods(candles['openTime'], interval, periodStart, periodEnd)
+            missingPeriods = remaining
+
+        return missingPeriods
+
+    def _getPageChunks(self, interval: m.Interval, missingPeriods: List[Tuple[datetime, datetime]]) -> \
+            List[Tuple[datetime, datetime]]:
+        width = self.pageSize * interval.timedelta()
+        chunks = []
+        for periodStart, periodEnd in missingPeriods:
+            while periodStart < periodEnd:
+                chunks.append((periodStart, min(periodStart + width, periodEnd)))
+                periodStart += width
+        return chunks
+
+    def _getFlightKey(self, pair: m.Pair, interval: m.Interval) -> tuple:
+        return id(self.candleStore), self.exchange.name, pair.asset, pair.currency, interval
+
+    def _joinFetchFlights(self, pair: m.Pair, interval: m.Interval, chunks: List[Tuple[datetime, datetime]]) -> \
+            Tuple[List[Tuple[datetime, datetime]], List[threading.Event]]:
+        '''
+        Returns the chunks to be fetched by the caller and the flights of other callers already fetching the others.
+        The caller has to land its chunks, before waiting for the other flights.
+        '''
+        led, flights = [], []
+        for periodStart, periodEnd in chunks:
+            overlapping = self.fetchFlights.join(self._getFlightKey(pair, interval), periodStart, periodEnd)
+            if overlapping:
+                flights += overlapping
+            else:
+                led.append((periodStart, periodEnd))
+        if flights:
+            self.log.debug(f'Waiting for {len(chunks) - len(led)} {pair} kline chunks ({interval}) being fetched')
+        return led, flights
+
+    def _landFetchFlights(self, pair: m.Pair, interval: m.Interval, chunks: List[Tuple[datetime, datetime]]) -> None:
+        for periodStart, periodEnd in chunks:
+            self.fetchFlights.land(self._getFlightKey(pair, interval), periodStart, periodEnd)
+
+    def _storeHistoricalKlinesChunk(self, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                                    periodEnd: datetime, candles: Union[List[m.Candle], np.ndarray]) -> None:
+        # handlers may hand over a structured array of `CANDLE_DTYPE`, which is inserted without ORM objects
+        if isinstance(candles, np.ndarray):
+            inserted, skipped = self.candleStore.addCandlesArray(self.exchange, pair, interval, candles)
+        else:
+            inserted, skipped = self.candleStore.addCandles(candles)
+        self.log.debug(f'Stored {inserted} new klines, skipped {skipped} already known klines')
+        self.candleStore.addCoverage(self.exchange, pair, interval, periodStart,
+                                     min(periodEnd, self._getCompleteCandlesEnd(interval)))
+        self._landFetchFlights(pair, interval, [(periodStart, periodEnd)])
+
+    def getBackfillWatermark(self, pair: m.Pair, interval: m.Interval, periodStart: datetime) -> datetime:
+        '''
+        Returns the date up to which all klines from `periodStart` on are known to be stored. The coverage recorded
+        with every stored page is the persisted watermark, an interrupted backfill resumes from it.
+        '''
+        periodStart = util.ceilDatetime(periodStart, interval.timedelta()).astimezone(timezone.utc)
+        coverage = self.candleStore.findCoverage(self.exchange, pair, interval, periodStart,
+                                                 periodStart + interval.timedelta())
+        if coverage and coverage[0][0] <= periodStart:
+            return coverage[0][1]
+        return periodStart
+
+    @staticmethod
+    def _getCompleteCandlesEnd(interval: m.Interval) -> datetime:
+        '''
+        Candles before the returned date are final on the exchange. One interval is kept as margin for clock skew and
+        publishing delays, such that the latest candles are never recorded as known to be empty.
+        '''
+        now = datetime.now(timezone.utc)
+        return util.floorDatetime(now, interval.timedelta()) - interval.timedelta()
+
+    @staticmethod
+    def _getEventClock(time: datetime) -> int:
+        ''' Milliseconds since the reference of the event grids, in wall clock time of the timezone of the time '''
+        offset = time.utcoffset() if time.tzinfo is not None else time.astimezone().utcoffset()
+        return util.toEpochMs(time) + offset // timedelta(milliseconds=1) - _EVENT_REFERENCE_MS
+
+    def _getSubscribedIntervals(self) -> List[m.Interval]:
+        return [interval for interval in m.Interval if len(self.events[interval]) > 0]
+
+    def _getNextEventTime(self, time: datetime, tickwidth: timedelta) -> datetime:
+        '''
+        Returns the first tick after the given time, at which an event with subscribers is due. Without subscribers,
+        this is the next tick.
+        '''
+        tick = tickwidth // timedelta(milliseconds=1)
+        # the ticks at which an interval is due are on the grid of the least common multiple of both
+        steps = [tick * interval.milliseconds() // math.gcd(tick, interval.milliseconds())
+                 for interval in self._getSubscribedIntervals()] or [tick]
+        clock = self._getEventClock(time)
+        return time + timedelta(milliseconds=min(step - clock % step for step in steps))
+
+    def _fireEvents(self, time: datetime) -> None:
+        ''' Fires the events of the intervals with subscribers, for which a new candle starts at the given time '''
+        clock = self._getEventClock(time)
+        for interval in m.Interval:
+            if len(self.events[interval]) > 0 and clock % interval.milliseconds() == 0:
+                self.events[interval]()
+
+
+class ExchangeHandler(BaseExchangeHandler):
+    # Chunks of missing klines are fetched by `backfillWorkers` threads
+    backfillWorkers: int = 1
+
     @abstractmethod
     def _getHistoricalKlinesFromServer(self, pair: m.Pair, interval: m.Interval, periodStart: datetime,
-                                       periodEnd: datetime) -> List[m.Candle]:
+                                       periodEnd: datetime) -> Union[List[m.Candle], np.ndarray]:
         pass
 
+    def _fetchHistoricalKlinesChunk(self, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                                    periodEnd: datetime) -> Union[List[m.Candle], np.ndarray]:
+        if self.rateLimiter is not None:
+            waited = self.rateLimiter.acquire(self.klinesRequestWeight)
+            if waited > 0:
+                self.log.debug(f'Waited {waited:.2f} s for the request weight budget')
+        self.log.debug(
+            f'Fetching {pair} klines ({interval}) for the period {periodStart} - {periodEnd} from {self.exchange}')
+        return self._getHistoricalKlinesFromServer(pair, interval, periodStart, periodEnd)
+
     def _fetchMissingHistoricalKlines(self, pair: m.Pair, interval: m.Interval,
                                       missingPeriods: List[Tuple[datetime, datetime]]) -> None:
-        for periodStart, periodEnd, in missingPeriods:
-            self.log.debug(
-                f'Fetching {pair} klines ({interval}) for the period {periodStart} - {periodEnd} from {self.exchange}')
-            candles = self._getHistoricalKlinesFromServer(pair, interval, periodStart, periodEnd)
-            self.dbservice.addCandles(candles)
-
-    def getHistoricalKlines(self, pair: m.Pair, interval: m.Interval, periodStart: datetime, periodEnd: datetime,
-                            attempt: int = 1) -> List[m.Candle]:
-        self.log.debug(
-            f'Getting historical klines: {self.exchange} {pair} ({interval}) from {periodStart} to {periodEnd}')
+        missingPeriods = self._resampleMissingHistoricalKlines(pair, interval, missingPeriods)
+        chunks, flights = self._joinFetchFlights(pair, interval, self._getPageChunks(interval, missingPeriods))
+        try:
+            self._fetchPageChunks(pair, interval, chunks)
+        finally:
+            self._landFetchFlights(pair, interval, chunks)
+        # the chunks fetched by other callers are checked again by `_assureHistoricalKlines`
+        for flight in flights:
+            flight.wait()
+
+    def _fetchPageChunks(self, pair: m.Pair, interval: m.Interval, chunks: List[Tuple[datetime, datetime]]) -> None:
+        if self.backfillWorkers <= 1 or len(chunks) <= 1:
+            for periodStart, periodEnd in chunks:
+                candles = self._fetchHistoricalKlinesChunk(pair, interval, periodStart, periodEnd)
+                self._storeHistoricalKlinesChunk(pair, interval, periodStart, periodEnd, candles)
+            return
+
+        # the chunks are fetched concurrently, but stored by the calling thread as they complete. A chunk is only
+        # submitted once a worker is free, such that at most `backfillWorkers` pages are held in memory at a time.
+        with concurrent.futures.ThreadPoolExecutor(min(self.backfillWorkers, len(chunks))) as executor:
+            futures = {}
+            try:
+                for periodStart, periodEnd in chunks:
+                    while len(futures) >= self.backfillWorkers:
+                        self._storeCompletedChunks(pair, interval, futures)
+                    future = executor.submit(self._fetchHistoricalKlinesChunk, pair, interval, periodStart, periodEnd)
+                    futures[future] = (periodStart, periodEnd)
+                while futures:
+                    self._storeCompletedChunks(pair, interval, futures)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def _storeCompletedChunks(self, pair: m.Pair, interval: m.Interval,
+                              futures: Dict[concurrent.futures.Future, Tuple[datetime, datetime]]) -> None:
+        done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            periodStart, periodEnd = futures.pop(future)
+            self._storeHistoricalKlinesChunk(pair, interval, periodStart, periodEnd, future.result())
+
+    def _assureHistoricalKlines(self, pair: m.Pair, interval: m.Interval, periodStart: datetime, periodEnd: datetime,
+                                attempt: int = 1) -> None:
         if attempt > 3:
             self.log.error(
                 f'Max attempts reached while trying to fetch missing historical klines for {pair} from {self.name} for the period {periodStart} - {periodEnd}')
             raise RuntimeError('Max attempts reached while trying to fetch missing historical klines')
 
-        missingPeriods = self.dbservice.findMissingCandlePeriods(self.exchange, pair, interval, periodStart, periodEnd)
+        missingPeriods = self.candleStore.findMissingCandlePeriods(self.exchange, pair, interval, periodStart, periodEnd)
         if missingPeriods:
             self._fetchMissingHistoricalKlines(pair, interval, missingPeriods)
-            return self.getHistoricalKlines(pair, interval, periodStart, periodEnd, attempt=attempt + 1)
-        else:
-            return self.dbservice.findCandles(self.exchange, pair, interval, periodStart, periodEnd)
+            self._assureHistoricalKlines(pair, interval, periodStart, periodEnd, attempt=attempt + 1)
+
+    def backfillHistoricalKlines(self, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                                 periodEnd: datetime) -> datetime:
+        '''
+        Fetches the missing klines of the period page by page without loading them from the store, each page is
+        stored as soon as it arrives. Resumes from the backfill watermark and returns the watermark reached.
+        '''
+        watermark = self.getBackfillWatermark(pair, interval, periodStart)
+        if watermark < periodEnd:
+            self.log.debug(f'Backfilling {self.exchange} {pair} klines ({interval}) from {watermark} to {periodEnd}')
+            self._assureHistoricalKlines(pair, interval, watermark, periodEnd)
+        return self.getBackfillWatermark(pair, interval, periodStart)
+
+    def getHistoricalKlines(self, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                            periodEnd: datetime) -> List[m.Candle]:
+        self.log.debug(
+            f'Getting historical klines: {self.exchange} {pair} ({interval}) from {periodStart} to {periodEnd}')
+        self._assureHistoricalKlines(pair, interval, periodStart, periodEnd)
+        return self.candleStore.findCandles(self.exchange, pair, interval, periodStart, periodEnd)
+
+    def getHistoricalKlinesArray(self, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                                 periodEnd: datetime) -> np.ndarray:
+        ''' Same as `getHistoricalKlines` but returns a structured array of `CANDLE_DTYPE` '''
+        self.log.debug(
+            f'Getting historical kline array: {self.exchange} {pair} ({interval}) from {periodStart} to {periodEnd}')
+        self._assureHistoricalKlines(pair, interval, periodStart, periodEnd)
+        return self.candleStore.findCandlesArray(self.exchange, pair, interval, periodStart, periodEnd)
+
+    def iterHistoricalKlines(self, pair: m.Pair, interval: m.Interval, periodStart: datetime, periodEnd: datetime,
+                             chunkSize: int = 10000) -> Iterator[m.Candle]:
+        ''' Same as `getHistoricalKlines`, but streams the klines from the store in chunks of `chunkSize` '''
+        self.log.debug(
+            f'Iterating historical klines: {self.exchange} {pair} ({interval}) from {periodStart} to {periodEnd}')
+        self._assureHistoricalKlines(pair, interval, periodStart, periodEnd)
+        return self.candleStore.iterCandles(self.exchange, pair, interval, periodStart, periodEnd, chunkSize)
+
+    def iterHistoricalKlinesArray(self, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                                  periodEnd: datetime, chunkSize: int = 10000) -> Iterator[np.ndarray]:
+        ''' Same as `getHistoricalKlinesArray`, but streams arrays of at most `chunkSize` klines from the store '''
+        self.log.debug(
+            f'Iterating historical kline arrays: {self.exchange} {pair} ({interval}) from {periodStart} to {periodEnd}')
+        self._assureHistoricalKlines(pair, interval, periodStart, periodEnd)
+        return self.candleStore.iterCandlesArray(self.exchange, pair, interval, periodStart, periodEnd, chunkSize)
 
     @abstractmethod
     def getLastCompleteCandleBefore(self, pair: m.Pair, interval: m.Interval, date: datetime) -> m.Candle:
@@ -113,11 +340,6 @@ class ExchangeHandler(ABC):
     def getAllOpenOrders(self, pair: m.Pair) -> List[m.Order]:
         pass
 
-    def _fireEvents(self, time: datetime) -> None:
-        for interval in m.Interval:
-            if util.floorDatetime(time, interval.timedelta()) == time:
-                self.events[interval]()
-
     def eventLoop(self, tickwidth: timedelta, terminate=lambda: False) -> None:
         while not terminate():
             now = self.getTime()
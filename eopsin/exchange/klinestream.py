@@ -0,0 +1,106 @@
+import asyncio
+import json
+from datetime import datetime
+from typing import Dict, List, Set, Tuple
+
+from websockets import connect
+from websockets.exceptions import WebSocketException
+
+import eopsin.model as m
+from .asyncexchange import AsyncExchangeHandler
+
+
+class BinanceKlineStream:
+    '''
+    Ingests the binance kline streams of the subscribed pairs and intervals. Closed klines are stored as they arrive
+    and the `NewCandleEvents` of an interval are fired as soon as its klines of all subscribed pairs are closed. The
+    stream reconnects after connection losses, the klines missed meanwhile are fetched over REST by the handler
+    before the next closed kline of the pair is stored.
+    '''
+    url: str = 'wss://stream.binance.com:9443/stream'
+    # waiting time before reconnecting, doubled after each failed attempt
+    reconnectDelay: float = 1.
+    maxReconnectDelay: float = 60.
+    # the terminate callback is checked at least every `pollInterval` seconds
+    pollInterval: float = 1.
+
+    def __init__(self, handler, subscriptions: List[Tuple[m.Pair, m.Interval]]):
+        self.handler = handler
+        self.log = handler.log.getChild('stream')
+        self.subscriptions = {(handler._convertPairSymbol(pair), interval.value): (pair, interval)
+                              for pair, interval in subscriptions}
+        self.reconnects = 0
+        self.gaps = 0
+        self._lastOpenTimes: Dict[Tuple[str, str], datetime] = {}
+        self._pendingSymbols: Dict[Tuple[m.Interval, datetime], Set[str]] = {}
+
+    def getStreamUrl(self) -> str:
+        streams = [f'{symbol.lower()}@kline_{interval}' for symbol, interval in self.subscriptions]
+        return f'{self.url}?streams={"/".join(streams)}'
+
+    async def run(self, terminate=lambda: False) -> None:
+        delay = self.reconnectDelay
+        while not terminate():
+            try:
+                async with connect(self.getStreamUrl()) as connection:
+                    self.log.info(f'Connected to the kline streams of {len(self.subscriptions)} subscriptions')
+                    delay = self.reconnectDelay
+                    while not terminate():
+                        try:
+                            message = await asyncio.wait_for(connection.recv(), self.pollInterval)
+                        except asyncio.TimeoutError:
+                            continue
+                        await self._onMessage(json.loads(message))
+            except (WebSocketException, OSError) as error:
+                self.reconnects += 1
+                self.log.warning(f'Kline stream disconnected ({error}), reconnecting in {delay} s')
+                await asyncio.sleep(delay)
+                delay = min(2 * delay, self.maxReconnectDelay)
+
+    async def _onMessage(self, message: dict) -> None:
+        kline = message['data']['k']
+        key = (kline['s'], kline['i'])
+        # klines are updated continuously until they are closed
+        if not kline['x'] or key not in self.subscriptions:
+            return
+
+        pair, interval = self.subscriptions[key]
+        candle = self.handler._getCandleFromStream(pair, interval, kline)
+        lastOpenTime = self._lastOpenTimes.get(key)
+        if lastOpenTime is not None and candle.openTime > lastOpenTime + interval.timedelta():
+            await self._fillGap(pair, interval, lastOpenTime + interval.timedelta(), candle.openTime)
+
+        self.handler.candleStore.addCandles([candle])
+        self.handler.candleStore.addCoverage(self.handler.exchange, pair, interval, candle.openTime,
+                                             candle.openTime + interval.timedelta())
+        if lastOpenTime is None or candle.openTime > lastOpenTime:
+            self._lastOpenTimes[key] = candle.openTime
+        self._closeCandle(kline['s'], interval, candle.openTime)
+
+    async def _fillGap(self, pair: m.Pair, interval: m.Interval, periodStart: datetime, periodEnd: datetime) -> None:
+        self.gaps += 1
+        self.log.info(f'Filling the gap in the {pair} kline stream ({interval}) from {periodStart} to {periodEnd}')
+        try:
+            if isinstance(self.handler, AsyncExchangeHandler):
+                await self.handler.getHistoricalKlinesArray(pair, interval, periodStart, periodEnd)
+            else:
+                await asyncio.get_running_loop().run_in_executor(None, self.handler.getHistoricalKlinesArray, pair,
+                                                                 interval, periodStart, periodEnd)
+        except Exception:
+            # the gap is fetched again by the next request of the period
+            self.log.exception(f'Could not fill the gap in the {pair} kline stream ({interval})')
+
+    def _closeCandle(self, symbol: str, interval: m.Interval, openTime: datetime) -> None:
+        key = (interval, openTime)
+        if key not in self._pendingSymbols:
+            self._pendingSymbols[key] = {symbol for symbol, streamInterval in self.subscriptions
+                                         if streamInterval == interval.value}
+        self._pendingSymbols[key].discard(symbol)
+        if self._pendingSymbols[key]:
+            return
+
+        # older candles, which were not closed for all pairs, are not announced anymore
+        for pendingInterval, pendingOpenTime in list(self._pendingSymbols):
+            if pendingInterval is interval and pendingOpenTime <= openTime:
+                del self._pendingSymbols[(pendingInterval, pendingOpenTime)]
+        self.handler.events[interval]()
@@ -0,0 +1,79 @@
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+import eopsin.model as m
+import eopsin.service as s
+import eopsin.util as util
+from .exchange import ExchangeHandler
+
+
+class MissingKlinesError(LookupError):
+    ''' Raised by the `OfflineHandler` for klines, which are neither stored nor derivable from stored klines '''
+
+    def __init__(self, message: str, missingPeriods: List[Tuple[datetime, datetime]]):
+        super().__init__(message)
+        self.missingPeriods = missingPeriods
+
+
+class OfflineHandler(ExchangeHandler):
+    '''
+    Serves the klines of an exchange from the candle store only, e.g. as the exchange of an `ExchangeEmulator` in
+    backtests. It never connects to the exchange: missing klines are derived from stored klines of finer intervals if
+    possible and raise a `MissingKlinesError` otherwise. With `allowGaps` the stored klines are returned regardless and
+    the gaps are only logged.
+    '''
+    allowGaps: bool
+
+    def __init__(self, dbservice: s.DBService, name: str = 'Binance', candleStore: s.CandleStore = None,
+                 allowGaps: bool = False):
+        self.name = name
+        super().__init__(dbservice, candleStore)
+        self.allowGaps = allowGaps
+
+    def _getHistoricalKlinesFromServer(self, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                                       periodEnd: datetime) -> List[m.Candle]:
+        raise MissingKlinesError(f'{self.name} klines are not requested offline', [(periodStart, periodEnd)])
+
+    def _assureHistoricalKlines(self, pair: m.Pair, interval: m.Interval, periodStart: datetime, periodEnd: datetime,
+                                attempt: int = 1) -> None:
+        missingPeriods = self.candleStore.findMissingCandlePeriods(self.exchange, pair, interval, periodStart, periodEnd)
+        if missingPeriods:
+            missingPeriods = self._resampleMissingHistoricalKlines(pair, interval, missingPeriods)
+        if not missingPeriods:
+            return
+
+        message = f'{len(missingPeriods)} gaps in the stored {self.exchange} {pair} klines ({interval}) for the ' \
+                  f'period {periodStart} - {periodEnd}, the first one is {missingPeriods[0][0]} - {missingPeriods[0][1]}'
+        if not self.allowGaps:
+            raise MissingKlinesError(message, missingPeriods)
+        self.log.debug(message)
+
+    def getLastCompleteCandleBefore(self, pair: m.Pair, interval: m.Interval, date: datetime) -> m.Candle:
+        ''' Returns None for a missing candle if gaps are allowed '''
+        begin = util.floorDatetime(date, interval.timedelta()) - interval.timedelta()
+        candles = self.getHistoricalKlines(pair, interval, begin, date)
+        return candles[0] if candles else None
+
+    def getTime(self) -> datetime:
+        return datetime.now(timezone.utc)
+
+    def getPortfolio(self) -> Dict[str, float]:
+        return {}
+
+    def getAssetBalance(self, asset: str) -> float:
+        return 0
+
+    def placeOrder(self, order: m.Order) -> m.OrderId:
+        raise NotImplementedError('Orders can not be placed offline, use an ExchangeEmulator')
+
+    def checkOrder(self, orderId: m.OrderId) -> m.OrderStatus:
+        raise NotImplementedError('Orders can not be placed offline, use an ExchangeEmulator')
+
+    def cancelOrder(self, orderId: m.OrderId) -> None:
+        raise NotImplementedError('Orders can not be placed offline, use an ExchangeEmulator')
+
+    def getAllOrders(self, pair: m.Pair) -> List[m.Order]:
+        return []
+
+    def getAllOpenOrders(self, pair: m.Pair) -> List[m.Order]:
+        return []
@@ -0,0 +1,83 @@
+from dataclasses import dataclass
+from typing import Dict
+
+import numpy as np
+
+import eopsin.model as m
+
+
+@dataclass
+class BacktestResult:
+    ''' State after the close of each candle of a `VectorizedBacktest`, once the orders placed at the close are filled '''
+    pair: m.Pair
+    # epoch ms
+    closeTimes: np.ndarray
+    prices: np.ndarray
+    # signed asset volumes, positive for buys
+    orders: np.ndarray
+    asset: np.ndarray
+    currency: np.ndarray
+    # value of the portfolio in the currency
+    equity: np.ndarray
+
+    def getPortfolio(self) -> Dict[str, float]:
+        return {self.pair.asset: float(self.asset[-1]), self.pair.currency: float(self.currency[-1])}
+
+
+class VectorizedBacktest:
+    '''
+    Backtests signal-style strategies on the klines of a single pair with numpy in one pass, instead of a python
+    callback per tick as the `ExchangeEmulator` does. The strategy is given as an array with one entry per candle,
+    computed from the `CANDLE_DTYPE` array of the klines up front, either of target positions or of orders.
+    The orders are filled at the close of their candle, like the market orders of the emulator placed on the new
+    candle event. Orders overdrawing the portfolio are not rejected like by the emulator, but raise a `ValueError`.
+    '''
+    pair: m.Pair
+    candles: np.ndarray
+    portfolio: Dict[str, float]
+    # tolerance for rounding errors of the balances
+    epsilon: float = 1e-9
+
+    def __init__(self, pair: m.Pair, candles: np.ndarray, portfolio: Dict[str, float]):
+        self.pair = pair
+        self.candles = candles
+        self.portfolio = dict(portfolio)
+
+    def runOrders(self, orders: np.ndarray) -> BacktestResult:
+        ''' Fills the signed asset volume ordered at the close of each candle, positive volumes are bought '''
+        orders = np.asarray(orders, dtype=np.float64)
+        prices = self.candles['close']
+        asset = self.portfolio.get(self.pair.asset, 0.) + np.cumsum(orders)
+        currency = self.portfolio.get(self.pair.currency, 0.) - np.cumsum(orders * prices)
+
+        overdrawn = np.flatnonzero((asset < -self.epsilon) | (currency < -self.epsilon))
+        if len(overdrawn) > 0:
+            raise ValueError(f'The order at candle {overdrawn[0]} overdraws the portfolio')
+        return self._getResult(orders, asset, currency)
+
+    def runTargets(self, targets: np.ndarray) -> BacktestResult:
+        '''
+        Rebalances the portfolio at the close of each candle, such that the given fraction of its value is held in the
+        asset. The fractions have to be within [0, 1].
+        '''
+        targets = np.asarray(targets, dtype=np.float64)
+        if len(targets) == 0:
+            return self.runOrders(targets)
+        if targets.min() < 0 or targets.max() > 1:
+            raise ValueError('Target positions have to be within [0, 1]')
+        prices = self.candles['close']
+        asset = self.portfolio.get(self.pair.asset, 0.)
+        equity = asset * prices[0] + self.portfolio.get(self.pair.currency, 0.)
+
+        # between two closes the value changes with the return of the asset fraction held
+        held = np.r_[asset * prices[0] / equity if equity > 0 else 0., targets[:-1]]
+        returns = np.r_[1., prices[1:] / prices[:-1]]
+        equities = equity * np.cumprod(1 + held * (returns - 1))
+        assets = targets * equities / prices
+        orders = np.diff(np.r_[asset, assets])
+        return self._getResult(orders, assets, equities - assets * prices)
+
+    def _getResult(self, orders: np.ndarray, asset: np.ndarray, currency: np.ndarray) -> BacktestResult:
+        prices = self.candles['close']
+        return BacktestResult(pair=self.pair, closeTimes=self.candles['closeTime'], prices=prices, orders=orders,
+                              asset=asset, currency=currency, equity=asset * prices + currency)
@@ -1,4 +1,6 @@
-from .candle import Candle, Interval
+from .candle import Candle, CandleLayout, Interval, CANDLE_DTYPE, UNSET_TRADES
+from .coverage import CandleCoverage
+from .timestamp import TimeStamp, TimestampFormat
 from .exchange import Exchange
 from .order import OrderId, Order, OrderStatus, OrderSide, LimitOrder, MarketOrder, VolumeType, OrderInfo
 from .pair import Pair
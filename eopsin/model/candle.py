@@ -1,11 +1,15 @@
 import enum
-from datetime import timedelta
+import math
+from datetime import datetime, timedelta, timezone
 
+import numpy as np
 import sqlalchemy as sql
 
 from ._sqlbase import Base
 from .timestamp import TimeStamp
 
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
 
 @enum.unique
 class Interval(enum.Enum):
@@ -33,6 +37,34 @@ class Interval(enum.Enum):
         elif self == self.WEEK_1:
             return timedelta(weeks=1)
 
+    def milliseconds(self) -> int:
+        return self.timedelta() // timedelta(milliseconds=1)
+
+
+@enum.unique
+class CandleLayout(enum.Enum):
+    # surrogate integer primary key, natural key as unique constraint
+    ROWID = 'rowid'
+    # natural key (exchange_id, pair_id, interval, openTime) as clustered primary key (WITHOUT ROWID on sqlite)
+    CLUSTERED = 'clustered'
+
+
+# Columnar representation of candles, timestamps are given as epoch milliseconds
+CANDLE_DTYPE = np.dtype([('openTime', np.int64),
+                         ('closeTime', np.int64),
+                         ('open', np.float64),
+                         ('high', np.float64),
+                         ('low', np.float64),
+                         ('close', np.float64),
+                         ('volume', np.float64),
+                         ('quoteAssetVolume', np.float64),
+                         ('numberOfTrades', np.int64),
+                         ('takerBuyBaseAssetVolume', np.float64),
+                         ('takerBuyQuoteAssetVolume', np.float64),
+                         ])
+# Unset (NULL) values are given as nan, respectively as this number of trades
+UNSET_TRADES = -1
+
 
 class Candle(Base):
     __tablename__ = 'candle'
@@ -58,5 +90,20 @@ class Candle(Base):
     takerBuyBaseAssetVolume = sql.Column(sql.Float)
     takerBuyQuoteAssetVolume = sql.Column(sql.Float)
 
+    # Candles are identified by their natural key, such that the mapping works with all storage layouts (see
+    # `CandleLayout`). The surrogate id is only populated in the default layout.
+    __mapper_args__ = {'primary_key': [exchange_id, pair_id, interval, openTime]}
+
+    @classmethod
+    def fromRecord(cls, exchange, pair, interval: Interval, record: np.void) -> 'Candle':
+        ''' Creates a transient candle from a record of a `CANDLE_DTYPE` array, unset values are restored as None '''
+        values = {name: float(record[name]) for name in CANDLE_DTYPE.names[2:] if CANDLE_DTYPE[name].kind == 'f'}
+        numberOfTrades = int(record['numberOfTrades'])
+        return cls(exchange=exchange, pair=pair, interval=interval,
+                   openTime=_EPOCH + timedelta(milliseconds=int(record['openTime'])),
+                   closeTime=_EPOCH + timedelta(milliseconds=int(record['closeTime'])),
+                   numberOfTrades=None if numberOfTrades == UNSET_TRADES else numberOfTrades,
+                   **{name: None if math.isnan(value) else value for name, value in values.items()})
+
     def __repr__(self):
         return f'{self.pair} {self.interval} {self.openTime}: {self.open} -> {self.close}'
@@ -0,0 +1,25 @@
+import sqlalchemy as sql
+
+from ._sqlbase import Base
+from .candle import Interval
+from .timestamp import TimeStamp
+
+
+class CandleCoverage(Base):
+    '''
+    A period for which all candles have been fetched from the exchange. Slots in a covered period without a stored
+    candle are known to be empty on the exchange (e.g. before a pair was listed).
+    '''
+    __tablename__ = 'candle_coverage'
+    __table_args__ = (sql.Index('_candle_coverage_lookup', 'exchange_id', 'pair_id', 'interval', 'periodStart'),
+                      )
+    id = sql.Column(sql.Integer, primary_key=True)
+    exchange_id = sql.Column(sql.Integer, sql.ForeignKey('exchange.id'))
+    pair_id = sql.Column(sql.Integer, sql.ForeignKey('pair.id'))
+    interval = sql.Column(sql.Enum(Interval))
+
+    periodStart = sql.Column(TimeStamp)
+    periodEnd = sql.Column(TimeStamp)
+
+    def __repr__(self):
+        return f'CandleCoverage<{self.interval} {self.periodStart} - {self.periodEnd}>'
@@ -1,19 +1,56 @@
+import enum
+
 import sqlalchemy as sql
 import datetime as dt
 
+_EPOCH = dt.datetime(1970, 1, 1, tzinfo=dt.timezone.utc)
+
+
+@enum.unique
+class TimestampFormat(enum.Enum):
+    # naive utc DateTime columns
+    DATETIME = 'datetime'
+    # BigInteger columns holding epoch milliseconds
+    EPOCH_MS = 'epoch_ms'
+
 
 class TimeStamp(sql.types.TypeDecorator):
+    '''
+    Timezone aware datetimes, which are stored in utc in the given format. The mapped models use the DATETIME format,
+    the `DBService` accesses the candle tables through copies typed with the format of the database.
+    '''
     impl = sql.types.DateTime
     LOCAL_TIMEZONE = dt.datetime.utcnow().astimezone().tzinfo
     cache_ok = True
 
+    def __init__(self, timestampFormat: TimestampFormat = TimestampFormat.DATETIME):
+        super().__init__()
+        self.timestampFormat = timestampFormat
+
+    def load_dialect_impl(self, dialect):
+        if self.timestampFormat is TimestampFormat.EPOCH_MS:
+            return dialect.type_descriptor(sql.types.BigInteger())
+        return dialect.type_descriptor(self.impl)
+
     def process_bind_param(self, value: dt.datetime, dialect):
+        # epoch milliseconds are accepted as well, which spares bulk inserts the datetime round trip
+        if isinstance(value, int):
+            if self.timestampFormat is TimestampFormat.EPOCH_MS:
+                return value
+            value = _EPOCH + dt.timedelta(milliseconds=value)
+
         if value.tzinfo is None:
             value = value.astimezone(self.LOCAL_TIMEZONE)
 
+        if self.timestampFormat is TimestampFormat.EPOCH_MS:
+            return (value - _EPOCH) // dt.timedelta(milliseconds=1)
+
         return value.astimezone(dt.timezone.utc)
 
     def process_result_value(self, value, dialect):
+        if self.timestampFormat is TimestampFormat.EPOCH_MS:
+            return _EPOCH + dt.timedelta(milliseconds=value)
+
         if value.tzinfo is None:
             return value.replace(tzinfo=dt.timezone.utc)
 
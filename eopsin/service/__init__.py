@@ -1 +1,6 @@
-from .dbservice import DBService
\ No newline at end of file
+from .candlecache import CandleCache
+from .candlestore import CandleStore, getMissingPeriods
+from .dbservice import DBService
+from .mmapstore import MmapCandleStore
+from .resample import canResample, resampleCandles
+from .priceseries import PriceSeries
@@ -0,0 +1,158 @@
+import collections
+import threading
+from datetime import datetime
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+
+def sliceCandles(candles: np.ndarray, periodStart: int, periodEnd: int) -> np.ndarray:
+    ''' Returns a copy of the ordered candles with openTime >= periodStart and closeTime <= periodEnd (epoch ms) '''
+    begin = np.searchsorted(candles['openTime'], periodStart, side='left')
+    end = np.searchsorted(candles['closeTime'], periodEnd, side='right')
+    return candles[begin:max(begin, end)].copy()
+
+
+class _Segment:
+    ''' All stored candles with openTime >= periodStart and closeTime <= periodEnd (epoch ms) '''
+    periodStart: int
+    periodEnd: int
+    candles: np.ndarray
+
+    def __init__(self, periodStart: int, periodEnd: int, candles: np.ndarray):
+        self.periodStart = periodStart
+        self.periodEnd = periodEnd
+        self.candles = candles
+
+    def __repr__(self):
+        return f'_Segment<{self.periodStart} - {self.periodEnd}, candles={len(self.candles)}>'
+
+    def contains(self, periodStart: int, periodEnd: int) -> bool:
+        return self.periodStart <= periodStart and periodEnd <= self.periodEnd
+
+    def touches(self, periodStart: int, periodEnd: int) -> bool:
+        return self.periodStart <= periodEnd and periodStart <= self.periodEnd
+
+    def slice(self, periodStart: int, periodEnd: int) -> np.ndarray:
+        return sliceCandles(self.candles, periodStart, periodEnd)
+
+
+class CandleCache:
+    '''
+    In-process read-through cache for candle arrays and coverage periods in front of the DBService, keyed by
+    (exchange, pair, interval). Each key holds segments of contiguous periods, whose candles are kept as arrays of
+    `CANDLE_DTYPE`. Keys are evicted in least recently used order once the candles exceed `maxBytes`.
+    The cache can be shared between threads. Every invalidation of a key increments its version, such that data
+    loaded before a concurrent write can be rejected when it is added.
+    '''
+    maxBytes: int
+    hits: int
+    misses: int
+    evictions: int
+
+    def __init__(self, maxBytes: int = 256 * 2 ** 20):
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._segments: Dict[Hashable, List[_Segment]] = collections.OrderedDict()
+        self._coverage: Dict[Hashable, List[Tuple[datetime, datetime]]] = {}
+        self._versions: Dict[Hashable, int] = collections.defaultdict(int)
+        self._nBytes = 0
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return f'CandleCache<keys={len(self._segments)}, bytes={self._nBytes}, hits={self.hits}, misses={self.misses}>'
+
+    __str__ = __repr__
+
+    @property
+    def nBytes(self) -> int:
+        return self._nBytes
+
+    def getVersion(self, key: Hashable) -> int:
+        return self._versions[key]
+
+    def findCandles(self, key: Hashable, periodStart: int, periodEnd: int) -> Optional[np.ndarray]:
+        ''' Returns the cached candles for the period or None if the period is not cached completely '''
+        with self._lock:
+            for segment in self._segments.get(key, []):
+                if segment.contains(periodStart, periodEnd):
+                    self.hits += 1
+                    self._segments.move_to_end(key)
+                    return segment.slice(periodStart, periodEnd)
+
+            self.misses += 1
+            return None
+
+    def getLoadPeriod(self, key: Hashable, periodStart: int, periodEnd: int) -> Tuple[int, int]:
+        '''
+        Returns the period that should be loaded to cache the given one, such that it is merged with all overlapping
+        or adjacent cached segments.
+        '''
+        with self._lock:
+            for segment in self._segments.get(key, []):
+                if segment.touches(periodStart, periodEnd):
+                    periodStart = min(periodStart, segment.periodStart)
+                    periodEnd = max(periodEnd, segment.periodEnd)
+            return periodStart, periodEnd
+
+    def addCandles(self, key: Hashable, periodStart: int, periodEnd: int, candles: np.ndarray,
+                   version: int = None) -> None:
+        '''
+        Caches all stored candles of the given period, replacing the segments within the period. The candles are
+        dropped if the key has been invalidated since `version` was taken.
+        '''
+        if candles.nbytes > self.maxBytes:
+            return
+
+        with self._lock:
+            if version is not None and version != self._versions[key]:
+                return
+
+            segments = self._segments.setdefault(key, [])
+            for segment in [segment for segment in segments if
+                            periodStart <= segment.periodStart and segment.periodEnd <= periodEnd]:
+                segments.remove(segment)
+                self._nBytes -= segment.candles.nbytes
+
+            segments.append(_Segment(periodStart, periodEnd, candles))
+            self._nBytes += candles.nbytes
+            self._segments.move_to_end(key)
+            self._evict()
+
+    def findCoverage(self, key: Hashable) -> Optional[List[Tuple[datetime, datetime]]]:
+        return self._coverage.get(key)
+
+    def setCoverage(self, key: Hashable, coverage: List[Tuple[datetime, datetime]], version: int = None) -> None:
+        with self._lock:
+            if version is None or version == self._versions[key]:
+                self._coverage[key] = coverage
+
+    def invalidateCandles(self, key: Hashable) -> None:
+        with self._lock:
+            self._versions[key] += 1
+            self._dropCandles(key)
+
+    def invalidateCoverage(self, key: Hashable) -> None:
+        with self._lock:
+            self._versions[key] += 1
+            self._coverage.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._segments) + list(self._coverage):
+                self._versions[key] += 1
+            self._segments.clear()
+            self._coverage.clear()
+            self._nBytes = 0
+
+    def _dropCandles(self, key: Hashable) -> None:
+        for segment in self._segments.pop(key, []):
+            self._nBytes -= segment.candles.nbytes
+
+    def _evict(self) -> None:
+        while self._nBytes > self.maxBytes:
+            key = next(iter(self._segments))
+            self._dropCandles(key)
+            self.evictions += 1
@@ -0,0 +1,140 @@
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+import eopsin.model as m
+import eopsin.util as util
+
+_logger = logging.getLogger(__name__)
+
+
+class CandleStore(ABC):
+    '''
+    Storage backend for candles, on which the ExchangeHandler caches klines fetched from the exchange.
+    Candles are identified by (exchange, pair, interval, openTime), duplicates are skipped on insert.
+    Covered periods record that all candles of a period have been fetched, such that slots without a stored candle
+    are known to be empty on the exchange.
+    '''
+
+    @abstractmethod
+    def addCandles(self, candles: List[m.Candle]) -> Tuple[int, int]:
+        ''' Returns the number of inserted and skipped candles '''
+        pass
+
+    @abstractmethod
+    def addCandlesArray(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval,
+                        candles: np.ndarray) -> Tuple[int, int]:
+        ''' Same as `addCandles` for a structured array of `CANDLE_DTYPE` '''
+        pass
+
+    @abstractmethod
+    def findCandles(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                    periodEnd: datetime) -> List[m.Candle]:
+        pass
+
+    @abstractmethod
+    def findCandlesArray(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                         periodEnd: datetime) -> np.ndarray:
+        pass
+
+    @abstractmethod
+    def addCoverage(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                    periodEnd: datetime) -> None:
+        pass
+
+    @abstractmethod
+    def findCoverage(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                     periodEnd: datetime) -> List[Tuple[datetime, datetime]]:
+        ''' Returns the ordered covered periods overlapping with the given period '''
+        pass
+
+    def iterCandles(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                    periodEnd: datetime, chunkSize: int = 10000) -> Iterator[m.Candle]:
+        ''' Same as `findCandles`, but loads the candles in chunks of `chunkSize` while iterating '''
+        for candles in self.iterCandlesArray(exchange, pair, interval, periodStart, periodEnd, chunkSize):
+            for candle in candles:
+                yield m.Candle.fromRecord(exchange, pair, interval, candle)
+
+    def iterCandlesArray(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                         periodEnd: datetime, chunkSize: int = 10000) -> Iterator[np.ndarray]:
+        '''
+        Yields the ordered candles of the period as arrays of at most `chunkSize` candles, such that the memory needed
+        does not depend on the length of the period.
+        '''
+        width = chunkSize * interval.timedelta()
+        periodEndMs = util.toEpochMs(periodEnd)
+        while periodStart < periodEnd:
+            chunkEnd = min(periodStart + width, periodEnd)
+            # the last candle opening before chunkEnd may close after it
+            candles = self.findCandlesArray(exchange, pair, interval, periodStart,
+                                            min(chunkEnd + interval.timedelta(), periodEnd))
+            candles = candles[(candles['openTime'] < util.toEpochMs(chunkEnd)) & (candles['closeTime'] <= periodEndMs)]
+            if len(candles) > 0:
+                yield candles
+            periodStart = chunkEnd
+
+    def _findOpenTimes(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                       periodEnd: datetime) -> np.ndarray:
+        return self.findCandlesArray(exchange, pair, interval, periodStart, periodEnd)['openTime']
+
+    def findMissingCandlePeriods(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                                 periodEnd: datetime) -> \
+            List[Tuple[datetime, datetime]]:
+        _logger.debug(f'Looking for missing klines: {pair} klines ({interval}) {exchange} for the period {periodStart} - {periodEnd}')
+        periodStart = util.ceilDatetime(periodStart, interval.timedelta()).astimezone(timezone.utc)
+        periodEnd = util.floorDatetime(periodEnd, interval.timedelta()).astimezone(timezone.utc)
+
+        # Only periods that are not covered by a previous fetch have to be checked candle by candle
+        missingPeriods = []
+        coverage = self.findCoverage(exchange, pair, interval, periodStart, periodEnd)
+        for uncoveredStart, uncoveredEnd in getUncoveredPeriods(coverage, interval, periodStart, periodEnd):
+            opens = self._findOpenTimes(exchange, pair, interval, uncoveredStart, uncoveredEnd)
+            missingPeriods += getMissingPeriods(opens, interval, uncoveredStart, uncoveredEnd)
+
+        return missingPeriods
+
+
+def getUncoveredPeriods(coverage: List[Tuple[datetime, datetime]], interval: m.Interval, periodStart: datetime,
+                        periodEnd: datetime) -> List[Tuple[datetime, datetime]]:
+    '''
+    Given the ordered covered periods, returns the periods between the (already rounded) `periodStart` and
+    `periodEnd` that contain slots which are not completely covered.
+    '''
+    width = interval.timedelta()
+    uncovered = []
+    begin = periodStart
+    for coveredStart, coveredEnd in coverage:
+        # only the slots that lie completely within the covered period count as covered
+        coveredStart = periodStart - ((periodStart - coveredStart) // width) * width
+        coveredEnd = periodStart + ((coveredEnd - periodStart) // width) * width
+        if coveredStart > begin:
+            uncovered.append((begin, min(coveredStart, periodEnd)))
+        begin = max(begin, coveredEnd)
+
+    if begin < periodEnd:
+        uncovered.append((begin, periodEnd))
+
+    return uncovered
+
+
+def getMissingPeriods(opens: np.ndarray, interval: m.Interval, periodStart: datetime, periodEnd: datetime) -> \
+        List[List[datetime]]:
+    '''
+    Given the epoch openTimes (in ms) of the available candles, returns the periods [begin, end] of the interval slots
+    between the (already rounded) `periodStart` and `periodEnd` without a candle.
+    '''
+    nSlots = max(0, int((periodEnd - periodStart) / interval.timedelta()))
+    step = interval.milliseconds()
+    offsets = np.asarray(opens, dtype=np.int64) - util.toEpochMs(periodStart)
+    offsets = offsets[(offsets >= 0) & (offsets < nSlots * step) & (offsets % step == 0)]
+
+    missing = np.ones(nSlots + 2, dtype=bool)
+    missing[[0, -1]] = False
+    missing[offsets // step + 1] = False
+    edges = np.flatnonzero(missing[1:] != missing[:-1])
+
+    return [[periodStart + int(begin) * interval.timedelta(), periodStart + int(end) * interval.timedelta()]
+            for begin, end in zip(edges[::2], edges[1::2])]
@@ -1,115 +1,610 @@
 import logging
+import threading
 from datetime import datetime, timezone
-from typing import List, Tuple
+from typing import Callable, Dict, Hashable, Iterator, List, Sequence, Tuple
 
+import numpy as np
 import sqlalchemy as sql
 import sqlalchemy.exc as exc
 import sqlalchemy.orm as orm
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.pool import SingletonThreadPool
 
 import eopsin.model as m
 import eopsin.util as util
 from eopsin.model._sqlbase import Base
+from .candlecache import CandleCache, sliceCandles
+from .candlestore import CandleStore
 
 _logger = logging.getLogger(__name__)
 
+_CANDLE_KEY_COLUMNS = ['exchange_id', 'pair_id', 'interval', 'openTime']
+_CANDLE_VALUE_COLUMNS = ['closeTime', 'open', 'high', 'low', 'close', 'volume', 'quoteAssetVolume', 'numberOfTrades',
+                         'takerBuyBaseAssetVolume', 'takerBuyQuoteAssetVolume']
+_SQLITE_BUSY_TIMEOUT_MS = 30000
+# julian day of the unix epoch
+_JULIAN_DAY_EPOCH = 2440587.5
+_MS_PER_DAY = 86400000
 
-class DBService:
-    def __init__(self, engine):
+
+def _setSqlitePragmas(dbapiConnection, connectionRecord) -> None:
+    cursor = dbapiConnection.cursor()
+    # WAL lets readers proceed while another connection writes, concurrent writers wait for the lock
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute(f'PRAGMA busy_timeout={_SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.close()
+
+
+class DBService(CandleStore):
+    _ARRAY_CHUNK_SIZE = 10000
+    # assets per query, bounded by the maximum number of parameters of older sqlite versions (999)
+    _PAIR_CHUNK_SIZE = 900
+
+    def __init__(self, engine, candleLayout: m.CandleLayout = None, candleCache: CandleCache = None,
+                 timestampFormat: m.TimestampFormat = None):
+        '''
+        New databases are created with the given `candleLayout` (default: ROWID) and `timestampFormat` (default:
+        DATETIME). Existing databases are migrated if their layout or format differs from an explicitly given one.
+        Candle reads are served from the optional `candleCache`.
+        Each thread works on its own session, such that a DBService can be shared between threads. Sqlite connections
+        are switched to WAL mode and wait for locks held by other connections.
+        File and server databases are expected to use a pool handing out a connection per session, like the default
+        pools of SQLAlchemy do. In-memory sqlite databases live in a single connection: with the default pool each
+        thread would see a database of its own, so they can only be used by the thread creating the service.
+        '''
         self.engine = engine
-        Base.metadata.create_all(engine)
+        self.candleCache = candleCache
+        self._memoryThread = threading.get_ident() if self._isThreadLocalMemory(engine) else None
+        if engine.dialect.name == 'sqlite' and not sql.event.contains(engine, 'connect', _setSqlitePragmas):
+            sql.event.listen(engine, 'connect', _setSqlitePragmas)
+        # loaded entities stay usable in other threads after a commit
+        self.Session = orm.scoped_session(orm.sessionmaker(bind=engine, expire_on_commit=False))
+        self._coverageLock = threading.Lock()
+        # identity cache of the immutable exchange and pair entities
+        self._exchanges: Dict[str, m.Exchange] = {}
+        self._pairs: Dict[Tuple[str, str], m.Pair] = {}
+        self._createTables(candleLayout, timestampFormat)
+
+    @staticmethod
+    def _isThreadLocalMemory(engine) -> bool:
+        return engine.dialect.name == 'sqlite' and engine.url.database in (None, '', ':memory:') and \
+               isinstance(engine.pool, SingletonThreadPool)
+
+    @property
+    def session(self) -> orm.Session:
+        ''' The session of the calling thread '''
+        if self._memoryThread is not None and threading.get_ident() != self._memoryThread:
+            raise RuntimeError('In-memory sqlite databases can not be shared between threads, use a file database')
+        return self.Session()
+
+    def removeSession(self) -> None:
+        ''' Closes the session of the calling thread, e.g. before a worker thread terminates '''
+        self.Session.remove()
+
+    def _createTables(self, candleLayout: m.CandleLayout, timestampFormat: m.TimestampFormat) -> None:
+        if sql.inspect(self.engine).has_table(m.Candle.__tablename__):
+            # existing databases are read in their layout and format until they are migrated
+            layout, self._timestampFormat = self.getCandleLayout(), self.getTimestampFormat()
+        else:
+            layout = candleLayout or m.CandleLayout.ROWID
+            self._timestampFormat = timestampFormat or m.TimestampFormat.DATETIME
+        self._candleTable, self._coverageTable = self._getTables(layout, self._timestampFormat)
+
+        Base.metadata.create_all(self.engine, tables=[table for table in Base.metadata.sorted_tables if table.name
+                                                      not in (m.Candle.__tablename__, m.CandleCoverage.__tablename__)])
+        with self.engine.begin() as connection:
+            self._candleTable.create(connection, checkfirst=True)
+            self._coverageTable.create(connection, checkfirst=True)
+
+        if candleLayout is not None:
+            self.migrateCandleLayout(candleLayout)
+        if timestampFormat is not None:
+            self.migrateTimestampFormat(timestampFormat)
+
+    @staticmethod
+    def _getTables(layout: m.CandleLayout, timestampFormat: m.TimestampFormat) -> Tuple[sql.Table, sql.Table]:
+        '''
+        Returns copies of the candle and coverage tables with the given layout, whose timestamps are stored in the given
+        format. Each service accesses its database through its own copies, such that the mapped models are not bound to
+        a format.
+        '''
+        metadata = sql.MetaData()
+        for table in (m.Exchange.__table__, m.Pair.__table__):
+            table.to_metadata(metadata)
+
+        candleTable, coverageTable = [table.to_metadata(metadata)
+                                      for table in (m.Candle.__table__, m.CandleCoverage.__table__)]
+        for table in (candleTable, coverageTable):
+            for column in table.columns:
+                if isinstance(column.type, m.TimeStamp):
+                    column.type = m.TimeStamp(timestampFormat)
+
+        if layout is m.CandleLayout.CLUSTERED:
+            metadata.remove(candleTable)
+            columns = [sql.Column(column.name, column.type, *[sql.ForeignKey(key.target_fullname)
+                                                              for key in column.foreign_keys])
+                       for column in candleTable.columns]
+            candleTable = sql.Table(m.Candle.__tablename__, metadata, *columns,
+                                    sql.PrimaryKeyConstraint(*_CANDLE_KEY_COLUMNS, name='_candle_key'),
+                                    sqlite_with_rowid=False)
+        return candleTable, coverageTable
+
+    @property
+    def candleTable(self) -> sql.Table:
+        ''' The candle table in the layout and timestamp format of the database, e.g. for bulk inserts '''
+        return self._candleTable
+
+    def getCandleLayout(self) -> m.CandleLayout:
+        primaryKey = sql.inspect(self.engine).get_pk_constraint(m.Candle.__tablename__)['constrained_columns']
+        return m.CandleLayout.ROWID if primaryKey == ['id'] else m.CandleLayout.CLUSTERED
+
+    def migrateCandleLayout(self, layout: m.CandleLayout) -> None:
+        ''' Rebuilds the candle table with the given layout, keeping all stored candles '''
+        if self.getCandleLayout() is layout:
+            return
+
+        _logger.info(f'Migrating the candle table to the {layout.name} layout')
+        self.session.commit()
+        candleTable, _ = self._getTables(layout, self._timestampFormat)
+        with self.engine.begin() as connection:
+            self._rebuildTable(connection, m.Candle.__tablename__, candleTable.create,
+                               _CANDLE_KEY_COLUMNS + _CANDLE_VALUE_COLUMNS)
+        self._candleTable = candleTable
 
-        Session = sql.orm.sessionmaker(bind=engine)
-        self.session = Session()
+    def getTimestampFormat(self) -> m.TimestampFormat:
+        columns = {column['name']: column['type'] for column in
+                   sql.inspect(self.engine).get_columns(m.Candle.__tablename__)}
+        return m.TimestampFormat.EPOCH_MS if isinstance(columns['openTime'], sql.Integer) \
+            else m.TimestampFormat.DATETIME
+
+    def migrateTimestampFormat(self, timestampFormat: m.TimestampFormat) -> None:
+        ''' Rebuilds the candle and coverage tables with timestamps stored in the given format '''
+        if self.getTimestampFormat() is timestampFormat:
+            return
+
+        _logger.info(f'Migrating the timestamps to the {timestampFormat.name} format')
+        self.session.commit()
+        convert = self._getTimestampConversion(timestampFormat)
+        candleTable, coverageTable = self._getTables(self.getCandleLayout(), timestampFormat)
+        with self.engine.begin() as connection:
+            self._rebuildTable(connection, m.Candle.__tablename__, candleTable.create,
+                               _CANDLE_KEY_COLUMNS + _CANDLE_VALUE_COLUMNS,
+                               {'openTime': convert, 'closeTime': convert})
+            self._rebuildTable(connection, m.CandleCoverage.__tablename__, coverageTable.create,
+                               [column.name for column in coverageTable.columns],
+                               {'periodStart': convert, 'periodEnd': convert})
+        self._timestampFormat = timestampFormat
+        self._candleTable, self._coverageTable = candleTable, coverageTable
+
+        if self.candleCache is not None:
+            self.candleCache.clear()
+
+    def _getTimestampConversion(self, timestampFormat: m.TimestampFormat) -> Callable[[str], str]:
+        ''' Returns a function building the SQL expression converting a timestamp column to the given format '''
+        dialect = self.engine.dialect.name
+        if dialect == 'sqlite':
+            if timestampFormat is m.TimestampFormat.EPOCH_MS:
+                return lambda column: f"CAST(strftime('%s', {column}) AS INTEGER) * 1000 + " \
+                                      f"CAST(substr(strftime('%f', {column}), 4) AS INTEGER)"
+            # same text representation as the sqlite DateTime type
+            return lambda column: f"strftime('%Y-%m-%d %H:%M:%f', {column} / 1000.0, 'unixepoch') || '000'"
+        elif dialect == 'postgresql':
+            if timestampFormat is m.TimestampFormat.EPOCH_MS:
+                return lambda column: f'CAST(ROUND(EXTRACT(EPOCH FROM {column}) * 1000) AS BIGINT)'
+            return lambda column: f"to_timestamp({column} / 1000.0) AT TIME ZONE 'UTC'"
+        else:
+            raise NotImplementedError(f'Timestamp migration is not supported for {dialect}')
+
+    def _rebuildTable(self, connection, table: str, create: Callable, columns: List[str],
+                      conversions: Dict[str, Callable[[str], str]] = {}) -> None:
+        '''
+        Replaces the table by the one created by `create`, copying the given columns of all rows. The values are
+        converted by the SQL expressions built by `conversions`.
+        '''
+        quote = self.engine.dialect.identifier_preparer.quote
+        targets = ', '.join(quote(column) for column in columns)
+        sources = ', '.join(conversions[column](quote(column)) if column in conversions else quote(column)
+                            for column in columns)
+        connection.execute(sql.text(f'CREATE TABLE {table}_migration AS SELECT * FROM {table}'))
+        connection.execute(sql.text(f'DROP TABLE {table}'))
+        create(connection)
+        connection.execute(sql.text(f'INSERT INTO {table} ({targets}) SELECT {sources} FROM {table}_migration'))
+        connection.execute(sql.text(f'DROP TABLE {table}_migration'))
 
     def addExchange(self, name: str) -> m.Exchange:
         exchange = m.Exchange(name=name)
         self.session.add(exchange)
         self.session.commit()
 
-        return exchange
+        return self._cacheEntity(self._exchanges, name, exchange)
 
     def findExchange(self, name: str) -> m.Exchange:
-        exchange = self.session.query(m.Exchange).filter(m.Exchange.name == name).first()
+        exchange = self._exchanges.get(name)
+        if exchange is None:
+            exchange = self.session.query(m.Exchange).filter(m.Exchange.name == name).first()
+            if exchange is not None:
+                exchange = self._cacheEntity(self._exchanges, name, exchange)
         return exchange
 
     def getExchange(self, name: str) -> m.Exchange:
         exchange = self.findExchange(name)
         if exchange:
             return exchange
-        else:
+
+        try:
             return self.addExchange(name)
+        except exc.IntegrityError:
+            # added concurrently by another thread or process
+            self.session.rollback()
+            return self.findExchange(name)
 
     def addPair(self, pair: m.Pair):
         self.session.add(pair)
         self.session.commit()
+        self._cacheEntity(self._pairs, (pair.asset, pair.currency), pair)
 
     def findPair(self, asset: str, currency: str):
-        return self.session.query(m.Pair).filter(sql.and_(
-            m.Pair.asset == asset, m.Pair.currency == currency)).first()
+        pair = self._pairs.get((asset, currency))
+        if pair is None:
+            pair = self.session.query(m.Pair).filter(sql.and_(
+                m.Pair.asset == asset, m.Pair.currency == currency)).first()
+            if pair is not None:
+                pair = self._cacheEntity(self._pairs, (asset, currency), pair)
+        return pair
 
     def getPair(self, asset: str, currency: str):
         pair = self.findPair(asset, currency)
         if pair is None:
             pair = m.Pair(asset=asset, currency=currency)
-            self.addPair(pair)
+            try:
+                self.addPair(pair)
+            except exc.IntegrityError:
+                # added concurrently by another thread or process
+                self.session.rollback()
+                pair = self.findPair(asset, currency)
         return pair
 
-    def addCandle(self, candle: m.Candle):
+    def findPairs(self, pairs: Sequence[Tuple[str, str]]) -> List[m.Pair]:
+        '''
+        Looks up the given (asset, currency) pairs, querying the uncached ones at once. Unknown pairs are returned as
+        None.
+        '''
+        assets = list({asset for asset, currency in pairs if (asset, currency) not in self._pairs})
+        for idx in range(0, len(assets), self._PAIR_CHUNK_SIZE):
+            query = self.session.query(m.Pair).filter(m.Pair.asset.in_(assets[idx:idx + self._PAIR_CHUNK_SIZE]))
+            for pair in query.all():
+                self._cacheEntity(self._pairs, (pair.asset, pair.currency), pair)
+        return [self._pairs.get(key) for key in pairs]
+
+    def getPairs(self, pairs: Sequence[Tuple[str, str]]) -> List[m.Pair]:
+        ''' Same as `getPair` for many (asset, currency) pairs. Missing pairs are added in a single transaction. '''
+        found = self.findPairs(pairs)
+        missing = list(dict.fromkeys(key for key, pair in zip(pairs, found) if pair is None))
+        if not missing:
+            return found
+
         try:
-            self.session.add(candle)
+            # a single executemany, the ORM would insert row by row to fetch the ids
+            self.session.execute(sql.insert(m.Pair.__table__),
+                                 [dict(asset=asset, currency=currency) for asset, currency in missing])
             self.session.commit()
-        except sql.exc.IntegrityError:
+        except exc.IntegrityError:
+            # some were added concurrently by another thread or process
             self.session.rollback()
+            return [self.getPair(asset, currency) for asset, currency in pairs]
 
-    def addCandles(self, candles: List[m.Candle]):
-        _logger.debug(f'Adding klines to the db: {candles}')
-        for candle in candles:
-            self.addCandle(candle)
+        self.findPairs(missing)
+        return [self._pairs[key] for key in pairs]
+
+    def _cacheEntity(self, cache: dict, key: Hashable, entity):
+        # Cached entities are detached, such that no rollback of the loading session expires them while other threads
+        # are using them
+        self.session.expunge(entity)
+        return cache.setdefault(key, entity)
+
+    def addCandle(self, candle: m.Candle):
+        # Inserted as row, such that the candle may reference entities loaded by the session of another thread
+        self.addCandles([candle])
+
+    def addCandles(self, candles: List[m.Candle], batchSize: int = 10000) -> Tuple[int, int]:
+        '''
+        Inserts the candles in batches of `batchSize` rows per transaction. Candles that are already stored
+        (w.r.t. the `_candle_unique` constraint) are skipped. Returns the number of inserted and skipped candles.
+        '''
+        _logger.debug(f'Adding {len(candles)} klines to the db')
+        rows = [self._getCandleRow(candle) for candle in candles]
+        try:
+            return self._insertCandleRows(rows, batchSize)
+        finally:
+            self._invalidateCachedCandles(rows)
+
+    def addCandlesArray(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, candles: np.ndarray,
+                        batchSize: int = 10000) -> Tuple[int, int]:
+        _logger.debug(f'Adding {len(candles)} klines of {pair} ({interval}) {exchange} to the db')
+        # the timestamps are bound as epoch milliseconds, see `TimeStamp`
+        values = [candles[name].tolist() for name in m.CANDLE_DTYPE.names[:2]] + \
+                 [self._fromColumn(candles[name]) for name in m.CANDLE_DTYPE.names[2:]]
+        rows = [dict(zip(m.CANDLE_DTYPE.names, row), exchange_id=exchange.id, pair_id=pair.id, interval=interval)
+                for row in zip(*values)]
+        try:
+            return self._insertCandleRows(rows, batchSize)
+        finally:
+            self._invalidateCachedCandles(rows)
+
+    def _invalidateCachedCandles(self, rows: List[dict]) -> None:
+        if self.candleCache is not None:
+            for key in {(row['exchange_id'], row['pair_id'], row['interval']) for row in rows}:
+                self.candleCache.invalidateCandles(key)
+
+    @staticmethod
+    def _fromColumn(values: np.ndarray) -> list:
+        ''' Inverse of `_toColumn`, unset values are stored as NULL '''
+        unset = np.isnan(values) if values.dtype.kind == 'f' else values == m.UNSET_TRADES
+        column = values.tolist()
+        for idx in np.flatnonzero(unset):
+            column[idx] = None
+        return column
+
+    @staticmethod
+    def _getCandleRow(candle: m.Candle) -> dict:
+        row = {column: getattr(candle, column) for column in _CANDLE_VALUE_COLUMNS}
+        row['exchange_id'] = candle.exchange.id if candle.exchange is not None else candle.exchange_id
+        row['pair_id'] = candle.pair.id if candle.pair is not None else candle.pair_id
+        row['interval'] = candle.interval
+        row['openTime'] = candle.openTime
+        return row
+
+    def _getCandleInsertIgnore(self):
+        table = self._candleTable
+        dialect = self.engine.dialect.name
+        if dialect == 'sqlite':
+            return sqlite.insert(table).on_conflict_do_nothing(index_elements=_CANDLE_KEY_COLUMNS)
+        elif dialect == 'postgresql':
+            return postgresql.insert(table).on_conflict_do_nothing(index_elements=_CANDLE_KEY_COLUMNS)
+        elif dialect in ('mysql', 'mariadb'):
+            return sql.insert(table).prefix_with('IGNORE')
+        else:
+            return None
+
+    def _insertCandleRows(self, rows: List[dict], batchSize: int) -> Tuple[int, int]:
+        statement = self._getCandleInsertIgnore()
+        if statement is None:
+            # No dialect-level conflict handling available: fall back to row-wise inserts
+            inserted = 0
+            for row in rows:
+                try:
+                    self.session.execute(sql.insert(self._candleTable), row)
+                    self.session.commit()
+                    inserted += 1
+                except sql.exc.IntegrityError:
+                    self.session.rollback()
+            return inserted, len(rows) - inserted
+
+        inserted = 0
+        for idx in range(0, len(rows), batchSize):
+            batch = rows[idx:idx + batchSize]
+            try:
+                result = self.session.execute(statement, batch)
+                self.session.commit()
+            except Exception:
+                self.session.rollback()
+                raise
+            inserted += result.rowcount
+
+        return inserted, len(rows) - inserted
 
     def findCandles(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
                     periodEnd: datetime) -> List[m.Candle]:
-        _logger.debug(f'Loading klines from the db: {pair} klines ({interval}) {exchange} for the period {periodStart} - {periodEnd}')
-        return self.session.query(m.Candle) \
-            .filter(sql.and_(m.Candle.exchange_id == exchange.id,
-                             m.Candle.pair_id == pair.id,
-                             m.Candle.interval == interval,
-                             m.Candle.openTime >= periodStart,
-                             m.Candle.closeTime <= periodEnd)) \
-            .order_by(m.Candle.openTime).all()
-
-    def findMissingCandlePeriods(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
-                                 periodEnd: datetime) -> \
-            List[Tuple[datetime, datetime]]:
-        _logger.debug(f'Looking for missing klines in the db: {pair} klines ({interval}) {exchange} for the period {periodStart} - {periodEnd}')
-        periodStart = util.ceilDatetime(periodStart, interval.timedelta()).astimezone(timezone.utc)
-        periodEnd = util.floorDatetime(periodEnd, interval.timedelta()).astimezone(timezone.utc)
-        candles = self.session.query(m.Candle) \
-            .filter(sql.and_(m.Candle.exchange_id == exchange.id,
-                             m.Candle.pair_id == pair.id,
-                             m.Candle.interval == interval,
-                             m.Candle.openTime >= periodStart,
-                             m.Candle.closeTime <= periodEnd)) \
-            .options(sql.orm.load_only('openTime')) \
-            .order_by(m.Candle.openTime)
-
-        opens = [candle.openTime for candle in candles]
-
-        missingPeriods = []
-        currentBegin = None
-        currentEnd = None
-
-        for idx in range(int((periodEnd - periodStart) / interval.timedelta())):
-            openTime = periodStart + idx * interval.timedelta()
-            if openTime not in opens:
-                if currentBegin is None:
-                    currentBegin = openTime
-                currentEnd = openTime + interval.timedelta()
-            else:
-                if currentEnd is not None:
-                    missingPeriods.append([currentBegin, currentEnd])
-                    currentBegin = currentEnd = None
-
-        if currentEnd is not None:
-            missingPeriods.append([currentBegin, currentEnd])
-
-        return missingPeriods
+        # the candles are built from the array, as the mapped timestamps do not know the format of the database
+        candles = self.findCandlesArray(exchange, pair, interval, periodStart, periodEnd)
+        return [m.Candle.fromRecord(exchange, pair, interval, candle) for candle in candles]
+
+    def findCandlesArray(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                         periodEnd: datetime) -> np.ndarray:
+        '''
+        Same as `findCandles` but returns a structured array of `CANDLE_DTYPE` (timestamps as epoch milliseconds)
+        instead of candle entities.
+        '''
+        if self.candleCache is None:
+            return self._loadCandlesArray(exchange, pair, interval, periodStart, periodEnd)
+
+        key = (exchange.id, pair.id, interval)
+        periodStart, periodEnd = util.toEpochMs(periodStart), util.toEpochMs(periodEnd)
+        candles = self.candleCache.findCandles(key, periodStart, periodEnd)
+        if candles is None:
+            loadStart, loadEnd = self.candleCache.getLoadPeriod(key, periodStart, periodEnd)
+            version = self.candleCache.getVersion(key)
+            loaded = self._loadCandlesArray(exchange, pair, interval, util.fromEpochMs(loadStart),
+                                            util.fromEpochMs(loadEnd))
+            self.candleCache.addCandles(key, loadStart, loadEnd, loaded, version)
+            candles = sliceCandles(loaded, periodStart, periodEnd)
+        return candles
+
+    def iterCandlesArray(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                         periodEnd: datetime, chunkSize: int = 10000) -> Iterator[np.ndarray]:
+        '''
+        Yields the ordered candles of the period as arrays of at most `chunkSize` candles. Every chunk is a separate
+        query continuing after the last openTime, such that no cursor is kept open between chunks. The candle cache
+        is bypassed.
+        '''
+        while True:
+            candles = self._loadCandlesArray(exchange, pair, interval, periodStart, periodEnd, limit=chunkSize)
+            if len(candles) > 0:
+                yield candles
+            if len(candles) < chunkSize:
+                return
+            periodStart = util.fromEpochMs(int(candles['openTime'][-1]) + 1)
+
+    def _loadCandlesArray(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                          periodEnd: datetime, limit: int = None) -> np.ndarray:
+        _logger.debug(f'Loading kline array from the db: {pair} klines ({interval}) {exchange} for the period {periodStart} - {periodEnd}')
+        table = self._candleTable
+        # The redundant upper bound on openTime limits the scan over the candle key index from both sides
+        query = sql.select(self._selectTimestamp(table.c.openTime),
+                           self._selectTimestamp(table.c.closeTime),
+                           *[table.c[name] for name in m.CANDLE_DTYPE.names[2:]]) \
+            .where(sql.and_(table.c.exchange_id == exchange.id,
+                            table.c.pair_id == pair.id,
+                            table.c.interval == interval,
+                            table.c.openTime >= periodStart,
+                            table.c.openTime < periodEnd,
+                            table.c.closeTime <= periodEnd)) \
+            .order_by(table.c.openTime) \
+            .limit(limit)
+        result = self.session.connection().execute(query)
+        rowDtype = self._getRowDtype()
+        # numeric rows need no result processing, such that the plain tuples of the DBAPI cursor are parsed by numpy
+        fetchmany = result.fetchmany if rowDtype is None else result.cursor.fetchmany
+        chunks = [np.zeros(0, dtype=m.CANDLE_DTYPE)]
+        try:
+            # convert chunk-wise to keep the number of intermediate row tuples bounded
+            for rows in iter(lambda: fetchmany(self._ARRAY_CHUNK_SIZE), []):
+                chunks.append(self._getCandleArray(rows, rowDtype))
+        finally:
+            result.close()
+        return np.concatenate(chunks)
+
+    def _getRowDtype(self) -> np.dtype:
+        ''' Returns the dtype of the selected candle rows, None if the timestamps are selected as datetimes '''
+        if self._timestampFormat is m.TimestampFormat.EPOCH_MS:
+            return m.CANDLE_DTYPE
+        if self.engine.dialect.name == 'sqlite':
+            return np.dtype([(name, np.float64 if name in ('openTime', 'closeTime') else m.CANDLE_DTYPE[name])
+                             for name in m.CANDLE_DTYPE.names])
+        return None
+
+    def _getCandleArray(self, rows: list, rowDtype: np.dtype = None) -> np.ndarray:
+        columns = None
+        if rowDtype is not None:
+            try:
+                # numpy parses the plain row tuples at once, unless an integer is unset
+                columns = np.array(rows, dtype=rowDtype)
+            except TypeError:
+                pass
+        if columns is None:
+            columns = dict(zip(m.CANDLE_DTYPE.names, zip(*rows)))
+
+        candles = np.zeros(len(rows), dtype=m.CANDLE_DTYPE)
+        candles['openTime'] = self._toEpochMs(columns['openTime'])
+        candles['closeTime'] = self._toEpochMs(columns['closeTime'])
+        for name in m.CANDLE_DTYPE.names[2:]:
+            candles[name] = self._toColumn(columns[name], m.CANDLE_DTYPE[name])
+        return candles
+
+    @staticmethod
+    def _toColumn(values: Sequence, dtype: np.dtype) -> np.ndarray:
+        # unset values are returned as nan or `UNSET_TRADES` respectively
+        if not isinstance(values, np.ndarray) and None in values:
+            fill = np.nan if dtype.kind == 'f' else m.UNSET_TRADES
+            values = [fill if value is None else value for value in values]
+        return np.array(values, dtype=dtype)
+
+    def _findOpenTimes(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                       periodEnd: datetime) -> np.ndarray:
+        if self.candleCache is not None:
+            return super()._findOpenTimes(exchange, pair, interval, periodStart, periodEnd)
+
+        table = self._candleTable
+        query = sql.select(self._selectTimestamp(table.c.openTime)) \
+            .where(sql.and_(table.c.exchange_id == exchange.id,
+                            table.c.pair_id == pair.id,
+                            table.c.interval == interval,
+                            table.c.openTime >= periodStart,
+                            table.c.openTime < periodEnd,
+                            table.c.closeTime <= periodEnd))
+        return self._toEpochMs(self.session.execute(query).scalars().all())
+
+    def addCoverage(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                    periodEnd: datetime) -> None:
+        '''
+        Records that all candles in the given period have been fetched from the exchange and stored. The period is
+        merged with overlapping or adjacent periods that are already recorded.
+        '''
+        periodStart = periodStart.astimezone(timezone.utc)
+        periodEnd = periodEnd.astimezone(timezone.utc)
+        if periodStart >= periodEnd:
+            return
+
+        _logger.debug(f'Adding coverage to the db: {pair} klines ({interval}) {exchange} for the period {periodStart} - {periodEnd}')
+        # merging is a read-modify-write of the overlapping spans
+        with self._coverageLock:
+            self._mergeCoverage(exchange, pair, interval, periodStart, periodEnd)
+
+    def _mergeCoverage(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                       periodEnd: datetime) -> None:
+        try:
+            table = self._coverageTable
+            query = sql.select(table.c.id, table.c.periodStart, table.c.periodEnd) \
+                .where(sql.and_(table.c.exchange_id == exchange.id,
+                                table.c.pair_id == pair.id,
+                                table.c.interval == interval,
+                                table.c.periodStart <= periodEnd,
+                                table.c.periodEnd >= periodStart))
+            spans = self.session.execute(query).all()
+            for span in spans:
+                periodStart = min(periodStart, span.periodStart)
+                periodEnd = max(periodEnd, span.periodEnd)
+            if spans:
+                self.session.execute(sql.delete(table).where(table.c.id.in_([span.id for span in spans])))
+
+            self.session.execute(sql.insert(table), dict(exchange_id=exchange.id, pair_id=pair.id, interval=interval,
+                                                         periodStart=periodStart, periodEnd=periodEnd))
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        finally:
+            if self.candleCache is not None:
+                self.candleCache.invalidateCoverage((exchange.id, pair.id, interval))
+
+    def findCoverage(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                     periodEnd: datetime) -> List[Tuple[datetime, datetime]]:
+        ''' Returns the ordered covered periods overlapping with the given period '''
+        if self.candleCache is not None:
+            key = (exchange.id, pair.id, interval)
+            coverage = self.candleCache.findCoverage(key)
+            if coverage is None:
+                version = self.candleCache.getVersion(key)
+                coverage = self._loadCoverage(exchange, pair, interval)
+                self.candleCache.setCoverage(key, coverage, version)
+            return [(begin, end) for begin, end in coverage if begin < periodEnd and end > periodStart]
+
+        return self._loadCoverage(exchange, pair, interval, periodStart, periodEnd)
+
+    def _loadCoverage(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime = None,
+                      periodEnd: datetime = None) -> List[Tuple[datetime, datetime]]:
+        table = self._coverageTable
+        condition = sql.and_(table.c.exchange_id == exchange.id,
+                             table.c.pair_id == pair.id,
+                             table.c.interval == interval)
+        if periodStart is not None and periodEnd is not None:
+            condition = sql.and_(condition,
+                                 table.c.periodStart < periodEnd,
+                                 table.c.periodEnd > periodStart)
+        query = sql.select(table.c.periodStart, table.c.periodEnd) \
+            .where(condition) \
+            .order_by(table.c.periodStart)
+        return [(begin, end) for begin, end in self.session.execute(query).all()]
+
+    def _selectTimestamp(self, column):
+        ''' Selects the timestamp column in a representation, which `_toEpochMs` converts without datetime objects '''
+        if self._timestampFormat is m.TimestampFormat.EPOCH_MS:
+            # the stored integers already are epoch milliseconds
+            return sql.type_coerce(column, sql.BigInteger)
+        # sqlite stores datetimes as ISO strings, their julian days are computed much faster than datetimes are parsed
+        if self.engine.dialect.name == 'sqlite':
+            return sql.type_coerce(sql.func.julianday(column), sql.Float)
+        return column
+
+    @staticmethod
+    def _toEpochMs(values: Sequence) -> np.ndarray:
+        if len(values) > 0 and isinstance(values[0], (int, np.integer)):
+            return np.array(values, dtype=np.int64)
+        if len(values) > 0 and isinstance(values[0], (float, np.floating)):
+            # julian days as selected from sqlite, which are exact to the millisecond
+            days = np.array(values, dtype=np.float64) - _JULIAN_DAY_EPOCH
+            return np.round(days * _MS_PER_DAY).astype(np.int64)
+
+        # naive datetimes are stored in utc
+        return np.array([util.toEpochMs(value if value.tzinfo else value.replace(tzinfo=timezone.utc))
+                         for value in values], dtype=np.int64)
@@ -0,0 +1,276 @@
+import json
+import logging
+import mmap
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import eopsin.model as m
+import eopsin.util as util
+from .candlestore import CandleStore
+
+_logger = logging.getLogger(__name__)
+
+# openTime is implied by the slot index
+_COLUMNS = m.CANDLE_DTYPE.names[1:]
+_MASK = 'present'
+
+
+class _Series:
+    '''
+    Candles of a single (exchange, pair, interval) stored as append-only, fixed-width column files. The candle with
+    a given openTime lives in slot (openTime - baseOpenTime) / interval of every column file, and the presence mask
+    tells which slots hold a candle. The column files are mapped until `close` is called, which also happens before
+    they are resized.
+    '''
+    directory: str
+    step: int
+    baseOpenTime: int
+    nSlots: int
+    coverage: List[Tuple[int, int]]
+
+    def __init__(self, directory: str, interval: m.Interval):
+        self.directory = directory
+        self.step = interval.milliseconds()
+        self.baseOpenTime = None
+        self.nSlots = 0
+        self.coverage = []
+        self._mmaps: Dict[str, mmap.mmap] = {}
+        self._columns: Dict[str, np.ndarray] = {}
+
+        if os.path.exists(self._metaPath):
+            with open(self._metaPath) as file:
+                meta = json.load(file)
+            self.baseOpenTime = meta['baseOpenTime']
+            self.nSlots = meta['nSlots']
+            self.coverage = [tuple(period) for period in meta['coverage']]
+            self._open()
+
+    @property
+    def _metaPath(self) -> str:
+        return os.path.join(self.directory, 'meta.json')
+
+    def _columnPath(self, name: str) -> str:
+        return os.path.join(self.directory, f'{name}.bin')
+
+    @staticmethod
+    def _dtype(name: str) -> np.dtype:
+        return np.dtype(np.uint8) if name == _MASK else m.CANDLE_DTYPE[name].newbyteorder('<')
+
+    def _saveMeta(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        meta = {'baseOpenTime': self.baseOpenTime, 'nSlots': self.nSlots, 'coverage': self.coverage}
+        with open(self._metaPath + '.tmp', 'w') as file:
+            json.dump(meta, file)
+        os.replace(self._metaPath + '.tmp', self._metaPath)
+
+    def _open(self) -> None:
+        self._columns = {}
+        if self.nSlots > 0:
+            for name in _COLUMNS + (_MASK,):
+                dtype = self._dtype(name)
+                with open(self._columnPath(name), 'r+b') as file:
+                    self._mmaps[name] = mmap.mmap(file.fileno(), self.nSlots * dtype.itemsize)
+                self._columns[name] = np.frombuffer(self._mmaps[name], dtype=dtype, count=self.nSlots)
+
+    def _flush(self) -> None:
+        for mapped in self._mmaps.values():
+            mapped.flush()
+
+    def close(self) -> None:
+        '''
+        Flushes and unmaps the column files. Files still referenced by views of the columns stay mapped until the views
+        are released, which prevents resizing them on windows.
+        '''
+        self._flush()
+        self._columns = {}
+        for name, mapped in self._mmaps.items():
+            try:
+                mapped.close()
+            except BufferError:
+                _logger.debug(f'The {name} column of {self.directory} stays mapped until its views are released')
+        self._mmaps = {}
+
+    def _resize(self, baseOpenTime: int, nSlots: int) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self.close()
+        shift = 0 if self.baseOpenTime is None else (self.baseOpenTime - baseOpenTime) // self.step
+        for name in _COLUMNS + (_MASK,):
+            dtype = self._dtype(name)
+            path = self._columnPath(name)
+            if shift > 0:
+                # prepending requires to rewrite the column
+                data = np.fromfile(path, dtype=dtype, count=self.nSlots)
+                resized = np.zeros(nSlots, dtype=dtype)
+                resized[shift:shift + len(data)] = data
+                resized.tofile(path)
+            else:
+                with open(path, 'ab') as file:
+                    file.truncate(nSlots * dtype.itemsize)
+
+        self.baseOpenTime = baseOpenTime
+        self.nSlots = nSlots
+        self._saveMeta()
+        self._open()
+
+    def _getSlots(self, openTimes: np.ndarray) -> np.ndarray:
+        offsets = openTimes - self.baseOpenTime
+        if np.any(offsets % self.step != 0):
+            raise ValueError('Candles are not aligned to the interval slots of the series')
+        return offsets // self.step
+
+    def write(self, candles: np.ndarray) -> Tuple[int, int]:
+        if len(candles) == 0:
+            return 0, 0
+
+        first, last = candles['openTime'].min(), candles['openTime'].max()
+        if self.baseOpenTime is None:
+            self._resize(int(first), 0)
+        baseOpenTime = self.baseOpenTime + min(0, (int(first) - self.baseOpenTime) // self.step) * self.step
+        nSlots = max(self.nSlots + (self.baseOpenTime - baseOpenTime) // self.step,
+                     (int(last) - baseOpenTime) // self.step + 1)
+        if baseOpenTime != self.baseOpenTime or nSlots != self.nSlots:
+            self._resize(baseOpenTime, nSlots)
+
+        slots, unique = np.unique(self._getSlots(candles['openTime']), return_index=True)
+        new = self._columns[_MASK][slots] == 0
+        slots, rows = slots[new], candles[unique[new]]
+        for name in _COLUMNS:
+            self._columns[name][slots] = rows[name]
+        self._columns[_MASK][slots] = 1
+        self._flush()
+
+        return len(slots), len(candles) - len(slots)
+
+    def _getSlotRange(self, periodStart: int, periodEnd: int) -> Tuple[int, int]:
+        begin = -(-(periodStart - self.baseOpenTime) // self.step)
+        end = -(-(periodEnd - self.baseOpenTime) // self.step)
+        return min(max(begin, 0), self.nSlots), min(max(end, 0), self.nSlots)
+
+    def columns(self, periodStart: int, periodEnd: int) -> Dict[str, np.ndarray]:
+        ''' Zero-copy views of the column slots with an openTime in [periodStart, periodEnd), see `close` '''
+        if self.nSlots == 0:
+            return {name: np.zeros(0, dtype=self._dtype(name)) for name in _COLUMNS + (_MASK,)}
+        begin, end = self._getSlotRange(periodStart, periodEnd)
+        return {name: column[begin:end] for name, column in self._columns.items()}
+
+    def read(self, periodStart: int, periodEnd: int) -> np.ndarray:
+        if self.nSlots == 0:
+            return np.zeros(0, dtype=m.CANDLE_DTYPE)
+
+        begin, end = self._getSlotRange(periodStart, periodEnd)
+        selected = (self._columns[_MASK][begin:end] != 0) & (self._columns['closeTime'][begin:end] <= periodEnd)
+        candles = np.zeros(np.count_nonzero(selected), dtype=m.CANDLE_DTYPE)
+        candles['openTime'] = self.baseOpenTime + (np.flatnonzero(selected) + begin) * self.step
+        for name in _COLUMNS:
+            candles[name] = self._columns[name][begin:end][selected]
+        return candles
+
+    def openTimes(self, periodStart: int, periodEnd: int) -> np.ndarray:
+        if self.nSlots == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        begin, end = self._getSlotRange(periodStart, periodEnd)
+        present = (self._columns[_MASK][begin:end] != 0) & (self._columns['closeTime'][begin:end] <= periodEnd)
+        return self.baseOpenTime + (np.flatnonzero(present) + begin) * self.step
+
+    def addCoverage(self, periodStart: int, periodEnd: int) -> None:
+        coverage = []
+        for coveredStart, coveredEnd in self.coverage:
+            if coveredStart <= periodEnd and periodStart <= coveredEnd:
+                periodStart, periodEnd = min(periodStart, coveredStart), max(periodEnd, coveredEnd)
+            else:
+                coverage.append((coveredStart, coveredEnd))
+        self.coverage = sorted(coverage + [(periodStart, periodEnd)])
+        self._saveMeta()
+
+
+class MmapCandleStore(CandleStore):
+    '''
+    Candle store keeping each (exchange, pair, interval) as fixed-width binary column files below `directory`, which
+    are memory-mapped as numpy arrays. Reads are slices of the mapped columns and gap checks are lookups in the presence
+    mask. Exchange and pair entities are still managed by the DBService.
+    The store is meant to be written by a single process at a time. Call `close` to release the mapped files.
+    '''
+    directory: str
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._series: Dict[tuple, _Series] = {}
+
+    def close(self) -> None:
+        ''' Flushes and unmaps the column files of all series, the store can still be used afterwards '''
+        for series in self._series.values():
+            series.close()
+        self._series = {}
+
+    def _getSeries(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval) -> _Series:
+        key = (exchange.name, pair.asset, pair.currency, interval)
+        if key not in self._series:
+            directory = os.path.join(self.directory, exchange.name, f'{pair.asset}_{pair.currency}', interval.value)
+            self._series[key] = _Series(directory, interval)
+        return self._series[key]
+
+    def addCandles(self, candles: List[m.Candle]) -> Tuple[int, int]:
+        _logger.debug(f'Adding {len(candles)} klines to the store')
+        grouped = defaultdict(list)
+        for candle in candles:
+            grouped[(candle.exchange, candle.pair, candle.interval)].append(candle)
+
+        inserted = skipped = 0
+        for (exchange, pair, interval), group in grouped.items():
+            array = np.zeros(len(group), dtype=m.CANDLE_DTYPE)
+            array['openTime'] = [util.toEpochMs(candle.openTime) for candle in group]
+            array['closeTime'] = [util.toEpochMs(candle.closeTime) for candle in group]
+            for name in m.CANDLE_DTYPE.names[2:]:
+                fill = np.nan if m.CANDLE_DTYPE[name].kind == 'f' else m.UNSET_TRADES
+                array[name] = [fill if getattr(candle, name) is None else getattr(candle, name) for candle in group]
+            groupInserted, groupSkipped = self.addCandlesArray(exchange, pair, interval, array)
+            inserted += groupInserted
+            skipped += groupSkipped
+        return inserted, skipped
+
+    def addCandlesArray(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval,
+                        candles: np.ndarray) -> Tuple[int, int]:
+        return self._getSeries(exchange, pair, interval).write(candles)
+
+    def findCandles(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                    periodEnd: datetime) -> List[m.Candle]:
+        candles = self.findCandlesArray(exchange, pair, interval, periodStart, periodEnd)
+        return [m.Candle.fromRecord(exchange, pair, interval, candle) for candle in candles]
+
+    def findCandlesArray(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                         periodEnd: datetime) -> np.ndarray:
+        return self._getSeries(exchange, pair, interval).read(util.toEpochMs(periodStart), util.toEpochMs(periodEnd))
+
+    def findCandleColumns(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                          periodEnd: datetime) -> Dict[str, np.ndarray]:
+        '''
+        Zero-copy views of the stored columns for all slots with an openTime in [periodStart, periodEnd), without
+        openTime. The `present` mask flags the slots holding a candle.
+        The views are invalidated by writes extending the series, which remap the columns: they do not show later
+        writes, and on windows they have to be released before, since mapped files can not be resized.
+        '''
+        return self._getSeries(exchange, pair, interval).columns(util.toEpochMs(periodStart),
+                                                                  util.toEpochMs(periodEnd))
+
+    def addCoverage(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                    periodEnd: datetime) -> None:
+        periodStart, periodEnd = util.toEpochMs(periodStart), util.toEpochMs(periodEnd)
+        if periodStart < periodEnd:
+            self._getSeries(exchange, pair, interval).addCoverage(periodStart, periodEnd)
+
+    def findCoverage(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                     periodEnd: datetime) -> List[Tuple[datetime, datetime]]:
+        periodStart, periodEnd = util.toEpochMs(periodStart), util.toEpochMs(periodEnd)
+        return [(util.fromEpochMs(begin), util.fromEpochMs(end))
+                for begin, end in self._getSeries(exchange, pair, interval).coverage
+                if begin < periodEnd and end > periodStart]
+
+    def _findOpenTimes(self, exchange: m.Exchange, pair: m.Pair, interval: m.Interval, periodStart: datetime,
+                       periodEnd: datetime) -> np.ndarray:
+        return self._getSeries(exchange, pair, interval).openTimes(util.toEpochMs(periodStart),
+                                                                    util.toEpochMs(periodEnd))
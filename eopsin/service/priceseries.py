@@ -0,0 +1,39 @@
+import math
+from datetime import datetime
+
+import numpy as np
+
+import eopsin.model as m
+import eopsin.util as util
+
+_MINUTE_MS = m.Interval.MINUTE_1.milliseconds()
+
+
+class PriceSeries:
+    '''
+    Close prices of 1 minute candles in a contiguous array indexed by the minute offset to the first candle, such that
+    the price at a given time is a single array lookup. Minutes without a candle hold nan.
+    '''
+    # minutes since the epoch of the first candle
+    start: int
+    closes: np.ndarray
+
+    def __init__(self, candles: np.ndarray):
+        ''' Takes ordered 1 minute candles of `CANDLE_DTYPE` '''
+        if len(candles) == 0:
+            self.start, self.closes = 0, np.zeros(0)
+            return
+        minutes = candles['openTime'] // _MINUTE_MS
+        self.start = int(minutes[0])
+        self.closes = np.full(int(minutes[-1]) - self.start + 1, np.nan)
+        self.closes[minutes - self.start] = candles['close']
+
+    def __len__(self):
+        return len(self.closes)
+
+    def getLastClose(self, date: datetime) -> float:
+        ''' Close of the last complete candle before the date, nan if it is not in the series '''
+        idx = util.toEpochMs(date) // _MINUTE_MS - 1 - self.start
+        if 0 <= idx < len(self.closes):
+            return float(self.closes[idx])
+        return math.nan
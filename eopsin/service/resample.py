@@ -0,0 +1,50 @@
+import numpy as np
+
+import eopsin.model as m
+
+# Weekly klines open on mondays, the epoch is a thursday
+_WEEK_OFFSET_MS = 4 * m.Interval.DAY_1.milliseconds()
+
+
+def canResample(source: m.Interval, target: m.Interval) -> bool:
+    return source.milliseconds() < target.milliseconds() and target.milliseconds() % source.milliseconds() == 0
+
+
+def getBucketOpenTimes(openTimes: np.ndarray, interval: m.Interval) -> np.ndarray:
+    ''' Floors the epoch openTimes (in ms) to the openTime of the enclosing candle of the given interval '''
+    step = interval.milliseconds()
+    offset = _WEEK_OFFSET_MS if interval is m.Interval.WEEK_1 else 0
+    return (openTimes - offset) // step * step + offset
+
+
+def resampleCandles(candles: np.ndarray, source: m.Interval, target: m.Interval) -> np.ndarray:
+    '''
+    Aggregates the ordered candles of the `source` interval (array of `CANDLE_DTYPE`) to candles of the coarser
+    `target` interval. Only target candles for which all source candles are given are returned.
+    '''
+    if not canResample(source, target):
+        raise ValueError(f'Cannot resample {source} candles to {target}')
+    if len(candles) == 0:
+        return np.zeros(0, dtype=m.CANDLE_DTYPE)
+
+    buckets = getBucketOpenTimes(candles['openTime'], target)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(candles)] - 1
+    complete = ends - starts + 1 == target.milliseconds() // source.milliseconds()
+
+    resampled = np.zeros(len(starts), dtype=m.CANDLE_DTYPE)
+    resampled['openTime'] = buckets[starts]
+    # keeps the closeTime convention of the source, e.g. the last millisecond of the period on binance
+    resampled['closeTime'] = candles['closeTime'][ends]
+    resampled['open'] = candles['open'][starts]
+    resampled['high'] = np.maximum.reduceat(candles['high'], starts)
+    resampled['low'] = np.minimum.reduceat(candles['low'], starts)
+    resampled['close'] = candles['close'][ends]
+    for name in ('volume', 'quoteAssetVolume', 'numberOfTrades', 'takerBuyBaseAssetVolume',
+                 'takerBuyQuoteAssetVolume'):
+        resampled[name] = np.add.reduceat(candles[name], starts)
+    # unset floats propagate as nan, the number of trades is unset if it is unset for any source candle
+    resampled['numberOfTrades'][np.minimum.reduceat(candles['numberOfTrades'], starts) == m.UNSET_TRADES] = \
+        m.UNSET_TRADES
+
+    return resampled[complete]
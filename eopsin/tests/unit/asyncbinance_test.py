@@ -0,0 +1,131 @@
+import asyncio
+import datetime
+import time
+import unittest
+
+import sqlalchemy as sql
+
+import eopsin as eop
+from eopsin.tests.unit.standins import AsyncTestCase, StandInServer, utcdate
+
+
+class TestAsyncBinanceHandler(AsyncTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.server = StandInServer(listedSince=utcdate(2021, 1, 5), latency=0.05)
+        client = eop.LimitedAsyncClient('key', 'secret')
+        client.limiter = eop.BinanceRateLimiter()
+        client.API_URL = await self.server.start()
+        engine = sql.create_engine("sqlite://", echo=False, future=True)
+        self.dbService = eop.DBService(engine)
+        self.handler = eop.AsyncBinanceHandler(self.dbService, client)
+        self.pair = self.dbService.getPair('BTC', 'USDT')
+
+    async def asyncTearDown(self) -> None:
+        await self.handler.close()
+        await self.server.stop()
+        self.dbService.removeSession()
+
+    def test_getHistoricalKlines(self):
+        candles = self.runAsync(self.handler.getHistoricalKlines(self.pair, eop.Interval.HOUR_1, utcdate(2021, 1, 3),
+                                                                 utcdate(2021, 1, 6)))
+        self.assertEqual(24, len(candles))
+        self.assertEqual(utcdate(2021, 1, 5), candles[0].openTime)
+        self.assertEqual(float(eop.toEpochMs(utcdate(2021, 1, 5)) // 60000 % 1000), candles[0].close)
+
+        nRequests = len(self.server.requests)
+        array = self.runAsync(self.handler.getHistoricalKlinesArray(self.pair, eop.Interval.HOUR_1, utcdate(2021, 1, 3),
+                                                                    utcdate(2021, 1, 6)))
+        self.assertEqual([candle.close for candle in candles], list(array['close']))
+        self.assertEqual(nRequests, len(self.server.requests), "Stored klines should not be requested again")
+
+    def test_parseKlines(self):
+        data = [[1612137600000 + idx * 60000, '1.5', '2.25', '0.125', '2.00000000', '10.1', 1612137659999 + idx * 60000,
+                 '15.3', 7, '4.4', '6.6', '0'] for idx in range(3)]
+        array = self.handler._getCandlesArrayFromData(data)
+        candles = [self.handler._getCandleFromData(self.pair, eop.Interval.MINUTE_1, row) for row in data]
+
+        self.assertEqual(eop.CANDLE_DTYPE, array.dtype)
+        self.assertEqual([eop.toEpochMs(candle.openTime) for candle in candles], list(array['openTime']))
+        self.assertEqual([eop.toEpochMs(candle.closeTime) for candle in candles], list(array['closeTime']))
+        for name in eop.CANDLE_DTYPE.names[2:]:
+            self.assertEqual([getattr(candle, name) for candle in candles], list(array[name]), name)
+        self.assertEqual((0,), self.handler._getCandlesArrayFromData([]).shape)
+
+    def test_concurrentChunks(self):
+        self.handler.pageSize = 12
+        self.handler.maxConcurrentRequests = 8
+        self.server.latency = 0.1
+        start = time.perf_counter()
+        candles = self.runAsync(self.handler.getHistoricalKlines(self.pair, eop.Interval.HOUR_1, utcdate(2021, 1, 5),
+                                                                 utcdate(2021, 1, 9)))
+        duration = time.perf_counter() - start
+
+        self.assertEqual(96, len(candles))
+        self.assertEqual(8, self.server.maxInFlight)
+        self.assertEqual(8, self.server.requests.count('/api/v3/klines'), "Each chunk should take a single request")
+        sequential = len(self.server.requests) * self.server.latency
+        self.assertLess(duration, sequential / 2, f'{len(self.server.requests)} requests took {duration:.2f} s')
+
+    def test_coalescing(self):
+        self.handler.fetchFlights = eop.SingleFlight()
+
+        async def fetchTwice():
+            return await asyncio.gather(*[
+                self.handler.getHistoricalKlinesArray(self.pair, eop.Interval.HOUR_1, utcdate(2021, 1, 5),
+                                                      utcdate(2021, 1, 7)) for _ in range(2)])
+
+        first, second = self.runAsync(fetchTwice())
+        self.assertEqual(48, len(first))
+        self.assertEqual(list(first['openTime']), list(second['openTime']))
+        self.assertEqual((1, 1), (self.handler.fetchFlights.flights, self.handler.fetchFlights.suppressed))
+        self.assertEqual(1, self.server.requests.count('/api/v3/klines'), "The page should be fetched once")
+
+    def test_clockSync(self):
+        serverTime = self.runAsync(self.handler.getTime())
+        self.assertAlmostEqual(utcdate(2021, 2, 1), serverTime, delta=datetime.timedelta(seconds=1))
+        self.assertEqual(self.handler.clock.samples, self.server.requests.count('/api/v3/time'))
+        self.assertGreaterEqual(self.handler.clock.roundTrip, self.server.latency)
+
+        time.sleep(0.1)
+        elapsed = self.runAsync(self.handler.getTime()) - serverTime
+        self.assertAlmostEqual(0.1, elapsed.total_seconds(), delta=0.03)
+        self.assertEqual(self.handler.clock.samples, self.server.requests.count('/api/v3/time'),
+                         "The time should be answered without a request")
+
+    def test_concurrentCalls(self):
+        order = eop.LimitOrder(pair=self.pair, side=eop.OrderSide.BUY, volume=0.1, price=30000.)
+
+        async def callConcurrently():
+            return await asyncio.gather(
+                self.handler.getHistoricalKlines(self.pair, eop.Interval.DAY_1, utcdate(2021, 1, 5),
+                                                 utcdate(2021, 1, 8)),
+                self.handler.placeOrder(order),
+                self.handler.getPortfolio(),
+                self.handler.getTime())
+
+        start = time.perf_counter()
+        candles, orderId, portfolio, serverTime = self.runAsync(callConcurrently())
+        duration = time.perf_counter() - start
+
+        self.assertEqual(3, len(candles))
+        self.assertEqual({'BTC': 0.5, 'USDT': 100.}, portfolio)
+        self.assertAlmostEqual(utcdate(2021, 2, 1), serverTime, delta=datetime.timedelta(seconds=1))
+        self.assertEqual({'symbol': 'BTCUSDT', 'side': 'BUY', 'type': 'LIMIT', 'quantity': '0.1', 'price': '30000'},
+                         {key: self.server.orders[orderId.id][key] for key in
+                          ('symbol', 'side', 'type', 'quantity', 'price')})
+        self.assertGreaterEqual(self.server.maxInFlight, 3)
+        self.assertLess(duration, len(self.server.requests) * self.server.latency)
+
+        self.assertEqual(eop.OrderStatus.FILLED, self.runAsync(self.handler.checkOrder(orderId)))
+
+    def test_cancelOrder(self):
+        order = eop.LimitOrder(pair=self.pair, side=eop.OrderSide.SELL, volume=0.1, price=40000.)
+        orderId = self.runAsync(self.handler.placeOrder(order))
+        self.runAsync(self.handler.cancelOrder(orderId))
+        self.assertEqual({orderId.id}, self.server.cancelled)
+        self.assertEqual(eop.OrderStatus.CANCELED, self.runAsync(self.handler.checkOrder(orderId)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import asyncio
+import time
+import unittest
+
+import binance.exceptions
+import sqlalchemy as sql
+
+import eopsin as eop
+from eopsin.tests.unit.standins import AsyncTestCase, StandInServer, utcdate
+
+
+class TestBinanceRateLimiter(unittest.TestCase):
+
+    def test_weights(self):
+        limiter = eop.BinanceRateLimiter()
+        self.assertEqual(0, limiter.acquire('get', '/api/v3/account'))
+        self.assertEqual(0, limiter.acquire('post', '/api/v3/order'))
+        self.assertAlmostEqual(6000 - 21, limiter.weight.tokens, delta=1)
+        self.assertAlmostEqual(99, limiter.orders.tokens, delta=0.1)
+        self.assertEqual(2, limiter.getMetrics()['requests'])
+
+    def test_update(self):
+        limiter = eop.BinanceRateLimiter()
+        limiter.update({'X-MBX-USED-WEIGHT-1M': '5900', 'X-MBX-ORDER-COUNT-10S': '100'})
+        self.assertEqual(5900, limiter.usedWeight)
+        self.assertLess(limiter.weight.tokens, 110)
+        self.assertGreater(limiter.getMetrics()['orderUtilization'], 0.9)
+
+    def test_reject(self):
+        limiter = eop.BinanceRateLimiter()
+        limiter.reject({'Retry-After': '0.1'})
+        start = time.perf_counter()
+        waited = limiter.acquire('get', '/api/v3/time')
+        self.assertGreaterEqual(time.perf_counter() - start, 0.09)
+        self.assertGreaterEqual(waited, 0.09)
+        self.assertEqual({'requests': 1, 'rejected': 1}, {key: limiter.getMetrics()[key] for key in
+                                                         ('requests', 'rejected')})
+
+
+class TestLimitedAsyncClient(AsyncTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.server = StandInServer(listedSince=utcdate(2021, 1, 5), latency=0.01)
+        self.client = eop.LimitedAsyncClient('key', 'secret')
+        self.client.limiter = eop.BinanceRateLimiter(weight=eop.TokenBucket(capacity=40, rate=400))
+        self.client.API_URL = await self.server.start()
+        engine = sql.create_engine("sqlite://", echo=False, future=True)
+        self.dbService = eop.DBService(engine)
+        self.handler = eop.AsyncBinanceHandler(self.dbService, self.client)
+
+    async def asyncTearDown(self) -> None:
+        await self.handler.close()
+        await self.server.stop()
+        self.dbService.removeSession()
+
+    def test_queueing(self):
+        async def getPortfolios():
+            return await asyncio.gather(*[self.handler.getPortfolio() for _ in range(6)])
+
+        # the account endpoint weighs 20, such that only two requests fit into the budget at once
+        self.runAsync(getPortfolios())
+        metrics = self.handler.getRateLimitMetrics()
+        self.assertEqual(6, metrics['requests'])
+        self.assertGreater(metrics['waited'], 0.1)
+
+    def test_usedWeight(self):
+        self.server.usedWeight = 35
+        self.runAsync(self.handler.getTime())
+        self.assertEqual(35, self.handler.getRateLimitMetrics()['usedWeight'])
+        self.assertLess(self.client.limiter.weight.tokens, 40 - 35 + 10)
+
+    def test_retryAfter(self):
+        self.server.rejections = [(429, 0.2)]
+        start = time.perf_counter()
+        self.assertEqual({'BTC': 0.5, 'USDT': 100.}, self.runAsync(self.handler.getPortfolio()))
+        self.assertGreaterEqual(time.perf_counter() - start, 0.2)
+        self.assertEqual(['/api/v3/account'] * 2, self.server.requests)
+        self.assertEqual(1, self.handler.getRateLimitMetrics()['rejected'])
+
+    def test_ban(self):
+        self.server.rejections = [(418, 0.1)]
+        with self.assertRaises(binance.exceptions.BinanceAPIException):
+            self.runAsync(self.handler.getPortfolio())
+        start = time.perf_counter()
+        self.runAsync(self.handler.getPortfolio())
+        self.assertGreaterEqual(time.perf_counter() - start, 0.05, "Requests should pause until the ban is lifted")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import datetime
+import unittest
+
+import numpy as np
+import sqlalchemy as sql
+
+import eopsin as eop
+
+getDatetime = lambda date: datetime.datetime.strptime(date, '%Y-%m-%d %H:%M:%S').replace(tzinfo=datetime.timezone.utc)
+
+
+class TestCandleCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        engine = sql.create_engine("sqlite://", echo=False, future=True)
+        self.cache = eop.CandleCache()
+        self.dbService = eop.DBService(engine, candleCache=self.cache)
+        self.binance = self.dbService.getExchange('Binance')
+        self.pair = self.dbService.getPair('BTC', 'USDT')
+        self.interval = eop.Interval.HOUR_1
+        self.begin = getDatetime('2021-01-01 00:00:00')
+        self.addCandles(range(48))
+
+    def addCandles(self, slots, pair: eop.Pair = None):
+        self.dbService.addCandles(
+            [eop.Candle(exchange=self.binance, pair=pair or self.pair, interval=self.interval,
+                        openTime=self.begin + idx * self.interval.timedelta(),
+                        closeTime=self.begin + (idx + 1) * self.interval.timedelta(),
+                        open=idx, high=idx, low=idx, close=idx, volume=idx, quoteAssetVolume=idx,
+                        numberOfTrades=idx, takerBuyBaseAssetVolume=idx, takerBuyQuoteAssetVolume=idx)
+             for idx in slots])
+
+    def find(self, begin: int, end: int, pair: eop.Pair = None) -> np.ndarray:
+        width = self.interval.timedelta()
+        return self.dbService.findCandlesArray(self.binance, pair or self.pair, self.interval,
+                                               self.begin + begin * width, self.begin + end * width)
+
+    def test_hitsAndMisses(self):
+        self.assertEqual(list(range(10, 20)), list(self.find(10, 20)['close']))
+        self.assertEqual((0, 1), (self.cache.hits, self.cache.misses))
+
+        self.assertEqual(list(range(12, 18)), list(self.find(12, 18)['close']))
+        self.assertEqual((1, 1), (self.cache.hits, self.cache.misses))
+
+        # Overlapping periods are merged into a single segment
+        self.assertEqual(list(range(15, 30)), list(self.find(15, 30)['close']))
+        self.assertEqual(list(range(10, 30)), list(self.find(10, 30)['close']))
+        self.assertEqual((2, 2), (self.cache.hits, self.cache.misses))
+        self.assertEqual(20 * eop.CANDLE_DTYPE.itemsize, self.cache.nBytes)
+
+    def test_returnsCopies(self):
+        self.find(0, 10)['close'] = -1
+        self.assertEqual(list(range(10)), list(self.find(0, 10)['close']))
+
+    def test_invalidation(self):
+        self.assertEqual(list(range(40, 48)), list(self.find(40, 50)['close']))
+        self.addCandles([48, 49])
+        self.assertEqual(list(range(40, 50)), list(self.find(40, 50)['close']))
+        self.assertEqual((0, 2), (self.cache.hits, self.cache.misses))
+
+    def test_missingPeriodsWithoutQueries(self):
+        self.dbService.addCoverage(self.binance, self.pair, self.interval, self.begin + 48 * self.interval.timedelta(),
+                                   self.begin + 50 * self.interval.timedelta())
+        getMissing = lambda: self.dbService.findMissingCandlePeriods(self.binance, self.pair, self.interval,
+                                                                     self.begin, getDatetime('2021-01-03 04:00:00'))
+        expected = [[getDatetime('2021-01-03 02:00:00'), getDatetime('2021-01-03 04:00:00')]]
+        self.assertEqual(expected, getMissing())
+
+        queries = []
+        sql.event.listen(self.dbService.engine, 'before_cursor_execute', lambda *args: queries.append(args))
+        self.assertEqual(expected, getMissing())
+        self.assertEqual([], queries, "Cached periods should not hit the db")
+
+    def test_eviction(self):
+        self.cache.maxBytes = 30 * eop.CANDLE_DTYPE.itemsize
+        otherPair = self.dbService.getPair('ETH', 'USDT')
+        self.addCandles(range(48), pair=otherPair)
+
+        self.find(0, 20)
+        self.find(0, 20, pair=otherPair)
+        self.assertEqual(1, self.cache.evictions, "The least recently used key should be evicted")
+        self.assertEqual(20 * eop.CANDLE_DTYPE.itemsize, self.cache.nBytes)
+
+        self.find(5, 10, pair=otherPair)
+        self.assertEqual((1, 2), (self.cache.hits, self.cache.misses))
+        self.assertEqual(list(range(0, 20)), list(self.find(0, 20)['close']))
+        self.assertEqual((1, 3), (self.cache.hits, self.cache.misses))
+        self.assertEqual(2, self.cache.evictions)
+
+        self.find(0, 40)
+        self.assertEqual(20 * eop.CANDLE_DTYPE.itemsize, self.cache.nBytes,
+                         "Periods exceeding the memory budget should not be cached")
+
+
+if __name__ == '__main__':
+    unittest.main()
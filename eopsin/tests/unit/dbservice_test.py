@@ -1,6 +1,10 @@
+import concurrent.futures
 import datetime
+import os
+import tempfile
 import unittest
 
+import numpy as np
 import sqlalchemy as sql
 
 import eopsin as eop
@@ -15,6 +19,9 @@ class TestDBService(unittest.TestCase):
         engine = sql.create_engine("sqlite://", echo=False, future=True)
         self.dbService = eop.DBService(engine)
 
+    def tearDown(self) -> None:
+        self.dbService.removeSession()
+
     def test_exchange(self):
         self.assertEqual(self.dbService.findExchange('Binance'), None, "DB should be empty")
         binance = self.dbService.addExchange('Binance')
@@ -23,6 +30,28 @@ class TestDBService(unittest.TestCase):
         self.assertEqual(binance.name, 'Binance')
         self.assertEqual(self.dbService.getExchange('Binance'), binance, "Binance should be in db")
 
+    def test_getPairs(self):
+        btc = self.dbService.getPair('BTC', 'USDT')
+        queries = []
+        sql.event.listen(self.dbService.engine, 'before_cursor_execute', lambda *args: queries.append(args))
+
+        self.assertIs(btc, self.dbService.getPair('BTC', 'USDT'))
+        self.assertEqual([], queries, "Known pairs should be served from the identity cache")
+
+        keys = [(f'COIN{idx}', 'USDT') for idx in range(500)] + [('BTC', 'USDT'), ('COIN0', 'USDT')]
+        pairs = self.dbService.getPairs(keys)
+        self.assertLessEqual(len(queries), 3, "Missing pairs should be looked up and added in bulk")
+        self.assertEqual(keys, [(pair.asset, pair.currency) for pair in pairs])
+        self.assertIs(btc, pairs[-2])
+        self.assertIs(pairs[0], pairs[-1])
+
+        # a new service finds the pairs with a single query
+        dbService = eop.DBService(self.dbService.engine)
+        queries.clear()
+        self.assertEqual([pair.id for pair in pairs], [pair.id for pair in dbService.getPairs(keys)])
+        self.assertEqual(1, len(queries))
+        self.assertEqual([None], dbService.findPairs([('ETH', 'BTC')]))
+
     def test_addCandleLocalTime(self):
         binance = self.dbService.addExchange('Binance')
         pair = self.dbService.getPair('BTC', 'USDT')
@@ -62,6 +91,99 @@ class TestDBService(unittest.TestCase):
         self.assertEqual(1, len(candles), "Should only find one candle")
         self.assertEqual(openTime2, candles[0].openTime, "Wrong candle found")
 
+    def test_findCandlesArray(self):
+        binance = self.dbService.addExchange('Binance')
+        pair = self.dbService.getPair('BTC', 'USDT')
+        interval = eop.Interval.HOUR_1
+        begin = getDatetime('2021-02-10 00:00:00')
+        self.dbService.addCandles(
+            [eop.Candle(exchange=binance, pair=pair, interval=interval,
+                        openTime=begin + idx * interval.timedelta(),
+                        closeTime=begin + (idx + 1) * interval.timedelta(),
+                        open=idx, high=idx + 2, low=idx - 1, close=idx + 1, volume=10 * idx, numberOfTrades=idx)
+             for idx in range(10)])
+        self.dbService.addCandle(
+            eop.Candle(exchange=binance, pair=pair, interval=interval,
+                       openTime=begin + 10 * interval.timedelta(), closeTime=begin + 11 * interval.timedelta()))
+
+        periodStart = begin + interval.timedelta()
+        periodEnd = begin + 11 * interval.timedelta()
+        candles = self.dbService.findCandles(binance, pair, interval, periodStart, periodEnd)
+        array = self.dbService.findCandlesArray(binance, pair, interval, periodStart, periodEnd)
+
+        self.assertEqual(eop.CANDLE_DTYPE, array.dtype)
+        self.assertEqual(len(candles), len(array))
+        self.assertEqual([eop.toEpochMs(candle.openTime) for candle in candles], list(array['openTime']))
+        self.assertEqual([eop.toEpochMs(candle.closeTime) for candle in candles], list(array['closeTime']))
+        self.assertEqual([candle.close for candle in candles[:-1]], list(array['close'][:-1]))
+        self.assertEqual([candle.numberOfTrades for candle in candles[:-1]], list(array['numberOfTrades'][:-1]))
+        self.assertTrue(np.isnan(array['close'][-1]), "Unset values should be nan")
+        self.assertEqual(eop.UNSET_TRADES, array['numberOfTrades'][-1])
+        self.assertEqual((None, None), (candles[-1].close, candles[-1].numberOfTrades),
+                         "Unset values should be None, also if served from the cache")
+
+        empty = self.dbService.findCandlesArray(binance, pair, eop.Interval.MINUTE_1, periodStart, periodEnd)
+        self.assertEqual((0,), empty.shape)
+        self.assertEqual(eop.CANDLE_DTYPE, empty.dtype)
+
+    def test_findCandlesArrayMilliseconds(self):
+        binance = self.dbService.addExchange('Binance')
+        pair = self.dbService.getPair('BTC', 'USDT')
+        interval = eop.Interval.MINUTE_1
+        begin, end = getDatetime('2000-01-01 00:00:00'), getDatetime('2100-01-01 00:00:00')
+        candles = np.zeros(1000, dtype=eop.CANDLE_DTYPE)
+        randomTimes = np.random.default_rng(3).integers(eop.toEpochMs(begin), eop.toEpochMs(end), len(candles))
+        candles['openTime'] = np.sort(randomTimes)
+        # binance klines close at the last millisecond of their period
+        candles['closeTime'] = candles['openTime'] + interval.milliseconds() - 1
+        self.dbService.addCandlesArray(binance, pair, interval, candles)
+
+        array = self.dbService.findCandlesArray(binance, pair, interval, begin, end + interval.timedelta())
+        self.assertEqual(list(candles['openTime']), list(array['openTime']))
+        self.assertEqual(list(candles['closeTime']), list(array['closeTime']))
+
+    def test_unsetValues(self):
+        binance = self.dbService.addExchange('Binance')
+        pair = self.dbService.getPair('BTC', 'USDT')
+        interval = eop.Interval.MINUTE_1
+        begin = getDatetime('2021-02-10 00:00:00')
+        candles = np.zeros(2, dtype=eop.CANDLE_DTYPE)
+        candles['openTime'] = eop.toEpochMs(begin) + np.arange(2) * interval.milliseconds()
+        candles['closeTime'] = candles['openTime'] + interval.milliseconds()
+        candles['volume'] = [np.nan, 1]
+        candles['numberOfTrades'] = [eop.UNSET_TRADES, 0]
+        self.dbService.addCandlesArray(binance, pair, interval, candles)
+
+        found = self.dbService.findCandles(binance, pair, interval, begin, begin + 2 * interval.timedelta())
+        self.assertEqual([(None, None), (1., 0)], [(candle.volume, candle.numberOfTrades) for candle in found])
+        array = self.dbService.findCandlesArray(binance, pair, interval, begin, begin + 2 * interval.timedelta())
+        self.assertEqual([eop.UNSET_TRADES, 0], list(array['numberOfTrades']))
+
+    def test_iterCandles(self):
+        binance = self.dbService.addExchange('Binance')
+        pair = self.dbService.getPair('BTC', 'USDT')
+        interval = eop.Interval.MINUTE_1
+        begin = getDatetime('2021-02-10 00:00:00')
+        # a gap in the middle, such that the chunks do not match fixed time windows
+        self.dbService.addCandles(
+            [eop.Candle(exchange=binance, pair=pair, interval=interval,
+                        openTime=begin + idx * interval.timedelta(),
+                        closeTime=begin + (idx + 1) * interval.timedelta(), close=idx)
+             for idx in list(range(25)) + list(range(40, 62))])
+
+        periodStart = begin + interval.timedelta()
+        periodEnd = begin + 61 * interval.timedelta()
+        expected = self.dbService.findCandlesArray(binance, pair, interval, periodStart, periodEnd)
+        chunks = list(self.dbService.iterCandlesArray(binance, pair, interval, periodStart, periodEnd, chunkSize=10))
+        self.assertTrue(all(len(chunk) <= 10 for chunk in chunks))
+        self.assertEqual(list(expected['openTime']), list(np.concatenate(chunks)['openTime']))
+
+        candles = list(self.dbService.iterCandles(binance, pair, interval, periodStart, periodEnd, chunkSize=7))
+        self.assertEqual(list(expected['close']), [candle.close for candle in candles])
+        self.assertEqual(periodStart, candles[0].openTime)
+        self.assertEqual([], list(self.dbService.iterCandles(binance, pair, eop.Interval.HOUR_1, periodStart,
+                                                             periodEnd)))
+
     def test_missingCandles(self):
         binance = self.dbService.addExchange('Binance')
         pair = self.dbService.getPair('BTC', 'USDT')
@@ -80,6 +202,63 @@ class TestDBService(unittest.TestCase):
         self.assertEqual([getDatetime('2021-01-04 00:00:00'), getDatetime('2021-01-06 00:00:00')], missingPeriods[1])
         self.assertEqual([getDatetime('2021-01-07 00:00:00'), getDatetime('2021-01-10 00:00:00')], missingPeriods[2])
 
+    def test_missingCandlesLongPeriod(self):
+        binance = self.dbService.addExchange('Binance')
+        pair = self.dbService.getPair('BTC', 'USDT')
+        interval = eop.Interval.MINUTE_1
+        begin = getDatetime('2021-01-01 00:00:00')
+        missingSlots = {0, 1, 500, 1438, 1439}
+        self.dbService.addCandles(
+            [eop.Candle(exchange=binance, pair=pair, interval=interval,
+                        openTime=begin + idx * interval.timedelta(),
+                        closeTime=begin + (idx + 1) * interval.timedelta())
+             for idx in range(24 * 60) if idx not in missingSlots])
+
+        missingPeriods = self.dbService.findMissingCandlePeriods(binance, pair, interval, begin,
+                                                                 getDatetime('2021-01-02 00:00:00'))
+        self.assertEqual([[begin, getDatetime('2021-01-01 00:02:00')],
+                          [getDatetime('2021-01-01 08:20:00'), getDatetime('2021-01-01 08:21:00')],
+                          [getDatetime('2021-01-01 23:58:00'), getDatetime('2021-01-02 00:00:00')]], missingPeriods)
+
+    def test_coverage(self):
+        binance = self.dbService.addExchange('Binance')
+        pair = self.dbService.getPair('BTC', 'USDT')
+        interval = eop.Interval.DAY_1
+        self.dbService.addCoverage(binance, pair, interval, getDatetime('2021-01-01 00:00:00'),
+                                   getDatetime('2021-01-03 00:00:00'))
+        self.dbService.addCoverage(binance, pair, interval, getDatetime('2021-01-05 00:00:00'),
+                                   getDatetime('2021-01-06 00:00:00'))
+        self.dbService.addCoverage(binance, pair, interval, getDatetime('2021-01-08 00:00:00'),
+                                   getDatetime('2021-01-09 00:00:00'))
+        self.dbService.addCoverage(binance, pair, eop.Interval.HOUR_1, getDatetime('2021-01-01 00:00:00'),
+                                   getDatetime('2021-01-20 00:00:00'))
+        # Merges with the first two and the adjacent third period
+        self.dbService.addCoverage(binance, pair, interval, getDatetime('2021-01-02 00:00:00'),
+                                   getDatetime('2021-01-08 00:00:00'))
+
+        coverage = self.dbService.findCoverage(binance, pair, interval, getDatetime('2020-01-01 00:00:00'),
+                                               getDatetime('2022-01-01 00:00:00'))
+        self.assertEqual([(getDatetime('2021-01-01 00:00:00'), getDatetime('2021-01-09 00:00:00'))], coverage)
+
+    def test_missingCandlesWithCoverage(self):
+        binance = self.dbService.addExchange('Binance')
+        pair = self.dbService.getPair('BTC', 'USDT')
+        interval = eop.Interval.DAY_1
+        self.dbService.addCandle(
+            eop.Candle(exchange=binance, pair=pair, interval=interval,
+                       openTime=getDatetime('2021-01-08 00:00:00'),
+                       closeTime=getDatetime('2021-01-09 00:00:00')))
+        # Known to be empty on the exchange
+        self.dbService.addCoverage(binance, pair, interval, getDatetime('2021-01-03 00:00:00'),
+                                   getDatetime('2021-01-05 12:00:00'))
+
+        missingPeriods = self.dbService.findMissingCandlePeriods(binance, pair, interval,
+                                                                 getDatetime('2021-01-01 00:00:00'),
+                                                                 getDatetime('2021-01-10 00:00:00'))
+        self.assertEqual([[getDatetime('2021-01-01 00:00:00'), getDatetime('2021-01-03 00:00:00')],
+                          [getDatetime('2021-01-05 00:00:00'), getDatetime('2021-01-08 00:00:00')],
+                          [getDatetime('2021-01-09 00:00:00'), getDatetime('2021-01-10 00:00:00')]], missingPeriods)
+
     def test_singleMissingCandle(self):
         binance = self.dbService.addExchange('Binance')
         pair = self.dbService.getPair('BTC', 'USDT')
@@ -123,6 +302,48 @@ class TestDBService(unittest.TestCase):
                                                                  closeTime)
         self.assertEqual([], missingPeriods, "the candle should no longer be missing after added.")
 
+    def test_addCandles(self):
+        binance = self.dbService.addExchange('Binance')
+        pair = self.dbService.getPair('BTC', 'USDT')
+        interval = eop.Interval.MINUTE_1
+        begin = getDatetime('2021-02-10 10:00:00')
+        getCandle = lambda idx: eop.Candle(exchange=binance, pair=pair, interval=interval,
+                                           openTime=begin + idx * interval.timedelta(),
+                                           closeTime=begin + (idx + 1) * interval.timedelta(),
+                                           open=idx, close=idx + 1)
+
+        inserted, skipped = self.dbService.addCandles([getCandle(idx) for idx in range(10)], batchSize=3)
+        self.assertEqual((10, 0), (inserted, skipped))
+
+        inserted, skipped = self.dbService.addCandles([getCandle(idx) for idx in range(5, 15)], batchSize=4)
+        self.assertEqual((5, 5), (inserted, skipped), "Already stored candles should be skipped")
+
+        candles = self.dbService.findCandles(binance, pair, interval, begin, begin + 15 * interval.timedelta())
+        self.assertEqual(15, len(candles))
+        self.assertEqual(list(range(15)), [candle.open for candle in candles])
+        self.assertEqual(begin, candles[0].openTime)
+
+    def test_addCandlesArray(self):
+        binance = self.dbService.addExchange('Binance')
+        pair = self.dbService.getPair('BTC', 'USDT')
+        interval = eop.Interval.MINUTE_1
+        begin = getDatetime('2021-02-10 10:00:00')
+        candles = np.zeros(10, dtype=eop.CANDLE_DTYPE)
+        candles['openTime'] = eop.toEpochMs(begin) + np.arange(10) * interval.milliseconds()
+        candles['closeTime'] = candles['openTime'] + interval.milliseconds()
+        candles['open'] = np.arange(10)
+
+        self.assertEqual((10, 0), self.dbService.addCandlesArray(binance, pair, interval, candles, batchSize=3))
+        self.assertEqual((0, 10), self.dbService.addCandlesArray(binance, pair, interval, candles),
+                         "Already stored candles should be skipped")
+
+        stored = self.dbService.findCandles(binance, pair, interval, begin, begin + 10 * interval.timedelta())
+        self.assertEqual([begin + idx * interval.timedelta() for idx in range(10)],
+                         [candle.openTime for candle in stored])
+        self.assertEqual(list(range(10)), [candle.open for candle in stored])
+        np.testing.assert_array_equal(candles, self.dbService.findCandlesArray(binance, pair, interval, begin,
+                                                                               begin + 10 * interval.timedelta()))
+
     def test_sameExchange(self):
         ''' Tests the behaviour for a second identical exchange entity '''
 
@@ -144,5 +365,228 @@ class TestDBService(unittest.TestCase):
         self.assertEqual(closeTime.astimezone(datetime.timezone.utc), candles[0].closeTime)
 
 
+class TestDBServiceClusteredLayout(TestDBService):
+
+    def setUp(self) -> None:
+        engine = sql.create_engine("sqlite://", echo=False, future=True)
+        self.dbService = eop.DBService(engine, candleLayout=eop.CandleLayout.CLUSTERED)
+
+    def test_layout(self):
+        self.assertEqual(eop.CandleLayout.CLUSTERED, self.dbService.getCandleLayout())
+
+
+class TestDBServiceCached(TestDBService):
+
+    def setUp(self) -> None:
+        engine = sql.create_engine("sqlite://", echo=False, future=True)
+        self.dbService = eop.DBService(engine, candleCache=eop.CandleCache())
+
+
+class TestDBServiceEpochTimestamps(TestDBService):
+
+    def setUp(self) -> None:
+        engine = sql.create_engine("sqlite://", echo=False, future=True)
+        self.dbService = eop.DBService(engine, timestampFormat=eop.TimestampFormat.EPOCH_MS)
+
+    def test_timestampFormat(self):
+        self.assertEqual(eop.TimestampFormat.EPOCH_MS, self.dbService.getTimestampFormat())
+        binance = self.dbService.getExchange('Binance')
+        pair = self.dbService.getPair('BTC', 'USDT')
+        openTime = getDatetime('2021-02-10 10:55:00')
+        self.dbService.addCandle(eop.Candle(exchange=binance, pair=pair, interval=eop.Interval.MINUTE_1,
+                                            openTime=openTime, closeTime=openTime + datetime.timedelta(minutes=1)))
+        with self.dbService.engine.connect() as connection:
+            self.assertEqual(eop.toEpochMs(openTime),
+                             connection.execute(sql.text('SELECT "openTime" FROM candle')).scalar())
+
+
+class TestDBServiceLayoutMigration(unittest.TestCase):
+
+    def test_migration(self):
+        engine = sql.create_engine("sqlite://", echo=False, future=True)
+        dbService = eop.DBService(engine)
+        self.assertEqual(eop.CandleLayout.ROWID, dbService.getCandleLayout())
+
+        binance = dbService.getExchange('Binance')
+        pair = dbService.getPair('BTC', 'USDT')
+        interval = eop.Interval.MINUTE_1
+        begin = getDatetime('2021-02-10 10:00:00')
+        dbService.addCandles([eop.Candle(exchange=binance, pair=pair, interval=interval,
+                                         openTime=begin + idx * interval.timedelta(),
+                                         closeTime=begin + (idx + 1) * interval.timedelta(),
+                                         open=idx, high=idx + 2, low=idx - 1, close=idx + 1, volume=1,
+                                         quoteAssetVolume=idx, numberOfTrades=idx, takerBuyBaseAssetVolume=0.5,
+                                         takerBuyQuoteAssetVolume=idx / 2)
+                              for idx in range(10)])
+        end = begin + 10 * interval.timedelta()
+        expected = dbService.findCandlesArray(binance, pair, interval, begin, end)
+
+        for layout in [eop.CandleLayout.CLUSTERED, eop.CandleLayout.ROWID]:
+            dbService = eop.DBService(engine, candleLayout=layout)
+            self.assertEqual(layout, dbService.getCandleLayout())
+            binance = dbService.getExchange('Binance')
+            pair = dbService.getPair('BTC', 'USDT')
+            np.testing.assert_array_equal(expected, dbService.findCandlesArray(binance, pair, interval, begin, end))
+            self.assertEqual((0, 10), dbService.addCandles(dbService.findCandles(binance, pair, interval, begin, end)),
+                             "The key constraint should be kept")
+
+        dbService = eop.DBService(engine)
+        self.assertEqual(eop.CandleLayout.ROWID, dbService.getCandleLayout(), "The layout should be kept by default")
+
+
+class TestDBServiceConcurrency(unittest.TestCase):
+    N_WRITERS = 4
+    N_READERS = 4
+    N_BATCHES = 20
+    BATCH_SIZE = 50
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.engine = sql.create_engine(f"sqlite:///{os.path.join(self.directory.name, 'test.sqlite')}", future=True)
+
+    def tearDown(self) -> None:
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def runConcurrently(self, dbService: eop.DBService):
+        interval = eop.Interval.MINUTE_1
+        begin = getDatetime('2021-02-10 00:00:00')
+        nCandles = self.N_BATCHES * self.BATCH_SIZE
+
+        def write(writer: int):
+            try:
+                exchange = dbService.getExchange('Binance')
+                pair = dbService.getPair('BTC', 'USDT')
+                # the writers insert overlapping batches in different orders
+                for batch in range(self.N_BATCHES):
+                    batch = (batch + writer * 3) % self.N_BATCHES
+                    start = begin + batch * self.BATCH_SIZE * interval.timedelta()
+                    dbService.addCandles([eop.Candle(exchange=exchange, pair=pair, interval=interval,
+                                                     openTime=start + idx * interval.timedelta(),
+                                                     closeTime=start + (idx + 1) * interval.timedelta(),
+                                                     close=batch)
+                                          for idx in range(self.BATCH_SIZE)])
+                    dbService.addCoverage(exchange, pair, interval, start,
+                                          start + self.BATCH_SIZE * interval.timedelta())
+            finally:
+                dbService.removeSession()
+
+        def read(reader: int):
+            try:
+                exchange = dbService.getExchange('Binance')
+                pair = dbService.getPair('BTC', 'USDT')
+                for _ in range(self.N_BATCHES):
+                    candles = dbService.findCandlesArray(exchange, pair, interval, begin,
+                                                         begin + nCandles * interval.timedelta())
+                    self.assertTrue(np.all(np.diff(candles['openTime']) > 0))
+                    dbService.findMissingCandlePeriods(exchange, pair, interval, begin,
+                                                       begin + nCandles * interval.timedelta())
+            finally:
+                dbService.removeSession()
+
+        with concurrent.futures.ThreadPoolExecutor(self.N_WRITERS + self.N_READERS) as executor:
+            futures = [executor.submit(write, idx) for idx in range(self.N_WRITERS)] + \
+                      [executor.submit(read, idx) for idx in range(self.N_READERS)]
+            for future in futures:
+                future.result()
+
+        exchange = dbService.getExchange('Binance')
+        pair = dbService.getPair('BTC', 'USDT')
+        end = begin + nCandles * interval.timedelta()
+        candles = dbService.findCandlesArray(exchange, pair, interval, begin, end)
+        self.assertEqual(nCandles, len(candles), "No candle should be lost")
+        self.assertEqual([], dbService.findMissingCandlePeriods(exchange, pair, interval, begin, end))
+        self.assertEqual([(begin, end)], dbService.findCoverage(exchange, pair, interval, begin, end))
+        self.assertEqual(1, len(dbService.session.query(eop.Pair).all()))
+        dbService.removeSession()
+
+    def test_concurrentReadWrite(self):
+        self.runConcurrently(eop.DBService(self.engine))
+
+    def test_concurrentReadWriteCached(self):
+        self.runConcurrently(eop.DBService(self.engine, candleCache=eop.CandleCache()))
+
+    def test_inMemoryThreads(self):
+        dbService = eop.DBService(sql.create_engine("sqlite://", echo=False, future=True))
+        self.addCleanup(dbService.removeSession)
+        pair = dbService.getPair('BTC', 'USDT')
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            self.assertIs(pair, executor.submit(dbService.getPair, 'BTC', 'USDT').result(), "Cached pairs are shared")
+            with self.assertRaises(RuntimeError):
+                executor.submit(dbService.getPair, 'ETH', 'USDT').result()
+
+    def test_walMode(self):
+        eop.DBService(self.engine).removeSession()
+        with self.engine.connect() as connection:
+            self.assertEqual('wal', connection.execute(sql.text('PRAGMA journal_mode')).scalar())
+
+
+class TestDBServiceTimestampMigration(unittest.TestCase):
+
+    def test_migration(self):
+        engine = sql.create_engine("sqlite://", echo=False, future=True)
+        dbService = eop.DBService(engine, candleLayout=eop.CandleLayout.CLUSTERED, candleCache=eop.CandleCache())
+        self.assertEqual(eop.TimestampFormat.DATETIME, dbService.getTimestampFormat())
+
+        binance = dbService.getExchange('Binance')
+        pair = dbService.getPair('BTC', 'USDT')
+        interval = eop.Interval.MINUTE_1
+        begin = getDatetime('2021-02-10 10:00:00') + datetime.timedelta(milliseconds=123)
+        dbService.addCandles([eop.Candle(exchange=binance, pair=pair, interval=interval,
+                                         openTime=begin + idx * interval.timedelta(),
+                                         closeTime=begin + (idx + 1) * interval.timedelta(),
+                                         open=idx, high=idx + 2, low=idx - 1, close=idx + 1, volume=1,
+                                         quoteAssetVolume=idx, numberOfTrades=idx, takerBuyBaseAssetVolume=0.5,
+                                         takerBuyQuoteAssetVolume=idx / 2)
+                              for idx in range(10)])
+        end = begin + 10 * interval.timedelta()
+        dbService.addCoverage(binance, pair, interval, begin, end)
+        expected = dbService.findCandlesArray(binance, pair, interval, begin, end)
+
+        for timestampFormat in [eop.TimestampFormat.EPOCH_MS, eop.TimestampFormat.DATETIME]:
+            dbService.migrateTimestampFormat(timestampFormat)
+            self.assertEqual(timestampFormat, dbService.getTimestampFormat())
+            self.assertEqual(eop.CandleLayout.CLUSTERED, dbService.getCandleLayout(), "The layout should be kept")
+            np.testing.assert_array_equal(expected, dbService.findCandlesArray(binance, pair, interval, begin, end))
+            candles = dbService.findCandles(binance, pair, interval, begin, end)
+            self.assertEqual([begin + idx * interval.timedelta() for idx in range(10)],
+                             [candle.openTime for candle in candles])
+            self.assertEqual([(begin, end)], dbService.findCoverage(binance, pair, interval, begin, end))
+            self.assertEqual((0, 10), dbService.addCandles(candles), "The key constraint should be kept")
+
+        dbService = eop.DBService(engine, timestampFormat=eop.TimestampFormat.EPOCH_MS)
+        dbService = eop.DBService(engine)
+        self.assertEqual(eop.TimestampFormat.EPOCH_MS, dbService.getTimestampFormat(),
+                         "The format should be kept by default")
+        np.testing.assert_array_equal(expected, dbService.findCandlesArray(binance, pair, interval, begin, end))
+
+    def test_formatsSideBySide(self):
+        engines = [sql.create_engine("sqlite://", echo=False, future=True) for _ in eop.TimestampFormat]
+        dbServices = [eop.DBService(engine, timestampFormat=timestampFormat)
+                      for engine, timestampFormat in zip(engines, eop.TimestampFormat)]
+        interval = eop.Interval.MINUTE_1
+        begin = getDatetime('2021-02-10 10:00:00')
+        end = begin + 3 * interval.timedelta()
+        for dbService in dbServices:
+            binance = dbService.getExchange('Binance')
+            pair = dbService.getPair('BTC', 'USDT')
+            dbService.addCandles([eop.Candle(exchange=binance, pair=pair, interval=interval,
+                                             openTime=begin + idx * interval.timedelta(),
+                                             closeTime=begin + (idx + 1) * interval.timedelta(), open=idx)
+                                  for idx in range(3)])
+            dbService.addCoverage(binance, pair, interval, begin, end)
+
+        for dbService, timestampFormat in zip(dbServices, eop.TimestampFormat):
+            self.assertEqual(timestampFormat, dbService.getTimestampFormat())
+            binance = dbService.getExchange('Binance')
+            pair = dbService.getPair('BTC', 'USDT')
+            candles = dbService.findCandles(binance, pair, interval, begin, end)
+            self.assertEqual([0, 1, 2], [candle.open for candle in candles])
+            self.assertEqual(begin, candles[0].openTime)
+            self.assertEqual([(begin, end)], dbService.findCoverage(binance, pair, interval, begin, end))
+        self.assertIs(eop.TimestampFormat.DATETIME, eop.Candle.__table__.c.openTime.type.timestampFormat,
+                      "The mapped models should not be bound to the format of a database")
+
+
 if __name__ == '__main__':
     unittest.main()
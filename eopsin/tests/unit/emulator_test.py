@@ -2,9 +2,11 @@ import datetime
 import os
 import unittest
 
+import numpy as np
 import sqlalchemy as sql
 
 import eopsin as eop
+from eopsin.tests.unit.standins import getCandlesArray
 
 
 def utcdate(*args):
@@ -29,9 +31,9 @@ class TestBinanceEmulator(unittest.TestCase):
         interval = eop.Interval.DAY_1
         begin = utcdate(2021, 5, 10, 10, 0, 00)
         end = utcdate(2021, 5, 10, 12, 0, 00)
-        self.assertEqual(self.binance._getHistoricalKlinesFromServer(pair, interval, begin, end),
-                         self.emulator._getHistoricalKlinesFromServer(pair, interval, begin, end),
-                         "_getHistoricalKlinesFromServer should be delegated to the underlying handler")
+        np.testing.assert_array_equal(self.binance._getHistoricalKlinesFromServer(pair, interval, begin, end),
+                                      self.emulator._getHistoricalKlinesFromServer(pair, interval, begin, end),
+                                      "_getHistoricalKlinesFromServer should be delegated to the underlying handler")
 
     def test_portfolio(self):
         self.assertEqual(100, self.emulator.getAssetBalance('BTC'))
@@ -99,5 +101,98 @@ class TestBinanceEmulatorBacktesting(unittest.TestCase):
             self.assertEqual(close, candle.close, f"Close value mismatch for candle {candle},\n{recorder.candles}")
 
 
+class TestEmulatorPrefetch(unittest.TestCase):
+
+    def setUp(self) -> None:
+        engine = sql.create_engine("sqlite://", echo=False, future=True)
+        self.dbService = eop.DBService(engine)
+        self.pair = self.dbService.getPair('BTC', 'USDT')
+        self.offline = eop.OfflineHandler(self.dbService)
+        self.dbService.addCandlesArray(self.offline.exchange, self.pair, eop.Interval.MINUTE_1,
+                                       getCandlesArray(eop.Interval.MINUTE_1, utcdate(2021, 1, 1), 3 * 60))
+
+    def tearDown(self) -> None:
+        self.dbService.removeSession()
+
+    def backtest(self, prefetchOnDemand: bool, klines=()) -> eop.ExchangeEmulator:
+        emulator = eop.ExchangeEmulator(self.offline, portfolio={'USDT': 10000.})
+        emulator.prefetchOnDemand = prefetchOnDemand
+        emulator.events[eop.Interval.MINUTE_15] += lambda: emulator.placeOrder(eop.MarketOrder.newBuy(self.pair, 1))
+        emulator.backtest(utcdate(2021, 1, 1, 0, 30), utcdate(2021, 1, 1, 2, 30), klines=klines)
+        return emulator
+
+    def test_prefetch(self):
+        queries = []
+        sql.event.listen(self.dbService.engine, 'before_cursor_execute', lambda *args: queries.append(args))
+        lazy = self.backtest(prefetchOnDemand=False)
+        lazyQueries = len(queries)
+
+        queries.clear()
+        prefetched = self.backtest(prefetchOnDemand=False, klines=[(self.pair, eop.Interval.MINUTE_1)])
+        self.assertEqual(lazy.getPortfolio(), prefetched.getPortfolio())
+        self.assertEqual({'USDT': 10000. - sum(range(145, 251, 15)), 'BTC': 8.}, prefetched.getPortfolio())
+        self.assertLess(len(queries), lazyQueries / 4, "The ticks should be served from memory")
+        self.assertEqual({'prefetch', 'simulation', 'klines'}, set(prefetched.backtestReport))
+        self.assertEqual(121, prefetched.backtestReport['klines'])
+
+        queries.clear()
+        onDemand = self.backtest(prefetchOnDemand=True)
+        self.assertEqual(lazy.getPortfolio(), onDemand.getPortfolio())
+        self.assertLess(len(queries), lazyQueries / 4, "The klines should be prefetched on their first request")
+
+    def test_prefetchedKlines(self):
+        emulator = eop.ExchangeEmulator(self.offline)
+        emulator.prefetch([(self.pair, eop.Interval.MINUTE_1)], utcdate(2021, 1, 1, 1), utcdate(2021, 1, 1, 2))
+        self.offline.getHistoricalKlinesArray = None
+        candles = emulator.getHistoricalKlinesArray(self.pair, eop.Interval.MINUTE_1, utcdate(2021, 1, 1, 1, 10),
+                                                    utcdate(2021, 1, 1, 1, 20))
+        self.assertEqual(list(range(171, 181)), list(candles['close']))
+        candle = emulator.getLastCompleteCandleBefore(self.pair, eop.Interval.MINUTE_1, utcdate(2021, 1, 1, 1, 0, 30))
+        self.assertEqual(utcdate(2021, 1, 1, 0, 59), candle.openTime)
+
+
+class TestEmulatorEvents(unittest.TestCase):
+
+    def setUp(self) -> None:
+        engine = sql.create_engine("sqlite://", echo=False, future=True)
+        self.dbService = eop.DBService(engine)
+        self.emulator = eop.ExchangeEmulator(eop.OfflineHandler(self.dbService))
+        self.fired = []
+        fireEvents = self.emulator._fireEvents
+        self.ticks = 0
+
+        def countedFireEvents(time):
+            self.ticks += 1
+            fireEvents(time)
+
+        self.emulator._fireEvents = countedFireEvents
+
+    def tearDown(self) -> None:
+        self.dbService.removeSession()
+
+    def test_sparseTicks(self):
+        self.emulator.events[eop.Interval.DAY_1] += lambda: self.fired.append(self.emulator.getTime())
+        self.emulator.backtest(utcdate(2021, 1, 1), utcdate(2021, 1, 11))
+        self.assertEqual([utcdate(2021, 1, day) for day in range(2, 12)], self.fired)
+        self.assertEqual(10, self.ticks, "Ticks without subscribed events should be skipped")
+
+    def test_backtestEnd(self):
+        self.emulator.events[eop.Interval.HOUR_4] += lambda: self.fired.append(self.emulator.getTime())
+        self.emulator.backtest(utcdate(2021, 1, 1, 1, 7), utcdate(2021, 1, 1, 10, 30),
+                               tickwidth=datetime.timedelta(minutes=15))
+        self.assertEqual([utcdate(2021, 1, 1, 4), utcdate(2021, 1, 1, 8)], self.fired)
+        self.assertEqual(utcdate(2021, 1, 1, 10, 30), self.emulator.getTime(),
+                         "The backtest should end at the same tick as when visiting every tick")
+
+    def test_eventLoop(self):
+        self.emulator.events[eop.Interval.DAY_1] += lambda: self.fired.append(self.emulator.getTime())
+        self.emulator._now = utcdate(2021, 1, 1)
+        self.emulator.eventLoop(datetime.timedelta(minutes=1),
+                                terminate=lambda: self.emulator.getTime() >= utcdate(2021, 1, 1, 0, 5))
+        self.assertEqual(utcdate(2021, 1, 1, 0, 5), self.emulator.getTime(),
+                         "Outside of backtests, the termination should be checked at every tick")
+        self.assertEqual((5, []), (self.ticks, self.fired))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,233 @@
+import datetime
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import sqlalchemy as sql
+
+import eopsin as eop
+from eopsin.tests.unit.standins import StubHandler
+
+
+def utcdate(*args):
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+
+class TestExchangeHandlerKlines(unittest.TestCase):
+
+    def setUp(self) -> None:
+        engine = sql.create_engine("sqlite://", echo=False, future=True)
+        self.dbService = eop.DBService(engine)
+        self.handler = StubHandler(self.dbService, listedSince=utcdate(2021, 1, 5))
+        self.pair = self.dbService.getPair('BTC', 'USDT')
+
+    def test_getKlines(self):
+        candles = self.handler.getHistoricalKlines(self.pair, eop.Interval.HOUR_1, utcdate(2021, 1, 6),
+                                                   utcdate(2021, 1, 7))
+        self.assertEqual(24, len(candles))
+        self.assertEqual(1, len(self.handler.requests))
+
+        array = self.handler.getHistoricalKlinesArray(self.pair, eop.Interval.HOUR_1, utcdate(2021, 1, 6),
+                                                      utcdate(2021, 1, 7))
+        self.assertEqual([candle.close for candle in candles], list(array['close']))
+        self.assertEqual(1, len(self.handler.requests), "Cached klines should not be fetched again")
+
+    def test_iterKlines(self):
+        candles = self.handler.iterHistoricalKlines(self.pair, eop.Interval.MINUTE_15, utcdate(2021, 1, 6),
+                                                    utcdate(2021, 1, 8), chunkSize=50)
+        self.assertEqual(1, len(self.handler.requests), "Missing klines should be fetched before iterating")
+        self.assertEqual(2 * 24 * 4, len(list(candles)))
+
+        chunks = list(self.handler.iterHistoricalKlinesArray(self.pair, eop.Interval.MINUTE_15, utcdate(2021, 1, 6),
+                                                             utcdate(2021, 1, 8), chunkSize=50))
+        self.assertEqual([50, 50, 50, 42], [len(chunk) for chunk in chunks])
+        self.assertEqual(1, len(self.handler.requests))
+
+    def test_resampledKlines(self):
+        minutes = self.handler.getHistoricalKlinesArray(self.pair, eop.Interval.MINUTE_1, utcdate(2021, 1, 6),
+                                                        utcdate(2021, 1, 6, 3))
+        self.assertEqual(1, len(self.handler.requests))
+
+        hours = self.handler.getHistoricalKlinesArray(self.pair, eop.Interval.HOUR_1, utcdate(2021, 1, 6),
+                                                      utcdate(2021, 1, 6, 4))
+        self.assertEqual(4, len(hours))
+        self.assertEqual(2, len(self.handler.requests), "Only the hour without stored minutes should be fetched")
+        self.assertEqual((utcdate(2021, 1, 6, 3), utcdate(2021, 1, 6, 4)), self.handler.requests[-1][2:])
+        self.assertEqual(list(minutes['open'][::60]), list(hours['open'][:3]))
+        self.assertEqual(list(minutes['close'][59::60]), list(hours['close'][:3]))
+        self.assertEqual([60] * 3, list(hours['volume'][:3]))
+        self.assertEqual(minutes['high'][:60].max(), hours['high'][0])
+
+        self.handler.resampleSources = ()
+        self.handler.getHistoricalKlinesArray(self.pair, eop.Interval.MINUTE_15, utcdate(2021, 1, 6),
+                                              utcdate(2021, 1, 6, 1))
+        self.assertEqual(3, len(self.handler.requests), "Resampling should be configurable")
+
+    def test_knownEmptyPeriod(self):
+        candles = self.handler.getHistoricalKlines(self.pair, eop.Interval.HOUR_1, utcdate(2021, 1, 3),
+                                                   utcdate(2021, 1, 5, 2))
+        self.assertEqual(2, len(candles), "Only the klines after listing should be found")
+        self.assertEqual(1, len(self.handler.requests))
+
+        candles = self.handler.getHistoricalKlines(self.pair, eop.Interval.HOUR_1, utcdate(2021, 1, 1),
+                                                   utcdate(2021, 1, 5, 2))
+        self.assertEqual(2, len(candles))
+        self.assertEqual(2, len(self.handler.requests))
+        self.assertEqual((utcdate(2021, 1, 1), utcdate(2021, 1, 3)), self.handler.requests[-1][2:],
+                         "Only the unknown period should be requested")
+
+
+class TestExchangeHandlerBackfill(unittest.TestCase):
+
+    def setUp(self) -> None:
+        engine = sql.create_engine("sqlite://", echo=False, future=True)
+        self.dbService = eop.DBService(engine)
+        self.pair = self.dbService.getPair('BTC', 'USDT')
+
+    def tearDown(self) -> None:
+        self.dbService.removeSession()
+
+    def backfill(self, workers: int, latency: float = 0, rateLimiter: eop.TokenBucket = None) -> StubHandler:
+        handler = StubHandler(self.dbService, listedSince=utcdate(2021, 1, 1), latency=latency)
+        handler.pageSize = 100
+        handler.backfillWorkers = workers
+        handler.rateLimiter = rateLimiter
+        candles = handler.getHistoricalKlinesArray(self.pair, eop.Interval.MINUTE_1, utcdate(2021, 1, 6),
+                                                   utcdate(2021, 1, 6, 8))
+        self.assertEqual(8 * 60, len(candles))
+        self.assertEqual(5, len(handler.requests), "Every page should be requested once")
+        self.assertTrue(all(end - start <= 100 * eop.Interval.MINUTE_1.timedelta()
+                            for _, _, start, end in handler.requests))
+        return handler
+
+    def test_parallelBackfill(self):
+        handler = self.backfill(workers=4)
+        self.assertEqual([(utcdate(2021, 1, 6), utcdate(2021, 1, 6, 8))],
+                         self.dbService.findCoverage(handler.exchange, self.pair, eop.Interval.MINUTE_1,
+                                                     utcdate(2021, 1, 6), utcdate(2021, 1, 7)))
+
+    def test_concurrentPages(self):
+        self.assertEqual(1, self.backfill(workers=1, latency=0.05).maxInFlight)
+
+        self.dbService.removeSession()
+        self.dbService = eop.DBService(sql.create_engine("sqlite://", echo=False, future=True))
+        self.pair = self.dbService.getPair('BTC', 'USDT')
+        self.assertEqual(5, self.backfill(workers=5, latency=0.05).maxInFlight, "Pages should be fetched concurrently")
+
+    def test_rateLimit(self):
+        rateLimiter = eop.TokenBucket(capacity=2, rate=20)
+        start = time.perf_counter()
+        self.backfill(workers=5, rateLimiter=rateLimiter)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.14, "Requests beyond the budget should wait")
+        self.assertGreater(rateLimiter.waited, 0)
+
+    def test_resume(self):
+        handler = StubHandler(self.dbService, listedSince=utcdate(2021, 1, 1))
+        handler.pageSize = 100
+        interval = eop.Interval.MINUTE_1
+        fetch = handler._getHistoricalKlinesFromServer
+
+        def interruptedFetch(*args):
+            if len(handler.requests) >= 2:
+                raise ConnectionError('Connection lost')
+            return fetch(*args)
+
+        handler._getHistoricalKlinesFromServer = interruptedFetch
+        with self.assertRaises(ConnectionError):
+            handler.backfillHistoricalKlines(self.pair, interval, utcdate(2021, 1, 6), utcdate(2021, 1, 6, 8))
+        self.assertEqual(utcdate(2021, 1, 6, 3, 20), handler.getBackfillWatermark(self.pair, interval,
+                                                                                 utcdate(2021, 1, 6)),
+                         "The pages stored before the interruption should be kept")
+
+        del handler._getHistoricalKlinesFromServer
+        self.assertEqual(utcdate(2021, 1, 6, 8), handler.backfillHistoricalKlines(self.pair, interval,
+                                                                                  utcdate(2021, 1, 6),
+                                                                                  utcdate(2021, 1, 6, 8)))
+        self.assertEqual(utcdate(2021, 1, 6, 3, 20), handler.requests[2][2], "The backfill should resume")
+        self.assertEqual(5, len(handler.requests))
+        self.assertEqual(utcdate(2021, 1, 5), handler.getBackfillWatermark(self.pair, interval, utcdate(2021, 1, 5)),
+                         "The watermark should not pass unknown klines")
+
+    def test_coalescing(self):
+        # the callers run in different threads, which share a file database
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        engine = sql.create_engine(f"sqlite:///{os.path.join(directory.name, 'test.sqlite')}", future=True)
+        self.addCleanup(engine.dispose)
+        dbService = eop.DBService(engine)
+        self.addCleanup(dbService.removeSession)
+        pair = dbService.getPair('BTC', 'USDT')
+
+        flights = eop.SingleFlight()
+        handlers = [StubHandler(dbService, listedSince=utcdate(2021, 1, 1), latency=0.1) for _ in range(2)]
+        for handler in handlers:
+            handler.pageSize = 24
+            handler.fetchFlights = flights
+
+        def fetchFirst():
+            handlers[0].getHistoricalKlines(pair, eop.Interval.HOUR_1, utcdate(2021, 1, 5), utcdate(2021, 1, 9))
+            dbService.removeSession()
+
+        first = threading.Thread(target=fetchFirst)
+        first.start()
+        time.sleep(0.02)
+        candles = handlers[1].getHistoricalKlines(pair, eop.Interval.HOUR_1, utcdate(2021, 1, 6), utcdate(2021, 1, 10))
+        first.join()
+
+        self.assertEqual(4 * 24, len(candles))
+        self.assertEqual(4, len(handlers[0].requests))
+        self.assertEqual([(utcdate(2021, 1, 9), utcdate(2021, 1, 10))],
+                         [request[2:] for request in handlers[1].requests],
+                         "Only the period not in flight should be fetched by the second caller")
+        self.assertEqual(5, flights.flights)
+        self.assertEqual(3, flights.suppressed)
+
+
+class TestExchangeHandlerEvents(unittest.TestCase):
+
+    def setUp(self) -> None:
+        engine = sql.create_engine("sqlite://", echo=False, future=True)
+        self.dbService = eop.DBService(engine)
+        self.handler = StubHandler(self.dbService, listedSince=utcdate(2021, 1, 1))
+        self.fired = []
+        for interval in [eop.Interval.MINUTE_15, eop.Interval.DAY_1, eop.Interval.WEEK_1]:
+            self.handler.events[interval] += lambda interval=interval: self.fired.append(interval)
+
+    def tearDown(self) -> None:
+        self.dbService.removeSession()
+
+    def test_fireEvents(self):
+        for tz in [datetime.timezone.utc, datetime.timezone(datetime.timedelta(hours=5, minutes=30)), None]:
+            begin = datetime.datetime(2021, 1, 1, tzinfo=tz)
+            for minutes in range(0, 15 * 24 * 60, 5):
+                time = begin + datetime.timedelta(minutes=minutes)
+                self.fired.clear()
+                self.handler._fireEvents(time)
+                self.assertEqual([interval for interval in self.handler._getSubscribedIntervals()
+                                  if eop.floorDatetime(time, interval.timedelta()) == time], self.fired, time)
+
+    def test_nextEventTime(self):
+        tick = datetime.timedelta(minutes=1)
+        self.assertEqual(utcdate(2021, 1, 1, 0, 15), self.handler._getNextEventTime(utcdate(2021, 1, 1), tick))
+        self.assertEqual(utcdate(2021, 1, 1, 0, 30), self.handler._getNextEventTime(utcdate(2021, 1, 1, 0, 17, 3),
+                                                                                    tick))
+
+        oddTick = datetime.timedelta(minutes=7)
+        time = eop.floorDatetime(utcdate(2021, 1, 1), oddTick) + oddTick
+        while eop.floorDatetime(time, eop.Interval.MINUTE_15.timedelta()) != time:
+            time += oddTick
+        self.assertEqual(time, self.handler._getNextEventTime(utcdate(2021, 1, 1), oddTick),
+                         "Events are only due at ticks")
+
+        self.handler.events[eop.Interval.MINUTE_15].targets.clear()
+        self.assertEqual(utcdate(2021, 1, 2), self.handler._getNextEventTime(utcdate(2021, 1, 1, 0, 17), tick))
+        for interval in [eop.Interval.DAY_1, eop.Interval.WEEK_1]:
+            self.handler.events[interval].targets.clear()
+        self.assertEqual(utcdate(2021, 1, 1, 0, 18), self.handler._getNextEventTime(utcdate(2021, 1, 1, 0, 17), tick),
+                         "Without subscribers, the next tick should be returned")
+
+
+if __name__ == '__main__':
+    unittest.main()
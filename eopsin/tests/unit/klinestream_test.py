@@ -0,0 +1,78 @@
+import asyncio
+import unittest
+from typing import List
+
+import sqlalchemy as sql
+
+import eopsin as eop
+from eopsin.tests.unit.standins import AsyncTestCase, StandInServer, StreamStandIn, klineMessage, utcdate
+
+
+class TestBinanceKlineStream(AsyncTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.server = StandInServer(listedSince=utcdate(2021, 1, 1), latency=0)
+        client = eop.LimitedAsyncClient('key', 'secret')
+        client.limiter = eop.BinanceRateLimiter()
+        client.API_URL = await self.server.start()
+        engine = sql.create_engine("sqlite://", echo=False, future=True)
+        self.dbService = eop.DBService(engine)
+        self.handler = eop.AsyncBinanceHandler(self.dbService, client)
+        self.btc = self.dbService.getPair('BTC', 'USDT')
+        self.eth = self.dbService.getPair('ETH', 'USDT')
+        self.interval = eop.Interval.MINUTE_1
+        self.events = []
+        self.handler.events[self.interval] += lambda: self.events.append(self.interval)
+
+    async def asyncTearDown(self) -> None:
+        await self.handler.close()
+        await self.server.stop()
+        self.dbService.removeSession()
+
+    def runStream(self, batches: List[List[dict]], nEvents: int) -> eop.BinanceKlineStream:
+        streamServer = StreamStandIn(batches)
+        stream = eop.BinanceKlineStream(self.handler, [(self.btc, self.interval), (self.eth, self.interval)])
+        stream.url = self.runAsync(streamServer.start())
+        stream.reconnectDelay = stream.pollInterval = 0.05
+        try:
+            self.runAsync(asyncio.wait_for(stream.run(terminate=lambda: len(self.events) >= nEvents), 5))
+        finally:
+            self.runAsync(streamServer.stop())
+        self.assertEqual(['/stream?streams=btcusdt@kline_1m/ethusdt@kline_1m'], streamServer.paths[:1])
+        return stream
+
+    def test_reconnect(self):
+        openTime = utcdate(2021, 1, 10)
+        later = openTime + 3 * self.interval.timedelta()
+        stream = self.runStream([
+            [klineMessage('BTCUSDT', self.interval, openTime, closed=False),
+             klineMessage('BTCUSDT', self.interval, openTime), klineMessage('ETHUSDT', self.interval, openTime)],
+            [klineMessage('BTCUSDT', self.interval, later), klineMessage('ETHUSDT', self.interval, later)],
+        ], nEvents=2)
+
+        self.assertEqual(2, len(self.events))
+        self.assertEqual(1, stream.reconnects)
+        self.assertEqual(2, stream.gaps, "The missed klines of both pairs should be filled")
+        candles = self.dbService.findCandles(self.handler.exchange, self.btc, self.interval, openTime,
+                                             later + self.interval.timedelta())
+        self.assertEqual([openTime + i * self.interval.timedelta() for i in range(4)],
+                         [candle.openTime for candle in candles])
+        self.assertEqual(2., candles[0].close)
+        self.assertIn('/api/v3/klines', self.server.requests)
+        self.assertEqual([], self.dbService.findMissingCandlePeriods(self.handler.exchange, self.eth, self.interval,
+                                                                     openTime, later))
+
+    def test_eventAfterAllPairs(self):
+        openTime = utcdate(2021, 1, 10)
+        later = openTime + self.interval.timedelta()
+        self.runStream([
+            [klineMessage('BTCUSDT', self.interval, openTime), klineMessage('BTCUSDT', self.interval, later),
+             klineMessage('ETHUSDT', self.interval, later)],
+        ], nEvents=1)
+
+        self.assertEqual(1, len(self.events))
+        self.assertEqual([], self.server.requests, "Streamed klines should not be requested")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import datetime
+import tempfile
+import unittest
+
+import numpy as np
+import sqlalchemy as sql
+
+import eopsin as eop
+from eopsin.tests.unit.standins import StubHandler
+
+
+def utcdate(*args):
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+
+def makeCandles(periodStart: datetime.datetime, interval: eop.Interval, n: int) -> np.ndarray:
+    candles = np.zeros(n, dtype=eop.CANDLE_DTYPE)
+    candles['openTime'] = eop.toEpochMs(periodStart) + np.arange(n) * interval.milliseconds()
+    candles['closeTime'] = candles['openTime'] + interval.milliseconds()
+    candles['close'] = np.arange(n)
+    candles['numberOfTrades'] = np.arange(n) * 2
+    return candles
+
+
+class TestMmapCandleStore(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        engine = sql.create_engine("sqlite://", echo=False, future=True)
+        self.dbService = eop.DBService(engine)
+        self.store = eop.MmapCandleStore(self.directory.name)
+        self.exchange = self.dbService.getExchange('Binance')
+        self.pair = self.dbService.getPair('BTC', 'USDT')
+        self.interval = eop.Interval.MINUTE_1
+
+    def tearDown(self) -> None:
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_roundtrip(self):
+        candles = makeCandles(utcdate(2021, 1, 1), self.interval, 100)
+        self.assertEqual((100, 0), self.store.addCandlesArray(self.exchange, self.pair, self.interval, candles))
+        self.assertEqual((0, 100), self.store.addCandlesArray(self.exchange, self.pair, self.interval, candles))
+
+        # A new store on the same directory reads the persisted files
+        store = eop.MmapCandleStore(self.directory.name)
+        found = store.findCandlesArray(self.exchange, self.pair, self.interval, utcdate(2021, 1, 1, 0, 10),
+                                       utcdate(2021, 1, 1, 0, 20))
+        np.testing.assert_array_equal(candles[10:20], found)
+
+        found = store.findCandles(self.exchange, self.pair, self.interval, utcdate(2021, 1, 1, 0, 10),
+                                  utcdate(2021, 1, 1, 0, 20))
+        self.assertEqual(10, len(found))
+        self.assertEqual(utcdate(2021, 1, 1, 0, 10), found[0].openTime)
+        self.assertEqual(10, found[0].close)
+        store.close()
+
+    def test_close(self):
+        candles = makeCandles(utcdate(2021, 1, 1), self.interval, 10)
+        self.store.addCandlesArray(self.exchange, self.pair, self.interval, candles[:5])
+        self.store.close()
+        self.store.addCandlesArray(self.exchange, self.pair, self.interval, candles[5:])
+        found = self.store.findCandlesArray(self.exchange, self.pair, self.interval, utcdate(2021, 1, 1),
+                                            utcdate(2021, 1, 2))
+        np.testing.assert_array_equal(candles, found)
+
+    def test_prepend(self):
+        self.store.addCandlesArray(self.exchange, self.pair, self.interval,
+                                   makeCandles(utcdate(2021, 1, 1, 1), self.interval, 10))
+        self.store.addCandlesArray(self.exchange, self.pair, self.interval,
+                                   makeCandles(utcdate(2021, 1, 1), self.interval, 10))
+
+        found = self.store.findCandlesArray(self.exchange, self.pair, self.interval, utcdate(2021, 1, 1),
+                                            utcdate(2021, 1, 1, 2))
+        self.assertEqual(20, len(found))
+        self.assertEqual(eop.toEpochMs(utcdate(2021, 1, 1, 1)), found['openTime'][10])
+        self.assertEqual([0, 9, 0, 9], list(found['close'][[0, 9, 10, 19]]))
+
+        missing = self.store.findMissingCandlePeriods(self.exchange, self.pair, self.interval, utcdate(2021, 1, 1),
+                                                      utcdate(2021, 1, 1, 2))
+        self.assertEqual([[utcdate(2021, 1, 1, 0, 10), utcdate(2021, 1, 1, 1)],
+                          [utcdate(2021, 1, 1, 1, 10), utcdate(2021, 1, 1, 2)]], missing)
+
+    def test_coverage(self):
+        self.store.addCandlesArray(self.exchange, self.pair, self.interval,
+                                   makeCandles(utcdate(2021, 1, 1, 1), self.interval, 10))
+        self.store.addCoverage(self.exchange, self.pair, self.interval, utcdate(2021, 1, 1), utcdate(2021, 1, 1, 1))
+        self.store.addCoverage(self.exchange, self.pair, self.interval, utcdate(2021, 1, 1, 1),
+                               utcdate(2021, 1, 1, 1, 10))
+
+        self.assertEqual([(utcdate(2021, 1, 1), utcdate(2021, 1, 1, 1, 10))],
+                         self.store.findCoverage(self.exchange, self.pair, self.interval, utcdate(2021, 1, 1),
+                                                 utcdate(2021, 1, 2)))
+        missing = self.store.findMissingCandlePeriods(self.exchange, self.pair, self.interval, utcdate(2021, 1, 1),
+                                                      utcdate(2021, 1, 1, 2))
+        self.assertEqual([[utcdate(2021, 1, 1, 1, 10), utcdate(2021, 1, 1, 2)]], missing)
+
+    def test_iterCandlesArray(self):
+        candles = makeCandles(utcdate(2021, 1, 1), self.interval, 100)
+        self.store.addCandlesArray(self.exchange, self.pair, self.interval, candles[candles['close'] % 7 != 3])
+        periodStart, periodEnd = utcdate(2021, 1, 1, 0, 0, 30), utcdate(2021, 1, 1, 1, 30)
+
+        chunks = list(self.store.iterCandlesArray(self.exchange, self.pair, self.interval, periodStart, periodEnd,
+                                                  chunkSize=16))
+        self.assertTrue(all(len(chunk) <= 16 for chunk in chunks))
+        np.testing.assert_array_equal(
+            self.store.findCandlesArray(self.exchange, self.pair, self.interval, periodStart, periodEnd),
+            np.concatenate(chunks))
+
+    def test_findCandleColumns(self):
+        candles = makeCandles(utcdate(2021, 1, 1), self.interval, 10)
+        self.store.addCandlesArray(self.exchange, self.pair, self.interval, candles[::2])
+
+        columns = self.store.findCandleColumns(self.exchange, self.pair, self.interval, utcdate(2021, 1, 1),
+                                               utcdate(2021, 1, 1, 0, 10))
+        self.assertEqual([1, 0] * 4 + [1], list(columns['present']))
+        self.assertEqual(list(candles['close'][::2]), list(columns['close'][columns['present'] != 0]))
+
+        self.store.addCandlesArray(self.exchange, self.pair, self.interval, candles[1:2])
+        self.assertEqual(1, columns['present'][1], "Columns should be views of the mapped files")
+
+    def test_misalignedCandles(self):
+        candles = makeCandles(utcdate(2021, 1, 1), self.interval, 10)
+        self.store.addCandlesArray(self.exchange, self.pair, self.interval, candles)
+        candles['openTime'] += 1
+        self.assertRaises(ValueError, self.store.addCandlesArray, self.exchange, self.pair, self.interval, candles)
+
+    def test_exchangeHandler(self):
+        handler = StubHandler(self.dbService, listedSince=utcdate(2021, 1, 5), candleStore=self.store)
+        candles = handler.getHistoricalKlines(self.pair, eop.Interval.HOUR_1, utcdate(2021, 1, 3),
+                                              utcdate(2021, 1, 6))
+        self.assertEqual(24, len(candles))
+        array = handler.getHistoricalKlinesArray(self.pair, eop.Interval.HOUR_1, utcdate(2021, 1, 1),
+                                                 utcdate(2021, 1, 6))
+        self.assertEqual([candle.close for candle in candles], list(array['close']))
+        self.assertEqual(2, len(handler.requests))
+        self.assertEqual(0, len(self.dbService.findCandles(handler.exchange, self.pair, eop.Interval.HOUR_1,
+                                                           utcdate(2021, 1, 1), utcdate(2021, 1, 6))))
+
+
+if __name__ == '__main__':
+    unittest.main()
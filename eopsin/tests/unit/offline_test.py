@@ -0,0 +1,63 @@
+import datetime
+import unittest
+
+import sqlalchemy as sql
+
+import eopsin as eop
+from eopsin.tests.unit.standins import getCandlesArray
+
+
+def utcdate(*args):
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+
+class TestOfflineHandler(unittest.TestCase):
+
+    def setUp(self) -> None:
+        engine = sql.create_engine("sqlite://", echo=False, future=True)
+        self.dbService = eop.DBService(engine)
+        self.pair = self.dbService.getPair('BTC', 'USDT')
+        self.handler = eop.OfflineHandler(self.dbService)
+        self.interval = eop.Interval.MINUTE_1
+        self.dbService.addCandlesArray(self.handler.exchange, self.pair, self.interval,
+                                       getCandlesArray(self.interval, utcdate(2021, 1, 1), 120))
+
+    def tearDown(self) -> None:
+        self.dbService.removeSession()
+
+    def test_storedKlines(self):
+        self.assertEqual('Binance', self.handler.exchange.name)
+        candles = self.handler.getHistoricalKlinesArray(self.pair, self.interval, utcdate(2021, 1, 1),
+                                                        utcdate(2021, 1, 1, 2))
+        self.assertEqual(120, len(candles))
+
+        hours = self.handler.getHistoricalKlines(self.pair, eop.Interval.HOUR_1, utcdate(2021, 1, 1),
+                                                 utcdate(2021, 1, 1, 2))
+        self.assertEqual([160., 220.], [candle.close for candle in hours], "Hours should be derived from minutes")
+
+    def test_failFast(self):
+        with self.assertRaises(eop.MissingKlinesError) as context:
+            self.handler.getHistoricalKlines(self.pair, self.interval, utcdate(2021, 1, 1, 1), utcdate(2021, 1, 1, 3))
+        self.assertEqual([(utcdate(2021, 1, 1, 2), utcdate(2021, 1, 1, 3))],
+                         [tuple(period) for period in context.exception.missingPeriods])
+        self.assertEqual([], self.dbService.findCoverage(self.handler.exchange, self.pair, self.interval,
+                                                         utcdate(2021, 1, 1), utcdate(2021, 1, 2)),
+                         "Gaps should not be recorded as known to be empty")
+
+    def test_allowGaps(self):
+        self.handler.allowGaps = True
+        candles = self.handler.getHistoricalKlinesArray(self.pair, self.interval, utcdate(2021, 1, 1, 1),
+                                                        utcdate(2021, 1, 1, 3))
+        self.assertEqual(60, len(candles))
+        self.assertIsNone(self.handler.getLastCompleteCandleBefore(self.pair, self.interval, utcdate(2021, 1, 1, 5)))
+
+    def test_emulator(self):
+        emulator = eop.ExchangeEmulator(self.handler, portfolio={'USDT': 1000.},
+                                        now=utcdate(2021, 1, 1, 0, 10, 30))
+        orderId = emulator.placeOrder(eop.MarketOrder.newBuy(self.pair, 2))
+        self.assertEqual(eop.OrderStatus.FILLED, emulator.checkOrder(orderId))
+        self.assertEqual({'USDT': 1000. - 2 * 110., 'BTC': 2.}, emulator.getPortfolio())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import datetime
+import math
+import unittest
+
+import numpy as np
+
+import eopsin as eop
+from eopsin.tests.unit.standins import getCandlesArray
+
+
+def utcdate(*args):
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+
+class TestPriceSeries(unittest.TestCase):
+
+    def test_lastClose(self):
+        candles = getCandlesArray(eop.Interval.MINUTE_1, utcdate(2021, 1, 1), 10)
+        prices = eop.PriceSeries(np.delete(candles, 5))
+        self.assertEqual(10, len(prices))
+        self.assertEqual(101., prices.getLastClose(utcdate(2021, 1, 1, 0, 1)))
+        self.assertEqual(103., prices.getLastClose(utcdate(2021, 1, 1, 0, 3, 59)), "Only complete candles count")
+        self.assertTrue(math.isnan(prices.getLastClose(utcdate(2021, 1, 1, 0, 6))), "Missing candles should be nan")
+        self.assertEqual(110., prices.getLastClose(utcdate(2021, 1, 1, 0, 10, 30)))
+        self.assertTrue(math.isnan(prices.getLastClose(utcdate(2021, 1, 1, 0, 11))))
+        self.assertTrue(math.isnan(prices.getLastClose(utcdate(2021, 1, 1))))
+
+    def test_empty(self):
+        prices = eop.PriceSeries(np.zeros(0, dtype=eop.CANDLE_DTYPE))
+        self.assertEqual(0, len(prices))
+        self.assertTrue(math.isnan(prices.getLastClose(utcdate(2021, 1, 1))))
+
+
+if __name__ == '__main__':
+    unittest.main()
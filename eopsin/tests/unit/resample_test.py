@@ -0,0 +1,73 @@
+import datetime
+import unittest
+
+import numpy as np
+
+import eopsin as eop
+
+
+def makeCandles(periodStart: datetime.datetime, interval: eop.Interval, n: int) -> np.ndarray:
+    candles = np.zeros(n, dtype=eop.CANDLE_DTYPE)
+    candles['openTime'] = eop.toEpochMs(periodStart) + np.arange(n) * interval.milliseconds()
+    candles['closeTime'] = candles['openTime'] + interval.milliseconds() - 1
+    candles['open'] = np.arange(n)
+    candles['close'] = np.arange(n) + 0.5
+    candles['high'] = np.arange(n) % 7 + 10
+    candles['low'] = -(np.arange(n) % 5)
+    candles['volume'] = 1
+    candles['numberOfTrades'] = 2
+    return candles
+
+
+class TestResample(unittest.TestCase):
+
+    def test_resample(self):
+        begin = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+        candles = makeCandles(begin, eop.Interval.MINUTE_5, 36)
+        resampled = eop.resampleCandles(candles, eop.Interval.MINUTE_5, eop.Interval.HOUR_1)
+
+        self.assertEqual(3, len(resampled))
+        self.assertEqual(list(candles['openTime'][::12]), list(resampled['openTime']))
+        self.assertEqual(list(candles['closeTime'][11::12]), list(resampled['closeTime']))
+        self.assertEqual([0, 12, 24], list(resampled['open']))
+        self.assertEqual([11.5, 23.5, 35.5], list(resampled['close']))
+        self.assertEqual([16, 16, 16], list(resampled['high']))
+        self.assertEqual([-4, -4, -4], list(resampled['low']))
+        self.assertEqual([12, 12, 12], list(resampled['volume']))
+        self.assertEqual([24, 24, 24], list(resampled['numberOfTrades']))
+
+    def test_incompleteBuckets(self):
+        begin = datetime.datetime(2021, 1, 1, 0, 50, tzinfo=datetime.timezone.utc)
+        candles = makeCandles(begin, eop.Interval.MINUTE_5, 30)
+        candles = np.delete(candles, 20)
+        resampled = eop.resampleCandles(candles, eop.Interval.MINUTE_5, eop.Interval.HOUR_1)
+        self.assertEqual([eop.toEpochMs(begin + datetime.timedelta(minutes=10))], list(resampled['openTime']),
+                         "Only the hour without missing candles should be derived")
+
+    def test_unsetValues(self):
+        begin = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+        candles = makeCandles(begin, eop.Interval.MINUTE_5, 24)
+        candles['volume'][3] = np.nan
+        candles['numberOfTrades'][3] = eop.UNSET_TRADES
+        resampled = eop.resampleCandles(candles, eop.Interval.MINUTE_5, eop.Interval.HOUR_1)
+        self.assertTrue(np.isnan(resampled['volume'][0]))
+        self.assertEqual([eop.UNSET_TRADES, 24], list(resampled['numberOfTrades']))
+
+    def test_weeks(self):
+        begin = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+        candles = makeCandles(begin, eop.Interval.DAY_1, 21)
+        resampled = eop.resampleCandles(candles, eop.Interval.DAY_1, eop.Interval.WEEK_1)
+        self.assertEqual([datetime.datetime(2021, 1, 4, tzinfo=datetime.timezone.utc),
+                          datetime.datetime(2021, 1, 11, tzinfo=datetime.timezone.utc)],
+                         [eop.fromEpochMs(openTime) for openTime in resampled['openTime']],
+                         "Weeks should start on mondays")
+
+    def test_invalidIntervals(self):
+        candles = np.zeros(0, dtype=eop.CANDLE_DTYPE)
+        self.assertRaises(ValueError, eop.resampleCandles, candles, eop.Interval.HOUR_1, eop.Interval.MINUTE_15)
+        self.assertRaises(ValueError, eop.resampleCandles, candles, eop.Interval.HOUR_1, eop.Interval.HOUR_1)
+        self.assertEqual(0, len(eop.resampleCandles(candles, eop.Interval.MINUTE_1, eop.Interval.DAY_1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,259 @@
+import asyncio
+import datetime
+import json
+import threading
+import time
+import unittest
+from typing import List
+
+import numpy as np
+import websockets
+from aiohttp import web
+
+import eopsin as eop
+
+
+def utcdate(*args):
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+
+def getCandlesArray(interval: eop.Interval, periodStart: datetime.datetime, count: int) -> np.ndarray:
+    candles = np.zeros(count, dtype=eop.CANDLE_DTYPE)
+    candles['openTime'] = eop.toEpochMs(periodStart) + np.arange(count) * interval.milliseconds()
+    candles['closeTime'] = candles['openTime'] + interval.milliseconds()
+    candles['open'] = candles['high'] = candles['low'] = 100 + np.arange(count)
+    candles['close'] = 101 + np.arange(count)
+    candles['volume'] = 1
+    return candles
+
+
+class AsyncTestCase(unittest.TestCase):
+    '''
+    Runs each test on an event loop of its own, like `unittest.IsolatedAsyncioTestCase` of python 3.8+. The test
+    methods run their coroutines on the loop by `runAsync`.
+    '''
+
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        # cleanups run in reverse order, also if the set up fails
+        self.addCleanup(self.loop.close)
+        self.addCleanup(asyncio.set_event_loop, None)
+        self.runAsync(self.asyncSetUp())
+
+    def tearDown(self) -> None:
+        self.runAsync(self.asyncTearDown())
+
+    async def asyncSetUp(self) -> None:
+        pass
+
+    async def asyncTearDown(self) -> None:
+        pass
+
+    def runAsync(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+
+class StubHandler(eop.ExchangeHandler):
+    '''
+    Serves synthetic klines for all slots since `listedSince` and records the server requests. Each request takes
+    `latency` seconds and the maximum number of requests in flight is recorded.
+    '''
+    name = 'Stub'
+
+    def __init__(self, dbservice: eop.DBService, listedSince: datetime.datetime, candleStore: eop.CandleStore = None,
+                 latency: float = 0):
+        super().__init__(dbservice, candleStore)
+        self.listedSince = listedSince
+        self.latency = latency
+        self.requests = []
+        self.inFlight = 0
+        self.maxInFlight = 0
+        self._inFlightLock = threading.Lock()
+
+    def _getHistoricalKlinesFromServer(self, pair: eop.Pair, interval: eop.Interval, periodStart: datetime.datetime,
+                                       periodEnd: datetime.datetime) -> List[eop.Candle]:
+        self.requests.append((pair, interval, periodStart, periodEnd))
+        with self._inFlightLock:
+            self.inFlight += 1
+            self.maxInFlight = max(self.maxInFlight, self.inFlight)
+        time.sleep(self.latency)
+        with self._inFlightLock:
+            self.inFlight -= 1
+        openTime = eop.ceilDatetime(max(periodStart, self.listedSince), interval.timedelta())
+        candles = []
+        while openTime + interval.timedelta() <= periodEnd:
+            close = float(eop.toEpochMs(openTime) // 60000 % 1000)
+            candles.append(eop.Candle(exchange=self.exchange, pair=pair, interval=interval, openTime=openTime,
+                                      closeTime=openTime + interval.timedelta(), open=close - 1, high=close + 1,
+                                      low=close - 2, close=close, volume=1, quoteAssetVolume=close,
+                                      numberOfTrades=1, takerBuyBaseAssetVolume=0.5,
+                                      takerBuyQuoteAssetVolume=close / 2))
+            openTime += interval.timedelta()
+        return candles
+
+    def getLastCompleteCandleBefore(self, pair: eop.Pair, interval: eop.Interval,
+                                    date: datetime.datetime) -> eop.Candle:
+        begin = eop.floorDatetime(date, interval.timedelta()) - interval.timedelta()
+        return self.getHistoricalKlines(pair, interval, begin, date)[0]
+
+    def getTime(self) -> datetime.datetime:
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    def getPortfolio(self):
+        return {}
+
+    def getAssetBalance(self, asset: str) -> float:
+        return 0
+
+    def placeOrder(self, order: eop.Order) -> eop.OrderId:
+        raise NotImplementedError
+
+    def checkOrder(self, orderId: eop.OrderId) -> eop.OrderStatus:
+        raise NotImplementedError
+
+    def cancelOrder(self, orderId: eop.OrderId) -> None:
+        raise NotImplementedError
+
+    def getAllOrders(self, pair: eop.Pair) -> List[eop.Order]:
+        return []
+
+    def getAllOpenOrders(self, pair: eop.Pair) -> List[eop.Order]:
+        return []
+
+
+class StandInServer:
+    '''
+    Local stand-in for the binance REST api, serving synthetic klines since `listedSince` and accepting all orders,
+    which are filled unless they are cancelled.
+    Each request takes `latency` seconds and the maximum number of requests in flight is recorded. Responses report
+    `usedWeight` and the next requests are rejected with the (status, retryAfter) pairs queued in `rejections`.
+    '''
+
+    def __init__(self, listedSince: datetime.datetime, latency: float):
+        self.listedSince = eop.toEpochMs(listedSince)
+        self.latency = latency
+        self.requests = []
+        self.orders = {}
+        self.cancelled = set()
+        self.inFlight = 0
+        self.maxInFlight = 0
+        self.usedWeight = 0
+        self.rejections = []
+        self.startedAt = time.monotonic()
+        self.app = web.Application(middlewares=[self._track])
+        self.app.router.add_get('/api/v3/ping', self._ping)
+        self.app.router.add_get('/api/v3/time', self._time)
+        self.app.router.add_get('/api/v3/klines', self._klines)
+        self.app.router.add_get('/api/v3/account', self._account)
+        self.app.router.add_post('/api/v3/order', self._placeOrder)
+        self.app.router.add_get('/api/v3/order', self._getOrder)
+        self.app.router.add_delete('/api/v3/order', self._cancelOrder)
+
+    async def start(self) -> str:
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = self.runner.addresses[0][:2]
+        return f'http://{host}:{port}/api'
+
+    async def stop(self) -> None:
+        await self.runner.cleanup()
+
+    @web.middleware
+    async def _track(self, request, handler):
+        self.requests.append(request.path)
+        self.inFlight += 1
+        self.maxInFlight = max(self.maxInFlight, self.inFlight)
+        try:
+            await asyncio.sleep(self.latency)
+            headers = {'X-MBX-USED-WEIGHT-1M': str(self.usedWeight)}
+            if self.rejections:
+                status, retryAfter = self.rejections.pop(0)
+                headers['Retry-After'] = str(retryAfter)
+                return web.json_response({'code': -1003, 'msg': 'Too many requests'}, status=status, headers=headers)
+            response = await handler(request)
+            response.headers.update(headers)
+            return response
+        finally:
+            self.inFlight -= 1
+
+    async def _ping(self, request):
+        return web.json_response({})
+
+    async def _time(self, request):
+        # the server clock starts at 2021-02-01
+        serverTime = eop.toEpochMs(utcdate(2021, 2, 1)) + int((time.monotonic() - self.startedAt) * 1000)
+        return web.json_response({'serverTime': serverTime})
+
+    async def _klines(self, request):
+        step = eop.Interval(request.query['interval']).milliseconds()
+        startTime = max(int(request.query['startTime']), self.listedSince)
+        openTime = -(-startTime // step) * step
+        endTime = int(request.query.get('endTime', eop.toEpochMs(utcdate(2021, 2, 1))))
+        klines = []
+        while openTime <= endTime and len(klines) < int(request.query['limit']):
+            close = openTime // 60000 % 1000
+            klines.append([openTime, f'{close - 1}', f'{close + 1}', f'{close - 2}', f'{close}', '1',
+                           openTime + step - 1, f'{close}', 1, '0.5', f'{close / 2}', '0'])
+            openTime += step
+        return web.json_response(klines)
+
+    async def _account(self, request):
+        return web.json_response({'balances': [{'asset': 'BTC', 'free': '0.5', 'locked': '0'},
+                                               {'asset': 'USDT', 'free': '100', 'locked': '0'}]})
+
+    async def _placeOrder(self, request):
+        data = await request.post()
+        orderId = len(self.orders) + 1
+        self.orders[orderId] = dict(data)
+        return web.json_response({'symbol': data['symbol'], 'orderId': orderId})
+
+    async def _getOrder(self, request):
+        orderId = int(request.query['orderId'])
+        return web.json_response({'symbol': request.query['symbol'], 'orderId': orderId,
+                                  'status': 'CANCELED' if orderId in self.cancelled else 'FILLED'})
+
+    async def _cancelOrder(self, request):
+        # the parameters are sent in the query or in the body, depending on the client
+        data = {**request.query, **await request.post()}
+        self.cancelled.add(int(data['orderId']))
+        return web.json_response({'symbol': data['symbol'], 'orderId': int(data['orderId']), 'status': 'CANCELED'})
+
+
+def klineMessage(symbol: str, interval: eop.Interval, openTime: datetime.datetime, closed: bool = True) -> dict:
+    openTime = eop.toEpochMs(openTime)
+    closeTime = openTime + interval.milliseconds() - 1
+    return {'stream': f'{symbol.lower()}@kline_{interval.value}',
+            'data': {'e': 'kline', 'E': closeTime, 's': symbol,
+                     'k': {'t': openTime, 'T': closeTime, 's': symbol, 'i': interval.value, 'o': '1', 'c': '2',
+                           'h': '3', 'l': '0.5', 'v': '10', 'n': 5, 'x': closed, 'q': '15', 'V': '4', 'Q': '6'}}}
+
+
+class StreamStandIn:
+    '''
+    Local stand-in for the binance kline streams. Each connection receives the next batch of messages and is closed
+    afterwards, except for the last one, which is kept open.
+    '''
+
+    def __init__(self, batches: List[List[dict]]):
+        self.batches = batches
+        self.paths = []
+
+    async def start(self) -> str:
+        self.server = await websockets.serve(self._handle, '127.0.0.1', 0)
+        host, port = list(self.server.sockets)[0].getsockname()[:2]
+        return f'ws://{host}:{port}/stream'
+
+    async def stop(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, connection, path: str = None):
+        # websockets 9 passes the request path, the handlers of later versions find it on the connection
+        self.paths.append(path if path is not None else connection.request.path)
+        for message in self.batches.pop(0):
+            await connection.send(json.dumps(message))
+        if not self.batches:
+            await connection.wait_closed()
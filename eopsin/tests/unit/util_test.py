@@ -1,3 +1,5 @@
+import asyncio
+import time
 import unittest
 from datetime import datetime, timedelta, timezone
 
@@ -56,5 +58,81 @@ class TestUtil(unittest.TestCase):
         self.assertEqual(datetime(2021, 10, 1, 0, 0, 0), floored(timedelta(days=1)))
 
 
+class TestTokenBucket(unittest.TestCase):
+
+    def test_acquire(self):
+        bucket = util.TokenBucket(capacity=10, rate=100)
+        self.assertEqual(0, bucket.acquire(10), "A full bucket should not wait")
+        start = time.perf_counter()
+        bucket.acquire(5)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.04)
+        self.assertGreater(bucket.waited, 0)
+        self.assertLess(bucket.tokens, 1)
+
+    def test_capacity(self):
+        bucket = util.TokenBucket(capacity=10, rate=100)
+        self.assertRaises(ValueError, bucket.acquire, 11)
+        time.sleep(0.05)
+        self.assertEqual(10, bucket.tokens, "Tokens should not exceed the capacity")
+
+    def test_acquireAsync(self):
+        bucket = util.TokenBucket(capacity=10, rate=100)
+
+        async def acquireConcurrently():
+            return await asyncio.gather(*[bucket.acquireAsync(5) for _ in range(4)])
+
+        waited = asyncio.run(acquireConcurrently())
+        self.assertEqual(2, waited.count(0), "Only the first two acquisitions should not wait")
+        self.assertGreater(bucket.waited, 0.1)
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_overlappingRanges(self):
+        flights = util.SingleFlight()
+        self.assertEqual([], flights.join('key', 0, 10), "The first caller should lead the flight")
+        self.assertEqual([], flights.join('key', 10, 20), "Adjacent ranges should not overlap")
+        self.assertEqual([], flights.join('other', 5, 15))
+        landed = flights.join('key', 5, 15)
+        self.assertEqual(2, len(landed))
+        self.assertEqual((3, 1), (flights.flights, flights.suppressed))
+
+        flights.land('key', 0, 10)
+        flights.land('key', 0, 10)
+        self.assertEqual([True, False], [event.is_set() for event in landed])
+        flights.land('key', 10, 20)
+        self.assertTrue(all(event.is_set() for event in landed))
+        self.assertEqual([], flights.join('key', 5, 15))
+
+
+class TestClockSync(unittest.TestCase):
+
+    def test_offset(self):
+        def getServerTime():
+            time.sleep(0.005)
+            serverTime = datetime.now(timezone.utc) + timedelta(hours=1)
+            time.sleep(0.005)
+            return serverTime
+
+        clock = util.ClockSync(resyncInterval=0.1)
+        self.assertTrue(clock.needsSync())
+        clock.sync(getServerTime)
+        self.assertFalse(clock.needsSync())
+        self.assertGreaterEqual(clock.roundTrip, 0.01)
+        self.assertLess(clock.jitter, 0.005)
+        self.assertAlmostEqual(3600, clock.getSystemOffset(), delta=0.005)
+        self.assertAlmostEqual(0, (clock.getTime() - datetime.now(timezone.utc) - timedelta(hours=1)).total_seconds(),
+                               delta=0.005)
+
+        time.sleep(0.1)
+        self.assertTrue(clock.needsSync(), "The clock should be synced again after the resync interval")
+
+    def test_drift(self):
+        clock = util.ClockSync()
+        clock.sync(lambda: datetime.now(timezone.utc))
+        clock._systemOffset -= 1
+        self.assertTrue(clock.needsSync(), "A jump of the system clock should be detected")
+
+
 if __name__ == '__main__':
     unittest.main()
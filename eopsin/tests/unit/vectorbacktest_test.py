@@ -0,0 +1,94 @@
+import datetime
+import unittest
+
+import numpy as np
+import sqlalchemy as sql
+
+import eopsin as eop
+
+
+def utcdate(*args):
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+
+def getMinuteCandles(periodStart: datetime.datetime, count: int) -> np.ndarray:
+    candles = np.zeros(count, dtype=eop.CANDLE_DTYPE)
+    candles['openTime'] = eop.toEpochMs(periodStart) + np.arange(count) * eop.Interval.MINUTE_1.milliseconds()
+    candles['closeTime'] = candles['openTime'] + eop.Interval.MINUTE_1.milliseconds() - 1
+    # a random walk, which stays positive
+    candles['close'] = 100 * np.exp(np.cumsum(np.random.default_rng(7).normal(0, 0.002, count)))
+    candles['open'] = np.r_[100, candles['close'][:-1]]
+    candles['high'] = np.maximum(candles['open'], candles['close'])
+    candles['low'] = np.minimum(candles['open'], candles['close'])
+    candles['volume'] = 1
+    return candles
+
+
+class TestVectorizedBacktest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        engine = sql.create_engine("sqlite://", echo=False, future=True)
+        self.dbService = eop.DBService(engine)
+        self.pair = self.dbService.getPair('BTC', 'USDT')
+
+    def tearDown(self) -> None:
+        self.dbService.removeSession()
+
+    def test_orders(self):
+        candles = getMinuteCandles(utcdate(2021, 1, 1), 4)
+        candles['close'] = [10., 20., 40., 20.]
+        backtest = eop.VectorizedBacktest(self.pair, candles, {'USDT': 100.})
+        result = backtest.runOrders([2, 0, -1, -1])
+        self.assertEqual([2, 2, 1, 0], list(result.asset))
+        self.assertEqual([80, 80, 120, 140], list(result.currency))
+        self.assertEqual([100, 120, 160, 140], list(result.equity))
+        self.assertEqual({'BTC': 0., 'USDT': 140.}, result.getPortfolio())
+
+        with self.assertRaises(ValueError):
+            backtest.runOrders([2, 0, -3, 0])
+
+    def test_targets(self):
+        candles = getMinuteCandles(utcdate(2021, 1, 1), 4)
+        candles['close'] = [10., 20., 40., 20.]
+        result = eop.VectorizedBacktest(self.pair, candles, {'USDT': 100.}).runTargets([0.5, 1, 0, 0.5])
+        self.assertEqual([5, 7.5, 0, 7.5], list(result.asset))
+        self.assertEqual([50, 0, 300, 150], list(result.currency))
+        self.assertEqual([100, 150, 300, 300], list(result.equity))
+        self.assertEqual([5, 2.5, -7.5, 7.5], list(result.orders))
+
+    def test_emulatorParity(self):
+        interval = eop.Interval.MINUTE_15
+        minutes = getMinuteCandles(utcdate(2021, 1, 1), 24 * 60)
+        offline = eop.OfflineHandler(self.dbService)
+        self.dbService.addCandlesArray(offline.exchange, self.pair, eop.Interval.MINUTE_1, minutes)
+        candles = offline.getHistoricalKlinesArray(self.pair, interval, utcdate(2021, 1, 1), utcdate(2021, 1, 2))
+
+        # holds half of the portfolio in the asset while the price is above its moving average
+        average = np.convolve(candles['close'], np.ones(4) / 4)[:len(candles)]
+        targets = np.where(candles['close'] > average, 0.5, 0.)
+        result = eop.VectorizedBacktest(self.pair, candles, {'USDT': 1000.}).runTargets(targets)
+
+        emulator = eop.ExchangeEmulator(offline, portfolio={'USDT': 1000.})
+        equity = []
+
+        def onCandle():
+            idx = len(equity)
+            if result.orders[idx] > 0:
+                emulator.placeOrder(eop.MarketOrder.newBuy(self.pair, result.orders[idx]))
+            elif result.orders[idx] < 0:
+                emulator.placeOrder(eop.MarketOrder.newSell(self.pair, -result.orders[idx]))
+            portfolio = emulator.getPortfolio()
+            equity.append(portfolio.get('BTC', 0) * emulator.getCurrentCourse(self.pair) + portfolio['USDT'])
+
+        emulator.events[interval] += onCandle
+        emulator.backtest(utcdate(2021, 1, 1), utcdate(2021, 1, 2), tickwidth=interval.timedelta())
+
+        self.assertEqual(len(candles), len(equity))
+        self.assertGreater(np.count_nonzero(result.orders), 10)
+        np.testing.assert_allclose(result.equity, equity)
+        for asset, balance in result.getPortfolio().items():
+            self.assertAlmostEqual(balance, emulator.getAssetBalance(asset))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,2 +1,6 @@
 from .roundDatetime import *
-from .events import Events, EventsException
\ No newline at end of file
+from .epoch import toEpochMs, fromEpochMs
+from .events import Events, EventsException
+from .ratelimit import TokenBucket
+from .singleflight import SingleFlight
+from .clocksync import ClockSync
@@ -0,0 +1,84 @@
+import statistics
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, Tuple
+
+
+class ClockSync:
+    '''
+    Estimates the offset of a server clock NTP-style from a few time requests, such that the server time can be
+    answered locally from the monotonic clock. The sample with the shortest round trip bounds the error of the offset
+    best and is used, the spread of the sampled offsets is kept as jitter. The clock needs to be synced again after
+    `resyncInterval` seconds, or as soon as the system clock drifted from the monotonic clock by more than `maxDrift`
+    seconds, e.g. after a suspend or a time adjustment.
+    '''
+    samples: int
+    resyncInterval: float
+    maxDrift: float
+    # server time in epoch seconds minus the monotonic clock
+    offset: float
+    roundTrip: float
+    jitter: float
+    syncs: int
+
+    def __init__(self, samples: int = 4, resyncInterval: float = 600., maxDrift: float = 0.05):
+        self.samples = samples
+        self.resyncInterval = resyncInterval
+        self.maxDrift = maxDrift
+        self.offset = None
+        self.roundTrip = None
+        self.jitter = None
+        self.syncs = 0
+        self._syncedAt = None
+        self._systemOffset = None
+
+    def __repr__(self):
+        return f'ClockSync<offset={self.offset}, roundTrip={self.roundTrip}, jitter={self.jitter}>'
+
+    __str__ = __repr__
+
+    def needsSync(self) -> bool:
+        if self._syncedAt is None:
+            return True
+        now = time.monotonic()
+        if now - self._syncedAt > self.resyncInterval:
+            return True
+        return abs(time.time() - now - self._systemOffset) > self.maxDrift
+
+    @staticmethod
+    def _measure(before: float, serverTime: datetime, after: float) -> Tuple[float, float]:
+        # the server time is assumed to be taken halfway through the round trip
+        return serverTime.timestamp() - (before + after) / 2, after - before
+
+    def _update(self, measurements: List[Tuple[float, float]]) -> None:
+        offset, roundTrip = min(measurements, key=lambda measurement: measurement[1])
+        jitter = statistics.pstdev([offset for offset, _ in measurements])
+        now = time.monotonic()
+        self.offset, self.roundTrip, self.jitter = offset, roundTrip, jitter
+        self._syncedAt, self._systemOffset = now, time.time() - now
+        self.syncs += 1
+
+    def sync(self, getServerTime: Callable[[], datetime]) -> None:
+        measurements = []
+        for _ in range(self.samples):
+            before = time.monotonic()
+            serverTime = getServerTime()
+            measurements.append(self._measure(before, serverTime, time.monotonic()))
+        self._update(measurements)
+
+    async def syncAsync(self, getServerTime: Callable[[], Awaitable[datetime]]) -> None:
+        ''' Same as `sync` for a coroutine function requesting the server time '''
+        measurements = []
+        for _ in range(self.samples):
+            before = time.monotonic()
+            serverTime = await getServerTime()
+            measurements.append(self._measure(before, serverTime, time.monotonic()))
+        self._update(measurements)
+
+    def getTime(self) -> datetime:
+        ''' Estimated server time, requires the clock to be synced '''
+        return datetime.fromtimestamp(time.monotonic() + self.offset, tz=timezone.utc)
+
+    def getSystemOffset(self) -> float:
+        ''' Estimated offset of the server clock to the system clock in seconds '''
+        return self.offset + time.monotonic() - time.time()
@@ -0,0 +1,15 @@
+import datetime as dt
+
+EPOCH = dt.datetime(1970, 1, 1, tzinfo=dt.timezone.utc)
+_MILLISECOND = dt.timedelta(milliseconds=1)
+
+
+def toEpochMs(date: dt.datetime) -> int:
+    # naive datetimes are interpreted in local time, as done by the TimeStamp column type
+    if date.tzinfo is None:
+        date = date.astimezone()
+    return (date - EPOCH) // _MILLISECOND
+
+
+def fromEpochMs(timestamp: int) -> dt.datetime:
+    return EPOCH + dt.timedelta(milliseconds=int(timestamp))
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    '''
+    Thread-safe token bucket holding up to `capacity` tokens, which are refilled continuously at `rate` tokens per
+    second. Used to share a request weight budget between threads and handlers.
+    '''
+    capacity: float
+    rate: float
+    waited: float
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.waited = 0.
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'TokenBucket<capacity={self.capacity}, rate={self.rate}/s, tokens={self.tokens:.1f}>'
+
+    __str__ = __repr__
+
+    @property
+    def tokens(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def capTokens(self, tokens: float) -> None:
+        ''' Limits the available tokens, e.g. to the remaining budget reported by a server '''
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, tokens)
+
+    def _take(self, tokens: float, waited: float) -> float:
+        ''' Takes the tokens if available and returns 0, otherwise returns the time until they will be '''
+        if tokens > self.capacity:
+            raise ValueError(f'Cannot acquire {tokens} tokens from a bucket of capacity {self.capacity}')
+
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                self.waited += waited
+                return 0.
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1) -> float:
+        ''' Blocks until the tokens are available and takes them, returns the time waited in seconds '''
+        waited = 0.
+        delay = self._take(tokens, waited)
+        while delay > 0:
+            time.sleep(delay)
+            waited += delay
+            delay = self._take(tokens, waited)
+        return waited
+
+    async def acquireAsync(self, tokens: float = 1) -> float:
+        ''' Same as `acquire`, but waits without blocking the event loop '''
+        waited = 0.
+        delay = self._take(tokens, waited)
+        while delay > 0:
+            await asyncio.sleep(delay)
+            waited += delay
+            delay = self._take(tokens, waited)
+        return waited
@@ -0,0 +1,49 @@
+import threading
+from typing import Any, Dict, Hashable, List, Tuple
+
+
+class SingleFlight:
+    '''
+    Coalesces concurrent work on overlapping ranges of the same key across threads. A caller joining a range, which
+    does not overlap any range of the key in flight, leads the flight and has to `land` it once the work is done.
+    Callers of overlapping ranges wait for the landing of those flights instead of repeating the work.
+    '''
+    flights: int
+    suppressed: int
+
+    def __init__(self):
+        self.flights = 0
+        self.suppressed = 0
+        self._inFlight: Dict[Hashable, Dict[Tuple[Any, Any], threading.Event]] = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'SingleFlight<flights={self.flights}, suppressed={self.suppressed}>'
+
+    __str__ = __repr__
+
+    def join(self, key: Hashable, start, end) -> List[threading.Event]:
+        '''
+        Returns an empty list if the caller leads the flight of the range, otherwise the events set once the
+        overlapping flights have landed
+        '''
+        with self._lock:
+            ranges = self._inFlight.setdefault(key, {})
+            overlapping = [landed for (flightStart, flightEnd), landed in ranges.items()
+                           if flightStart < end and start < flightEnd]
+            if overlapping:
+                self.suppressed += 1
+            else:
+                ranges[(start, end)] = threading.Event()
+                self.flights += 1
+            return overlapping
+
+    def land(self, key: Hashable, start, end) -> None:
+        ''' Ends the flight of the range and releases the waiting callers, landing twice has no effect '''
+        with self._lock:
+            ranges = self._inFlight.get(key, {})
+            landed = ranges.pop((start, end), None)
+            if not ranges:
+                self._inFlight.pop(key, None)
+        if landed is not None:
+            landed.set()
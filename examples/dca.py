@@ -26,11 +26,15 @@ dbService = eop.DBService(engine)
 # To enusre DB consistency, we have to use the DB-service to get a given pair
 pair = dbService.getPair('BTC', 'USDT')
 
-# Get binance api token from the environment ...
-BINANCE_API_KEY = os.environ['BINANCE_TEST_API_KEY']
-BINANCE_API_SECRET = os.environ['BINANCE_TEST_API_SECRET']
-# ... and set up the exchange handler
-binance = eop.BinanceHandler(dbService, BINANCE_API_KEY, BINANCE_API_SECRET, testnet=True)
+if 'BINANCE_TEST_API_KEY' in os.environ:
+    # Get binance api token from the environment ...
+    BINANCE_API_KEY = os.environ['BINANCE_TEST_API_KEY']
+    BINANCE_API_SECRET = os.environ['BINANCE_TEST_API_SECRET']
+    # ... and set up the exchange handler
+    binance = eop.BinanceHandler(dbService, BINANCE_API_KEY, BINANCE_API_SECRET, testnet=True)
+else:
+    # Without api token, the backtest runs on the klines already stored in the database
+    binance = eop.OfflineHandler(dbService, 'Binance')
 emulator = eop.ExchangeEmulator(binance, portfolio={'USDT': 100})
 
 